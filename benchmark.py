@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+from faidx import FastaIndex
+
+"""
+benchmark - synthetic-data benchmarks for snplrr.py, pileup2coverage.py,
+consnptor.py, seqsplitter.py and synteny_parse.py
+Inputs (reference, VCFs, mpileups, synteny/MAST tables, BLAST XML) are
+generated offline from a fixed seed per scale and reused between runs.
+Each tool is run as a separate process; wall time, CPU time, peak RSS
+(of the tool and its waited-for worker processes) and records/s are
+appended as JSON lines to a results file and can be compared against a
+stored baseline.
+"""
+
+BASES = 'ACGT'
+# random sequence is cut from a pool instead of drawn base by base
+SEQUENCE_POOL_SIZE = 1 << 20
+MIN_CONTIG_LENGTH = 200
+FASTA_LINE_WIDTH = 60
+
+# contigs: number of contigs, meanLength/lengthSigma: log-normal length
+# distribution, snpDensity: susP SNPs per bp, pileupFraction: share of
+# contigs covered by the mpileups, blastQueries: BLAST iterations
+SCALES = {
+    'tiny': dict(contigs=200, meanLength=2000, lengthSigma=0.8, snpDensity=0.01,
+                 pileupFraction=1.0, blastQueries=100),
+    'small': dict(contigs=2000, meanLength=4000, lengthSigma=0.8, snpDensity=0.005,
+                  pileupFraction=0.25, blastQueries=1000),
+    'medium': dict(contigs=20000, meanLength=4000, lengthSigma=0.8, snpDensity=0.005,
+                   pileupFraction=0.05, blastQueries=5000),
+    'large': dict(contigs=100000, meanLength=4000, lengthSigma=0.8, snpDensity=0.005,
+                  pileupFraction=0.02, blastQueries=20000),
+    # ~2 Gbp in 500k contigs
+    'assembly': dict(contigs=500000, meanLength=4000, lengthSigma=0.8, snpDensity=0.005,
+                     pileupFraction=0.01, blastQueries=100000),
+}
+DEFAULT_SCALES = ['tiny', 'small', 'medium']
+
+# genotype mix of the susceptible samples and of the control
+SUS_GENOTYPES = [('1/1', 0.7), ('0/1', 0.25), ('0/0', 0.05)]
+CONTROL_GENOTYPES = [('0/1', 0.6), ('1/1', 0.3), ('0/0', 0.1)]
+# share of susP SNPs also called in the bulk, control SNP density relative to susP
+BULK_SHARED = 0.9
+CONTROL_DENSITY = 0.25
+NON_PASS_FRACTION = 0.05
+MEAN_DEPTH = 20
+
+TOOLS = ['seqsplitter', 'consnptor', 'pileup2coverage', 'snplrr', 'synteny_parse']
+DATASET_MANIFEST = 'dataset.json'
+
+VCF_HEADER = '##fileformat=VCFv4.1\n' + \
+    '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n' + \
+    '##FORMAT=<ID=PL,Number=G,Type=Integer,Description="Phred-scaled genotype likelihoods">\n' + \
+    '##FORMAT=<ID=GQ,Number=1,Type=Integer,Description="Genotype quality">\n' + \
+    '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">\n' + \
+    '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t%s\n'
+
+
+def getContigLengths(rng, contigs, meanLength, lengthSigma):
+    """
+    Returns contig lengths drawn from a log-normal distribution with the
+    given mean.
+    """
+    mu = math.log(meanLength) - lengthSigma ** 2 / 2.0
+    return [max(MIN_CONTIG_LENGTH, int(rng.lognormvariate(mu, lengthSigma)))
+            for i in range(contigs)]
+
+
+def getSequence(rng, pool, length):
+    """
+    Returns a random sequence of length bp cut from pool.
+    """
+    parts = []
+    while length > 0:
+        n = min(length, len(pool) // 2)
+        start = rng.randrange(len(pool) - n + 1)
+        parts.append(pool[start:start + n])
+        length -= n
+    return ''.join(parts)
+
+
+def getWeighted(rng, choices):
+    x, acc = rng.random(), 0.0
+    for value, weight in choices:
+        acc += weight
+        if x < acc:
+            return value
+    return choices[-1][0]
+
+
+def getPositions(rng, length, density):
+    """
+    Returns sorted random positions (1-based) with the given density.
+    """
+    expected = length * density
+    k = min(length, int(expected) + (rng.random() < expected - int(expected)))
+    return sorted(rng.sample(range(1, length + 1), k))
+
+
+def formatVCFRecord(rng, contig, pos, seq, genotypes):
+    ref = seq[pos - 1]
+    alt = rng.choice([b for b in BASES if b != ref])
+    gt = getWeighted(rng, genotypes)
+    depth = rng.randint(3, 2 * MEAN_DEPTH)
+    status = 'PASS' if rng.random() >= NON_PASS_FRACTION else 'LowQual'
+    return '%s\t%i\t.\t%s\t%s\t%i\t%s\tDP=%i\tGT:PL:GQ:DP\t%s:0,0,0:99:%i\n' % \
+        (contig, pos, ref, alt, rng.randint(20, 225), status, depth, gt, depth)
+
+
+def writePileup(rng, out, contig, seq):
+    """
+    Writes a single-sample mpileup over all positions of a contig and
+    returns the number of lines.
+    """
+    lines = []
+    for i, base in enumerate(seq):
+        depth = max(0, int(rng.gauss(MEAN_DEPTH, MEAN_DEPTH / 3.0)))
+        lines.append('%s\t%i\t%s\t%i\t%s\t%s\n' % (contig, i + 1, base, depth,
+                                                   '.' * depth, 'I' * depth))
+    out.write(''.join(lines))
+    return len(lines)
+
+
+def writeBlastXML(rng, pool, fn, queries):
+    """
+    Writes a blastn XML report (NCBI BLAST 2.2.x layout) with one
+    iteration per query and returns the number of HSPs.
+    """
+    nhsps = 0
+    out = open(fn, 'w')
+    out.write('<?xml version="1.0"?>\n'
+              '<!DOCTYPE BlastOutput PUBLIC "-//NCBI//NCBI BlastOutput/EN" '
+              '"http://www.ncbi.nlm.nih.gov/dtd/NCBI_BlastOutput.dtd">\n'
+              '<BlastOutput>\n'
+              '  <BlastOutput_program>blastn</BlastOutput_program>\n'
+              '  <BlastOutput_version>BLASTN 2.2.28+</BlastOutput_version>\n'
+              '  <BlastOutput_reference>synthetic</BlastOutput_reference>\n'
+              '  <BlastOutput_db>Gmax</BlastOutput_db>\n'
+              '  <BlastOutput_query-ID>Query_1</BlastOutput_query-ID>\n'
+              '  <BlastOutput_query-def>%s</BlastOutput_query-def>\n'
+              '  <BlastOutput_query-len>%i</BlastOutput_query-len>\n'
+              '  <BlastOutput_param>\n    <Parameters>\n'
+              '      <Parameters_expect>10</Parameters_expect>\n'
+              '      <Parameters_sc-match>1</Parameters_sc-match>\n'
+              '      <Parameters_sc-mismatch>-2</Parameters_sc-mismatch>\n'
+              '      <Parameters_gap-open>0</Parameters_gap-open>\n'
+              '      <Parameters_gap-extend>0</Parameters_gap-extend>\n'
+              '      <Parameters_filter>L;m;</Parameters_filter>\n'
+              '    </Parameters>\n  </BlastOutput_param>\n'
+              '  <BlastOutput_iterations>\n' % (queries[0][0], queries[0][1]))
+    for n, (query, qlen) in enumerate(queries):
+        out.write('    <Iteration>\n'
+                  '      <Iteration_iter-num>%i</Iteration_iter-num>\n'
+                  '      <Iteration_query-ID>Query_%i</Iteration_query-ID>\n'
+                  '      <Iteration_query-def>%s</Iteration_query-def>\n'
+                  '      <Iteration_query-len>%i</Iteration_query-len>\n'
+                  '      <Iteration_hits>\n' % (n + 1, n + 1, query, qlen))
+        for h in range(rng.randint(0, 5)):
+            gene = 'Glyma.%02iG%06i' % (rng.randint(1, 20), rng.randint(0, 300000))
+            out.write('        <Hit>\n'
+                      '          <Hit_num>%i</Hit_num>\n'
+                      '          <Hit_id>gnl|BL_ORD_ID|%i</Hit_id>\n'
+                      '          <Hit_def>%s.1|PACid:%i</Hit_def>\n'
+                      '          <Hit_accession>%i</Hit_accession>\n'
+                      '          <Hit_len>%i</Hit_len>\n'
+                      '          <Hit_hsps>\n' % (h + 1, rng.randint(0, 1 << 20), gene,
+                                                 rng.randint(1, 1 << 25), h, rng.randint(500, 5000)))
+            for k in range(rng.randint(1, 3)):
+                alen = rng.randint(50, min(qlen, 1000))
+                qstart = rng.randint(1, qlen - alen + 1)
+                identities = int(alen * rng.uniform(0.6, 1.0))
+                qseq = getSequence(rng, pool, alen)
+                out.write('            <Hsp>\n'
+                          '              <Hsp_num>%i</Hsp_num>\n'
+                          '              <Hsp_bit-score>%.3f</Hsp_bit-score>\n'
+                          '              <Hsp_score>%i</Hsp_score>\n'
+                          '              <Hsp_evalue>%.3g</Hsp_evalue>\n'
+                          '              <Hsp_query-from>%i</Hsp_query-from>\n'
+                          '              <Hsp_query-to>%i</Hsp_query-to>\n'
+                          '              <Hsp_hit-from>%i</Hsp_hit-from>\n'
+                          '              <Hsp_hit-to>%i</Hsp_hit-to>\n'
+                          '              <Hsp_query-frame>1</Hsp_query-frame>\n'
+                          '              <Hsp_hit-frame>1</Hsp_hit-frame>\n'
+                          '              <Hsp_identity>%i</Hsp_identity>\n'
+                          '              <Hsp_positive>%i</Hsp_positive>\n'
+                          '              <Hsp_gaps>0</Hsp_gaps>\n'
+                          '              <Hsp_align-len>%i</Hsp_align-len>\n'
+                          '              <Hsp_qseq>%s</Hsp_qseq>\n'
+                          '              <Hsp_hseq>%s</Hsp_hseq>\n'
+                          '              <Hsp_midline>%s</Hsp_midline>\n'
+                          '            </Hsp>\n' %
+                          (k + 1, identities * 1.8, identities * 2, 10 ** -rng.uniform(0, 150),
+                           qstart, qstart + alen - 1, 1, alen, identities, identities, alen,
+                           qseq, qseq, '|' * alen))
+                nhsps += 1
+            out.write('          </Hit_hsps>\n        </Hit>\n')
+        out.write('      </Iteration_hits>\n'
+                  '      <Iteration_stat>\n        <Statistics>\n'
+                  '          <Statistics_db-num>88647</Statistics_db-num>\n'
+                  '          <Statistics_db-len>120000000</Statistics_db-len>\n'
+                  '          <Statistics_hsp-len>0</Statistics_hsp-len>\n'
+                  '          <Statistics_eff-space>0</Statistics_eff-space>\n'
+                  '          <Statistics_kappa>0.41</Statistics_kappa>\n'
+                  '          <Statistics_lambda>0.625</Statistics_lambda>\n'
+                  '          <Statistics_entropy>0.78</Statistics_entropy>\n'
+                  '        </Statistics>\n      </Iteration_stat>\n'
+                  '    </Iteration>\n')
+    out.write('  </BlastOutput_iterations>\n</BlastOutput>\n')
+    out.close()
+    return nhsps
+
+
+def generateDataset(outdir, scale, seed):
+    """
+    Writes the synthetic inputs of a scale to outdir and returns the
+    manifest with their record counts.
+    """
+    params = SCALES[scale]
+    rng = random.Random(seed)
+    pool = ''.join(rng.choice(BASES) for i in range(SEQUENCE_POOL_SIZE))
+    lengths = getContigLengths(rng, params['contigs'], params['meanLength'], params['lengthSigma'])
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    path = lambda fn: os.path.join(outdir, fn)
+    samples = ['ctrl', 'susP', 'susB']
+    fasta = open(path('ref.fa'), 'w')
+    vcfs = dict((s, open(path('%s.vcf' % s), 'w')) for s in samples)
+    pileups = dict((s, open(path('%s.mp' % s), 'w')) for s in samples)
+    for s in samples:
+        vcfs[s].write(VCF_HEADER % s)
+    counts = dict(('%s.vcf' % s, 0) for s in samples)
+    counts.update(('%s.mp' % s, 0) for s in samples)
+    synteny, mast = open(path('synteny.tsv'), 'w'), open(path('mast.tsv'), 'w')
+    mast.write('#sequence_name\tclass\tmotifs\tstart\tend\n')
+    density = params['snpDensity']
+    for i, length in enumerate(lengths):
+        contig = 'contig%06i' % (i + 1)
+        seq = getSequence(rng, pool, length)
+        fasta.write('>%s length=%i\n' % (contig, length))
+        fasta.write(''.join(seq[p:p + FASTA_LINE_WIDTH] + '\n'
+                            for p in range(0, length, FASTA_LINE_WIDTH)))
+        susP = getPositions(rng, length, density)
+        susB = sorted(set(p for p in susP if rng.random() < BULK_SHARED).union(
+            getPositions(rng, length, density * (1 - BULK_SHARED))))
+        ctrl = getPositions(rng, length, density * CONTROL_DENSITY)
+        for s, positions, genotypes in [('ctrl', ctrl, CONTROL_GENOTYPES),
+                                        ('susP', susP, SUS_GENOTYPES),
+                                        ('susB', susB, SUS_GENOTYPES)]:
+            vcfs[s].write(''.join(formatVCFRecord(rng, contig, pos, seq, genotypes)
+                                  for pos in positions))
+            counts['%s.vcf' % s] += len(positions)
+        if rng.random() < params['pileupFraction']:
+            for s in samples:
+                counts['%s.mp' % s] += writePileup(rng, pileups[s], contig, seq)
+        if rng.random() < 0.3:
+            synteny.write('%s\tGlyma.%02iG%06i\n' % (contig, rng.randint(1, 20), rng.randint(0, 300000)))
+        if rng.random() < 0.05:
+            start = rng.randint(1, length)
+            mast.write('%s\t%s\tNB-ARC,LRR\t%i\t%i\n' % (contig, rng.choice(['CNL', 'TNL', 'N/A']),
+                                                        start, min(length, start + 300)))
+    for handle in [fasta, synteny, mast] + list(vcfs.values()) + list(pileups.values()):
+        handle.close()
+    nqueries = min(params['blastQueries'], len(lengths))
+    queries = [('contig%06i' % (i + 1), lengths[i]) for i in range(nqueries)]
+    counts['blast.xml'] = nqueries
+    counts['blastHSPs'] = writeBlastXML(rng, pool, path('blast.xml'), queries)
+    counts['contigs'] = len(lengths)
+    counts['bases'] = sum(lengths)
+    # build the .fai so that no tool pays for it
+    FastaIndex(path('ref.fa')).close()
+    manifest = dict(scale=scale, seed=seed, params=params, counts=counts)
+    with open(path(DATASET_MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=1, sort_keys=True)
+    return manifest
+
+
+def getDataset(workdir, scale, seed, logfile=sys.stderr):
+    """
+    Returns (directory, manifest) of a scale, generating it if needed.
+    """
+    outdir = os.path.join(workdir, '%s-seed%i' % (scale, seed))
+    manifestFile = os.path.join(outdir, DATASET_MANIFEST)
+    if os.path.exists(manifestFile):
+        manifest = json.load(open(manifestFile))
+        if manifest.get('params') == SCALES[scale]:
+            return outdir, manifest
+    logfile.write('Generating %s dataset (seed %i)...' % (scale, seed))
+    logfile.flush()
+    tstamp = time.time()
+    manifest = generateDataset(outdir, scale, seed)
+    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+    return outdir, manifest
+
+
+def getToolCommand(tool, datadir, outdir, python):
+    """
+    Returns (command, unit) for benchmarking tool on a dataset; unit names
+    the manifest count(s) used as records.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    data = lambda fn: os.path.join(datadir, fn)
+    out = lambda fn: os.path.join(outdir, fn)
+    script = [python, os.path.join(here, '%s.py' % tool)]
+    if tool == 'seqsplitter':
+        return script + ['--input', data('ref.fa'), '--fragsize', '10000', '--overlap', '1000',
+                         '--output', out('fragments.fa')], 'bases'
+    if tool == 'consnptor':
+        return script + ['--reference', data('ref.fa'), '--vcf', data('susP.vcf'),
+                         '--flank', '250', '--out', out('flanks.fa')], 'susP.vcf'
+    if tool == 'pileup2coverage':
+        return script + ['--refcontigs', data('ref.fa'), '--pileup', data('susP.mp'),
+                         '--out', out('coverage.tsv'), '--logfile', out('pileup2coverage.log')], 'susP.mp'
+    if tool == 'snplrr':
+        return script + ['--refcontigs', data('ref.fa'),
+                         '--controlMP', data('ctrl.mp'), '--controlVCF', data('ctrl.vcf'),
+                         '--susP-vs-resMP', data('susP.mp'), '--susP-vs-resVCF', data('susP.vcf'),
+                         '--susBulk-vs-resMP', data('susB.mp'), '--susBulk-vs-resVCF', data('susB.vcf'),
+                         '--synteny-table', data('synteny.tsv'), '--mast-table', data('mast.tsv'),
+                         '--contig-summary', out('contigs.tsv'), '--snp-table', out('snps.tsv'),
+                         '--logfile', out('snplrr.log')], ['ctrl.vcf', 'susP.vcf', 'susB.vcf']
+    if tool == 'synteny_parse':
+        return script + [data('blast.xml'), out('hits.tsv')], 'blast.xml'
+    raise ValueError('Unknown tool %s.' % tool)
+
+
+def runTool(command, logfn):
+    """
+    Runs command and returns (returncode, wall, cpu, peak RSS in kB)
+    of the process and its waited-for children.
+    """
+    env = dict(os.environ)
+    # benchmark parsing, not the parse cache
+    env.pop('SNPLRR_CACHE_DIR', None)
+    log = open(logfn, 'w')
+    tstamp = time.time()
+    process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env)
+    pid, status, usage = os.wait4(process.pid, 0)
+    wall = time.time() - tstamp
+    log.close()
+    returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    # ru_maxrss: kB on Linux, bytes on macOS
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return returncode, wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss // scale
+
+
+def benchmark(tool, scale, datadir, manifest, outdir, python, repeat=1):
+    """
+    Returns the result record of the fastest of repeat runs of tool.
+    """
+    command, unit = getToolCommand(tool, datadir, outdir, python)
+    units = unit if isinstance(unit, list) else [unit]
+    records = sum(manifest['counts'][u] for u in units)
+    best = None
+    for i in range(repeat):
+        returncode, wall, cpu, rss = runTool(command, os.path.join(outdir, '%s.out' % tool))
+        if best is None or returncode or wall < best[1]:
+            best = (returncode, wall, cpu, rss)
+        if returncode:
+            break
+    returncode, wall, cpu, rss = best
+    return {'tool': tool, 'scale': scale, 'seed': manifest['seed'],
+            'returncode': returncode,
+            'wall_s': round(wall, 6), 'cpu_s': round(cpu, 6),
+            'peak_rss_kb': rss,
+            'records': records, 'unit': '+'.join(units),
+            'records_per_s': round(records / wall, 3) if wall > 0 and not returncode else None,
+            'input_bytes': sum(os.path.getsize(os.path.join(datadir, fn))
+                               for fn in os.listdir(datadir)),
+            'python': python, 'host': platform.node(),
+            'timestamp': round(time.time(), 3)}
+
+
+def readResults(fn):
+    """
+    Returns {(tool, scale): result} from a results file (last entry wins).
+    """
+    results = {}
+    for line in open(fn):
+        if line.strip():
+            result = json.loads(line)
+            results[(result['tool'], result['scale'])] = result
+    return results
+
+
+def compareResults(results, baseline, tolerance):
+    """
+    Returns [(tool, scale, metric, current, baseline, ratio)] of the
+    metrics that are worse than the baseline by more than tolerance.
+    """
+    regressions = []
+    for result in results:
+        base = baseline.get((result['tool'], result['scale']))
+        if base is None:
+            continue
+        if result['returncode'] and not base['returncode']:
+            regressions.append((result['tool'], result['scale'], 'returncode',
+                                result['returncode'], base['returncode'], None))
+            continue
+        for metric in ['wall_s', 'peak_rss_kb']:
+            current, previous = result[metric], base[metric]
+            if previous and current > previous * (1 + tolerance):
+                regressions.append((result['tool'], result['scale'], metric,
+                                    current, previous, current / float(previous)))
+    return regressions
+
+
+def main(argv):
+
+    descr = 'Benchmarks the snplrr tools on synthetic data.'
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument('--scales', default=','.join(DEFAULT_SCALES), help='Comma-separated scales (%s).' % ', '.join(sorted(SCALES)))
+    parser.add_argument('--tools', default=','.join(TOOLS), help='Comma-separated tools to benchmark.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the synthetic data.')
+    parser.add_argument('--workdir', default='benchmark_data', help='Directory for generated inputs and tool outputs.')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter that runs the tools.')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per tool and scale (the fastest counts).')
+    parser.add_argument('--results', default='benchmark_results.jsonl', help='Results file (JSON lines, appended).')
+    parser.add_argument('--baseline', help='Results file to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative slowdown/memory growth against the baseline.')
+    parser.add_argument('--generate-only', action='store_true', help='Only generate the synthetic inputs.')
+    args = parser.parse_args(argv)
+
+    scales = [s.strip() for s in args.scales.split(',') if s.strip()]
+    tools = [t.strip() for t in args.tools.split(',') if t.strip()]
+    for scale in scales:
+        if scale not in SCALES:
+            sys.stderr.write('Error: Unknown scale %s.\n' % scale)
+            sys.exit(1)
+    for tool in tools:
+        if tool not in TOOLS:
+            sys.stderr.write('Error: Unknown tool %s.\n' % tool)
+            sys.exit(1)
+
+    results = []
+    for scale in scales:
+        datadir, manifest = getDataset(args.workdir, scale, args.seed)
+        if args.generate_only:
+            continue
+        outdir = os.path.join(args.workdir, '%s-seed%i-out' % (scale, args.seed))
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        for tool in tools:
+            result = benchmark(tool, scale, datadir, manifest, outdir, args.python, repeat=args.repeat)
+            results.append(result)
+            with open(args.results, 'a') as out:
+                out.write(json.dumps(result, sort_keys=True) + '\n')
+            sys.stdout.write('%-16s %-9s %10.3fs %10ikB %14s records/s%s\n' %
+                             (tool, scale, result['wall_s'], result['peak_rss_kb'],
+                              '%.1f' % result['records_per_s'] if result['records_per_s'] is not None else 'NA',
+                              '' if not result['returncode'] else
+                              '  FAILED (%i, see %s)' % (result['returncode'],
+                                                         os.path.join(outdir, '%s.out' % tool))))
+            sys.stdout.flush()
+
+    if args.baseline and results:
+        regressions = compareResults(results, readResults(args.baseline), args.tolerance)
+        for tool, scale, metric, current, previous, ratio in regressions:
+            sys.stdout.write('REGRESSION %s %s %s: %s (baseline %s%s)\n' %
+                             (tool, scale, metric, current, previous,
+                              ', x%.2f' % ratio if ratio is not None else ''))
+        if regressions:
+            sys.exit(2)
+    pass
+
+
+if __name__ == '__main__': main(sys.argv[1:])
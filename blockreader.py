@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+import io
+import os
+import zlib
+import struct
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.pool
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import cStringIO
+except ImportError:
+    cStringIO = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+blockreader - read-ahead input layer for the line-oriented parsers
+Files are read in large blocks on a background thread that stays at most
+QUEUE_BLOCKS blocks ahead of the parser, so reads from (network) storage
+and decompression overlap with parsing. gzip and zstd streams are
+decompressed on the reader thread; BGZF files are read as batches of
+BGZF blocks that are decompressed in parallel on a pool of threads (zlib
+releases the GIL) and reassembled in file order. The parsers get
+line-aligned buffers (iterLineBuffers) or lines (iterLines).
+Compression detection (getCompression, isBGZF) and BGZF block header
+parsing are shared with the seeking readers in indexedio.
+"""
+
+READ_BLOCK_SIZE = 1 << 22
+# decompressed blocks read ahead of the parser
+QUEUE_BLOCKS = 4
+# BGZF blocks (<= 64 kB uncompressed each) per decompression task
+BGZF_BATCH_BLOCKS = 64
+DECOMPRESS_THREADS = 4
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_BGZF, COMPRESSION_ZSTD = 'none', 'gzip', 'bgzf', 'zstd'
+
+if bytes is str:
+    def _native(b):
+        return b
+    def _splitLines(buf):
+        return cStringIO.StringIO(buf)
+else:
+    def _native(b):
+        return b.decode()
+    def _splitLines(buf):
+        return io.StringIO(buf.decode(), newline=None)
+
+# decompression threads of this process (re-created after a fork)
+_pool, _poolPid = None, None
+_poolLock = threading.Lock()
+
+
+def _getPool():
+    global _pool, _poolPid
+    with _poolLock:
+        if _pool is None or _poolPid != os.getpid():
+            _pool = multiprocessing.pool.ThreadPool(getDecompressThreads())
+            _poolPid = os.getpid()
+    return _pool
+
+
+def getDecompressThreads():
+    """
+    Returns the number of threads decompressing BGZF batches (0: on the
+    reader thread, e.g. on a single CPU).
+    """
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    return min(DECOMPRESS_THREADS, cpus) if cpus > 1 else 0
+
+
+def getCompression(fn):
+    """
+    Returns the compression of fn (COMPRESSION_NONE/GZIP/BGZF/ZSTD).
+    """
+    with open(fn, 'rb') as handle:
+        header = handle.read(18)
+    if header[:4] == ZSTD_MAGIC:
+        return COMPRESSION_ZSTD
+    if header[:2] != GZIP_MAGIC:
+        return COMPRESSION_NONE
+    if len(header) == 18 and ord(header[3:4]) & 4 and header[12:14] == b'BC':
+        return COMPRESSION_BGZF
+    return COMPRESSION_GZIP
+
+
+def isBGZF(fn):
+    """
+    Returns True if fn starts with a BGZF block (gzip with a 'BC' extra field).
+    """
+    return getCompression(fn) == COMPRESSION_BGZF
+
+
+def _readBGZFHeader(handle):
+    """
+    Reads the header of the BGZF block at the handle position and returns
+    the size of its deflate data (None at end of file). The data and the
+    8 byte gzip trailer follow.
+    """
+    header = handle.read(12)
+    if len(header) < 12:
+        return None
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = handle.read(xlen)
+    bsize, p = None, 0
+    while p + 4 <= len(extra):
+        slen = struct.unpack('<H', extra[p + 2:p + 4])[0]
+        if extra[p:p + 2] == b'BC':
+            bsize = struct.unpack('<H', extra[p + 4:p + 6])[0]
+        p += 4 + slen
+    if bsize is None:
+        raise IOError('%s is not BGZF compressed.' % handle.name)
+    return bsize - xlen - 19
+
+
+def _iterPlainBlocks(handle, blockSize, start=0, end=None):
+    """
+    Returns generator over the blocks of the lines starting within bytes
+    [start, end) of an uncompressed file.
+    """
+    if start > 0:
+        # the line containing byte start - 1 belongs to the previous range
+        handle.seek(start - 1)
+        handle.readline()
+    offset = handle.tell()
+    if end is not None and offset >= end:
+        return
+    while True:
+        data = handle.read(blockSize)
+        if not data:
+            break
+        if end is not None and offset + len(data) >= end:
+            # the last line is the one containing byte end - 1
+            cut = data.find(b'\n', max(0, end - 1 - offset))
+            if cut != -1:
+                yield data[:cut + 1]
+                break
+        yield data
+        offset += len(data)
+    pass
+
+
+def _iterGzipBlocks(handle, blockSize):
+    """
+    Returns generator over the decompressed data of a (multi-member) gzip file.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        data = handle.read(blockSize)
+        if not data:
+            break
+        while data:
+            out = decompressor.decompress(data)
+            if out:
+                yield out
+            data = decompressor.unused_data
+            if data:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    out = decompressor.flush()
+    if out:
+        yield out
+    pass
+
+
+def _iterZstdBlocks(handle, blockSize):
+    if zstandard is None:
+        raise IOError('%s is zstd compressed: reading it needs the zstandard module.' % handle.name)
+    reader = zstandard.ZstdDecompressor().stream_reader(handle, read_across_frames=True)
+    while True:
+        data = reader.read(blockSize)
+        if not data:
+            break
+        yield data
+    pass
+
+
+def _iterBGZFBatches(handle, nblocks):
+    """
+    Returns generator over lists of the raw deflate data of nblocks
+    consecutive BGZF blocks.
+    """
+    batch = []
+    while True:
+        size = _readBGZFHeader(handle)
+        if size is None:
+            break
+        batch.append(handle.read(size))
+        handle.read(8)
+        if len(batch) == nblocks:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+    pass
+
+
+def _inflateBlocks(batch):
+    return b''.join([zlib.decompress(data, -15) for data in batch])
+
+
+class _Ready(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class _Failed(object):
+    def __init__(self, error):
+        self.error = error
+
+    def get(self):
+        raise self.error
+
+_END = object()
+
+
+class BlockReader(object):
+    """
+    Iterates over the (decompressed) data blocks of a file that are read
+    on a background thread; start/end restrict an uncompressed file to
+    the lines starting within that byte range.
+    """
+
+    def __init__(self, fn, blockSize=READ_BLOCK_SIZE, start=0, end=None,
+                 queueBlocks=QUEUE_BLOCKS):
+        self.fn, self.blockSize = fn, blockSize
+        self.start, self.end = start, end
+        self.compression = getCompression(fn)
+        if self.compression != COMPRESSION_NONE and (start or end is not None):
+            raise ValueError('%s is compressed: byte ranges cannot be read.' % fn)
+        self.threads = getDecompressThreads() if self.compression == COMPRESSION_BGZF else 0
+        self.queue = queue.Queue(max(queueBlocks, self.threads))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _iterItems(self, handle):
+        if self.compression == COMPRESSION_BGZF:
+            pool = _getPool() if self.threads else None
+            for batch in _iterBGZFBatches(handle, BGZF_BATCH_BLOCKS):
+                if pool is not None:
+                    yield pool.apply_async(_inflateBlocks, (batch,))
+                else:
+                    yield _Ready(_inflateBlocks(batch))
+            return
+        if self.compression == COMPRESSION_GZIP:
+            blocks = _iterGzipBlocks(handle, self.blockSize)
+        elif self.compression == COMPRESSION_ZSTD:
+            blocks = _iterZstdBlocks(handle, self.blockSize)
+        else:
+            blocks = _iterPlainBlocks(handle, self.blockSize, self.start, self.end)
+        for data in blocks:
+            yield _Ready(data)
+        pass
+
+    def _read(self):
+        try:
+            with open(self.fn, 'rb') as handle:
+                for item in self._iterItems(handle):
+                    if self.stopped.is_set():
+                        return
+                    self.queue.put(item)
+            self.queue.put(_END)
+        except Exception as e:
+            self.queue.put(_Failed(e))
+        pass
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _END:
+                    break
+                yield item.get()
+        finally:
+            self.close()
+        pass
+
+    def close(self):
+        """
+        Stops the reader thread (e.g. if the parser stops early).
+        """
+        self.stopped.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        pass
+
+
+def iterLineBuffers(fn, blockSize=READ_BLOCK_SIZE, start=0, end=None):
+    """
+    Returns generator over buffers (bytes) of complete lines of fn (gzip,
+    BGZF and zstd transparently), read ahead on a background thread. All
+    buffers end with a line break, except for the unterminated last line
+    of a file, which is a buffer of its own.
+    """
+    rest = b''
+    for block in BlockReader(fn, blockSize=blockSize, start=start, end=end):
+        cut = block.rfind(b'\n')
+        if cut == -1:
+            rest += block
+            continue
+        yield rest + block[:cut + 1] if rest else block[:cut + 1]
+        rest = block[cut + 1:]
+    if rest:
+        yield rest
+    pass
+
+
+def iterLines(fn, blockSize=READ_BLOCK_SIZE, start=0, end=None):
+    """
+    Returns iterator over the lines of fn, cf. iterLineBuffers.
+    """
+    return itertools.chain.from_iterable(_splitLines(buf) for buf in
+                                         iterLineBuffers(fn, blockSize=blockSize, start=start, end=end))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+import sys
+import json
+import math
+import struct
+from array import array
+
+"""
+columnar - compact self-describing columnar tables
+A table file starts with a magic string and a JSON header describing the
+columns (name, type, NA value), followed by blocks of rows stored column
+by column: fixed-width little-endian arrays for numbers, NUL-separated
+UTF-8 for strings. Every column chunk is prefixed with its size, so
+readers can skip columns they do not need. A zero-row block ends the file.
+Types: i8 (64bit int), f8 (double, NA = NaN), bool (one byte), str.
+
+    names, columns = readColumnar('snps.snpc')
+
+returns array/list columns that convert directly to dataframe columns;
+'python columnar.py table.snpc' prints a table as TSV, formatted like the
+snplrr.py TSV tables (floats with three decimals, booleans as YES/NO).
+"""
+
+MAGIC = b'SNPCOL\x01\n'
+FORMAT_VERSION = 1
+
+INT_TYPECODE = 'l' if array('l').itemsize >= 8 else 'q'
+TYPECODES = {'i8': INT_TYPECODE, 'f8': 'd', 'bool': 'B'}
+# stored in place of missing (None) values
+NA_VALUES = {'i8': -1, 'f8': float('nan'), 'bool': 0, 'str': 'NA'}
+
+BIG_ENDIAN = sys.byteorder == 'big'
+
+if hasattr(array, 'tobytes'):
+    def _tobytes(a):
+        return a.tobytes()
+    def _frombytes(a, b):
+        a.frombytes(b)
+else:
+    def _tobytes(a):
+        return a.tostring()
+    def _frombytes(a, b):
+        a.fromstring(b)
+
+if bytes is str:
+    def _encode(values):
+        return '\0'.join(values)
+    def _decode(data):
+        return data.split('\0')
+else:
+    def _encode(values):
+        return '\0'.join(values).encode('utf-8')
+    def _decode(data):
+        return data.decode('utf-8').split('\0')
+
+
+class ColumnarWriter(object):
+    """
+    Writes a table with the given column names and types to fn; rows are
+    passed as blocks of columns (lists or arrays of equal length, None
+    for missing values).
+    """
+
+    def __init__(self, fn, names, types):
+        if len(names) != len(types):
+            raise ValueError('Got %i column names but %i types.' % (len(names), len(types)))
+        for type_ in types:
+            if type_ not in NA_VALUES:
+                raise ValueError('Unknown column type %s.' % type_)
+        self.names, self.types = list(names), list(types)
+        self.out = open(fn, 'wb')
+        header = {'version': FORMAT_VERSION,
+                  'columns': [{'name': name, 'type': type_,
+                               'na': None if type_ in ('f8', 'bool') else NA_VALUES[type_]}
+                              for name, type_ in zip(names, types)]}
+        header = json.dumps(header, sort_keys=True).encode('utf-8')
+        self.out.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self.rows = 0
+
+    def writeBlock(self, columns):
+        if len(columns) != len(self.names):
+            raise ValueError('Got %i columns for a %i column table.' % (len(columns), len(self.names)))
+        nrows = len(columns[0]) if columns else 0
+        if not nrows:
+            return
+        chunks = [struct.pack('<I', nrows)]
+        for column, type_ in zip(columns, self.types):
+            if len(column) != nrows:
+                raise ValueError('Columns of a block must have the same length.')
+            if None in column:
+                na = NA_VALUES[type_]
+                column = [na if value is None else value for value in column]
+            if type_ == 'str':
+                data = _encode(column)
+            else:
+                values = array(TYPECODES[type_], column)
+                if BIG_ENDIAN:
+                    values.byteswap()
+                data = _tobytes(values)
+            chunks.append(struct.pack('<Q', len(data)))
+            chunks.append(data)
+        self.out.write(b''.join(chunks))
+        self.rows += nrows
+        pass
+
+    def close(self):
+        if self.out is not None:
+            self.out.write(struct.pack('<I', 0))
+            self.out.close()
+            self.out = None
+        pass
+
+
+def _readExactly(handle, n):
+    data = handle.read(n)
+    if len(data) != n:
+        raise IOError('%s is truncated.' % handle.name)
+    return data
+
+
+def readHeader(handle):
+    """
+    Returns the column descriptors [{'name', 'type', 'na'}] of an open table.
+    """
+    if handle.read(len(MAGIC)) != MAGIC:
+        raise IOError('%s is not a columnar table.' % handle.name)
+    size = struct.unpack('<I', _readExactly(handle, 4))[0]
+    header = json.loads(_readExactly(handle, size).decode('utf-8'))
+    if header['version'] > FORMAT_VERSION:
+        raise IOError('%s has unsupported format version %i.' % (handle.name, header['version']))
+    return header['columns']
+
+
+def iterBlocks(fn, columns=None):
+    """
+    Returns generator over blocks as {name: column} (array for numbers,
+    list for strings), restricted to the given column names if any.
+    """
+    handle = open(fn, 'rb')
+    descriptors = readHeader(handle)
+    wanted = set(columns) if columns is not None else None
+    while True:
+        nrows = struct.unpack('<I', _readExactly(handle, 4))[0]
+        if not nrows:
+            break
+        block = {}
+        for desc in descriptors:
+            size = struct.unpack('<Q', _readExactly(handle, 8))[0]
+            if wanted is not None and desc['name'] not in wanted:
+                handle.seek(size, 1)
+                continue
+            data = _readExactly(handle, size)
+            if desc['type'] == 'str':
+                block[desc['name']] = _decode(data)
+            else:
+                values = array(TYPECODES[desc['type']])
+                _frombytes(values, data)
+                if BIG_ENDIAN:
+                    values.byteswap()
+                block[desc['name']] = values
+        yield block
+    handle.close()
+    pass
+
+
+def readColumnar(fn, columns=None):
+    """
+    Returns (column names, {name: column}) of a whole table.
+    """
+    with open(fn, 'rb') as handle:
+        descriptors = readHeader(handle)
+    names = [desc['name'] for desc in descriptors
+             if columns is None or desc['name'] in columns]
+    types = dict((desc['name'], desc['type']) for desc in descriptors)
+    data = dict((name, [] if types[name] == 'str' else array(TYPECODES[types[name]]))
+                for name in names)
+    for block in iterBlocks(fn, columns=names):
+        for name in names:
+            data[name].extend(block[name])
+    return names, data
+
+
+def formatValue(value, type_, na):
+    # as in the TSV tables written by snplrr.py
+    if type_ == 'bool':
+        return 'YES' if value else 'NO'
+    if type_ == 'f8':
+        return 'NA' if math.isnan(value) else '%.3f' % value
+    if type_ == 'i8' and value == na:
+        return 'NA'
+    return str(value)
+
+
+def main(argv):
+    """
+    Prints a columnar table as TSV.
+    """
+    if not argv:
+        sys.stderr.write('Usage: columnar.py <table> [<column> ...]\n')
+        sys.exit(1)
+    with open(argv[0], 'rb') as handle:
+        descriptors = readHeader(handle)
+    if len(argv) > 1:
+        wanted = argv[1:]
+        descriptors = [d for d in descriptors if d['name'] in wanted]
+    names = [d['name'] for d in descriptors]
+    sys.stdout.write('\t'.join(names) + '\n')
+    for block in iterBlocks(argv[0], columns=names):
+        columns = [[formatValue(value, d['type'], d['na']) for value in block[d['name']]]
+                   for d in descriptors]
+        sys.stdout.write(''.join('\t'.join(row) + '\n' for row in zip(*columns)))
+    pass
+
+if __name__ == '__main__': main(sys.argv[1:])
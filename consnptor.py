@@ -8,17 +8,51 @@ except:
     sys.stderr.write('TESTEXIT.\n')
     sys.exit(0)
 
-from snplrr import readVCFQuick, anabl_getSeqsFromFASTA as getSequences
+from snplrr import readVCFQuick
+from faidx import FastaIndex
+from indexedio import getContigSelection
 
 """
 ConSNPtor - context SNP extractor
 Extracts sequence context around variant positions.
 """
 
+OUTPUT_BUFFER_SIZE = 1 << 20
+OUTPUT_BLOCK_RECORDS = 4096
+
 def iupac(b1, b2):
     dic = {('A', 'C'): 'M', ('A', 'G'): 'R', ('A', 'T'): 'W', ('C', 'G'): 'S', ('C', 'T'): 'Y', ('G', 'T'): 'K'}
     return dic.get(tuple(sorted([b1, b2])), 'N')
 
+def groupVariantsByContig(variants):
+    """
+    Returns dictionary {contig: [(pos, alt, ref), ...]} with positions sorted,
+    built in one pass over readVCFQuick-style ((contig, pos), data) records.
+    """
+    grouped = {}
+    for (contig, pos), data in variants:
+        grouped.setdefault(contig, {})[pos] = (data[1], data[2])
+    return dict((contig, [(pos,) + snps[pos] for pos in sorted(snps)])
+                for contig, snps in grouped.items())
+
+def extractFlanks(reference, variants, flank):
+    """
+    Returns generator over (header, sequence) of the SNP contexts.
+    Contigs are visited in reference order, SNPs in position order, and
+    only the 2 x flank + 1 window around each SNP is read from the reference.
+    """
+    for id_ in reference.names():
+        if id_ not in variants:
+            continue
+        length = reference.getLength(id_)
+        for pos, alt, ref in variants[id_]:
+            id_out = '%s:%i:[%s/%s]:%i-%i' % (id_, pos, alt, ref, max(1, pos - flank), min(length, pos + flank))
+            pos -= 1
+            start = max(0, pos - flank)
+            window = reference.fetch(id_, start, pos + flank + 1)
+            yield id_out, '%s%s%s' % (window[:pos - start], iupac(alt, ref), window[pos - start + 1:])
+    pass
+
 def main():
 
     descr = ''
@@ -27,29 +61,23 @@ def main():
     parser.add_argument('--vcf', help='Variant information in VCF format.')
     parser.add_argument('--flank', type=int, default=250, help='Size of flanking sequence context.')
     parser.add_argument('--out', help='Output in Fasta format.')
+    parser.add_argument('--regions', help='Comma-separated list of contigs to restrict the output to.')
+    parser.add_argument('--contigs-file', help='File with contigs (one per line) to restrict the output to.')
     args = parser.parse_args()
 
+    contigs = getContigSelection(args.regions, args.contigs_file)
+    variants = groupVariantsByContig(readVCFQuick(args.vcf, contigs=contigs))
+    reference = FastaIndex(args.reference)
 
-
-    flank = args.flank
-    snps = dict(readVCFQuick(args.vcf))
-    #    Returns dictionary over all variant positions: {(contig, pos): (count, alt, ref, genotype)}
-    contigs = set([snp[0] for snp in snps])
-
-    with open(args.out, 'wb') as fo:
-        # fo.write(str(contigs) + '\n')
-        for id_, seq in getSequences(args.reference):
-            # fo.write('%s\n' % id_)
-            if id_ in contigs:
-                for snp in sorted(snps):
-                    # fo.write('%s\n' % str(snp))
-                    if snp[0] != id_:
-                        continue
-                    pos = snp[1]
-                    id_out = '%s:%i:[%c/%c]:%i-%i' % (id_, pos, snps[snp][1], snps[snp][2], max(1, pos - flank), min(len(seq), pos + flank))
-                    pos -= 1
-                    seq_out = '%s%c%s' % (seq[pos - flank:pos], iupac(snps[snp][1], snps[snp][2]), seq[pos+1:pos+flank+1])
-                    fo.write('>%s\n%s\n' % (id_out, seq_out.upper()))
+    with open(args.out, 'wb', OUTPUT_BUFFER_SIZE) as fo:
+        block = []
+        for id_out, seq_out in extractFlanks(reference, variants, args.flank):
+            block.append('>%s\n%s\n' % (id_out, seq_out.upper()))
+            if len(block) == OUTPUT_BLOCK_RECORDS:
+                fo.write(''.join(block))
+                block = []
+        fo.write(''.join(block))
+    reference.close()
 
     pass
 
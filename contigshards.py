@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+import os
+import heapq
+import itertools
+
+from columnar import ColumnarWriter, readHeader, iterBlocks
+from blockreader import isBGZF
+from indexedio import getContigIndex
+
+"""
+contigshards - contig-sharded snplrr runs and their deterministic merge
+The contigs of the reference are split into N shards of balanced weight
+(contig length, or the size of a contig's records in a VCF as a proxy
+for its SNP count) by assigning the heaviest remaining contig to the
+lightest shard. Every shard is a full run on its contigs only, and all
+result tables are sorted by contig with rows of different contigs
+independent of each other, so merging the partial tables by contig
+reproduces the output of a single run byte by byte.
+"""
+
+SHARD_WEIGHTS = ['length', 'snps']
+# table layouts: blocks never span contigs ('contig', SNP table) or are
+# filled across contigs ('rows', contig summary and region table)
+LAYOUT_CONTIG, LAYOUT_ROWS = 'contig', 'rows'
+
+
+def parseShard(spec):
+    """
+    Returns (shard, nshards) of an 'i/N' shard spec (1 <= i <= N).
+    """
+    try:
+        shard, nshards = [int(x) for x in spec.split('/')]
+    except ValueError:
+        raise ValueError('Invalid shard %s (expected i/N).' % spec)
+    if not 1 <= shard <= nshards:
+        raise ValueError('Invalid shard %s (expected 1 <= i <= N).' % spec)
+    return shard, nshards
+
+
+def getShardFile(fn, shard, nshards):
+    """
+    Returns the name of the partial output of a shard for output fn.
+    """
+    return '%s.shard%iof%i' % (fn, shard, nshards)
+
+
+def getRecordWeights(fn):
+    """
+    Returns {contig: bytes of its records} of a plain or BGZF VCF
+    (compressed bytes for BGZF) from its contig index.
+    """
+    shift = 16 if isBGZF(fn) else 0
+    size = os.path.getsize(fn)
+    weights = {}
+    for contig, ranges in getContigIndex(fn).items():
+        weights[contig] = sum(((size if end is None else end >> shift) - (begin >> shift))
+                              for begin, end in ranges)
+    return weights
+
+
+def getShardContigs(weights, shard, nshards):
+    """
+    Returns the contigs of shard (1-based) of nshards from {contig: weight}:
+    the heaviest contigs first, each to the currently lightest shard (ties
+    by contig name and shard number, so every shard computes the same split).
+    """
+    load = [(0, i) for i in range(nshards)]
+    contigs = set()
+    for contig in sorted(weights, key=lambda contig: (-weights[contig], contig)):
+        total, i = heapq.heappop(load)
+        heapq.heappush(load, (total + weights[contig], i))
+        if i == shard - 1:
+            contigs.add(contig)
+    return contigs
+
+
+def _iterTSVRows(fn, i):
+    with open(fn, 'rb') as handle:
+        header = handle.readline()
+        yield header
+        for n, line in enumerate(handle):
+            yield line.split(b'\t', 1)[0], i, n, line
+    pass
+
+
+def mergeTSV(fns, out):
+    """
+    Merges contig-sorted TSV tables fns (with equal header lines) into out.
+    """
+    streams = [_iterTSVRows(fn, i) for i, fn in enumerate(fns)]
+    headers = [next(stream) for stream in streams]
+    if len(set(headers)) > 1:
+        raise ValueError('The headers of %s differ.' % ', '.join(fns))
+    with open(out, 'wb') as handle:
+        handle.write(headers[0])
+        for contig, i, n, line in heapq.merge(*streams):
+            handle.write(line)
+    pass
+
+
+def _iterColumnarRuns(fn, i, names):
+    """
+    Returns generator over (contig, i, n, columns) runs of one contig
+    (first column) within the blocks of a columnar table.
+    """
+    n = 0
+    for block in iterBlocks(fn):
+        start = 0
+        for contig, rows in itertools.groupby(block[names[0]]):
+            end = start + len(list(rows))
+            yield contig, i, n, [block[name][start:end] for name in names]
+            n += 1
+            start = end
+    pass
+
+
+def mergeColumnar(fns, out, layout, blockRows):
+    """
+    Merges contig-sorted columnar tables fns (with equal headers) into out,
+    re-blocked as the layout (LAYOUT_CONTIG or LAYOUT_ROWS) with at most
+    blockRows rows per block.
+    """
+    descriptors = []
+    for fn in fns:
+        with open(fn, 'rb') as handle:
+            descriptors.append(readHeader(handle))
+    if any(desc != descriptors[0] for desc in descriptors):
+        raise ValueError('The headers of %s differ.' % ', '.join(fns))
+    names = [desc['name'] for desc in descriptors[0]]
+    writer = ColumnarWriter(out, names, [desc['type'] for desc in descriptors[0]])
+    pending, nrows, currentContig = [[] for name in names], 0, None
+    streams = [_iterColumnarRuns(fn, i, names) for i, fn in enumerate(fns)]
+    for contig, i, n, columns in heapq.merge(*streams):
+        if layout == LAYOUT_CONTIG and contig != currentContig and nrows:
+            writer.writeBlock(pending)
+            pending, nrows = [[] for name in names], 0
+        currentContig = contig
+        start, size = 0, len(columns[0])
+        while start < size:
+            end = min(size, start + blockRows - nrows)
+            for column, values in zip(pending, columns):
+                column.extend(values[start:end])
+            nrows += end - start
+            start = end
+            if nrows == blockRows:
+                writer.writeBlock(pending)
+                pending, nrows = [[] for name in names], 0
+    if nrows:
+        writer.writeBlock(pending)
+    writer.close()
+    pass
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+import heapq
+import marshal
+import tempfile
+import itertools
+
+"""
+extsort - external merge sort of record tuples
+Records are sorted in memory in runs of at most maxRecords each; runs
+are written to temporary files (marshal) and combined by a k-way heap
+merge, in several passes if there are more than MAX_FANIN runs. Records
+are tuples of marshal-able values compared as a whole; input that fits
+into a single run never touches the disk. SortedLookup answers
+ascending key queries by walking a sorted (key, value) stream, e.g. the
+contig lengths of a reference in contig name order.
+"""
+
+MAX_FANIN = 64
+
+
+def _writeRun(records, tmpdir=None):
+    handle = tempfile.TemporaryFile(dir=tmpdir)
+    dump = marshal.dump
+    for record in records:
+        dump(record, handle)
+    handle.seek(0)
+    return handle
+
+
+def _readRun(handle):
+    load = marshal.load
+    try:
+        while True:
+            yield load(handle)
+    except EOFError:
+        pass
+    handle.close()
+    pass
+
+
+def externalSort(records, maxRecords, tmpdir=None):
+    """
+    Returns an iterator over the records in sorted order, holding at most
+    maxRecords of them in memory at a time.
+    """
+    records = iter(records)
+    runs = []
+    while True:
+        chunk = list(itertools.islice(records, maxRecords))
+        if not chunk:
+            break
+        chunk.sort()
+        if not runs and len(chunk) < maxRecords:
+            return iter(chunk)
+        runs.append(_writeRun(chunk, tmpdir))
+        chunk = None
+    while len(runs) > MAX_FANIN:
+        runs = [_writeRun(heapq.merge(*[_readRun(run) for run in runs[i:i + MAX_FANIN]]), tmpdir)
+                for i in range(0, len(runs), MAX_FANIN)]
+    return heapq.merge(*[_readRun(run) for run in runs])
+
+
+class SortedLookup(object):
+    """
+    Values of a (key, value) stream sorted by key, looked up with
+    ascending keys (missing keys get default).
+    """
+
+    def __init__(self, items, default=None):
+        self.items = iter(items)
+        self.default = default
+        self.key, self.value = None, None
+        self.exhausted = False
+
+    def get(self, key):
+        while not self.exhausted and (self.key is None or self.key < key):
+            try:
+                self.key, self.value = next(self.items)
+            except StopIteration:
+                self.exhausted = True
+        return self.value if self.key == key else self.default
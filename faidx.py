@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+import os
+import sys
+import mmap
+import tempfile
+
+from blockreader import _native
+
+"""
+faidx - samtools-compatible FASTA index (.fai)
+Answers contig length queries without reading sequence data and serves
+random-access subsequence fetches from a memory-mapped FASTA file.
+"""
+
+# .fai columns: NAME LENGTH OFFSET LINEBASES LINEWIDTH
+FAI_NAME, FAI_LENGTH, FAI_OFFSET, FAI_LINEBASES, FAI_LINEWIDTH = range(5)
+
+def iterFAI(fn):
+    """
+    Returns generator over .fai records [name, length, offset, linebases, linewidth]
+    computed in a single streaming pass over a multi-FASTA file.
+    Records with irregular line lengths get linebases = linewidth = 0,
+    their length is still exact but fetches fall back to a linear read.
+    """
+    rec, offset = None, 0
+    # lastShort: a line shorter than linebases was seen (only allowed last)
+    lastShort = False
+    for line in open(fn, 'rb'):
+        offset += len(line)
+        if line.startswith(b'>'):
+            if rec is not None:
+                yield _finishRecord(rec)
+            name = line[1:].strip().split()
+            rec = [_native(name[0]) if name else '', 0, offset, None, None]
+            lastShort = False
+            continue
+        if rec is None:
+            continue
+        bases = len(line.rstrip(b'\r\n'))
+        if not bases:
+            lastShort = True
+            continue
+        if rec[FAI_LINEBASES] is None:
+            rec[FAI_LINEBASES], rec[FAI_LINEWIDTH] = bases, len(line)
+        elif rec[FAI_LINEBASES] and \
+                (lastShort or bases > rec[FAI_LINEBASES] or
+                 (len(line) > bases and
+                  len(line) - bases != rec[FAI_LINEWIDTH] - rec[FAI_LINEBASES])):
+            rec[FAI_LINEBASES], rec[FAI_LINEWIDTH] = 0, 0
+        if bases < rec[FAI_LINEBASES]:
+            lastShort = True
+        rec[FAI_LENGTH] += bases
+    if rec is not None:
+        yield _finishRecord(rec)
+    pass
+
+
+def _finishRecord(rec):
+    if rec[FAI_LINEBASES] is None:
+        rec[FAI_LINEBASES], rec[FAI_LINEWIDTH] = 0, 0
+    return rec
+
+
+def buildFAI(fn):
+    """
+    Returns list of .fai records of a multi-FASTA file, cf. iterFAI.
+    """
+    return list(iterFAI(fn))
+
+
+def iterFAIFile(fn):
+    """
+    Returns generator over the .fai records of an existing index file.
+    """
+    for line in open(fn):
+        line = line.rstrip('\r\n').split('\t')
+        if len(line) < 5:
+            continue
+        yield [line[0]] + [int(x) for x in line[1:5]]
+    pass
+
+
+def readFAI(fn):
+    """
+    Returns list of .fai records from an existing index file.
+    """
+    return list(iterFAIFile(fn))
+
+
+def hasCurrentFAI(fn, faiFile=None):
+    """
+    Returns whether the index file of a FASTA file exists and is up to date.
+    """
+    faiFile = faiFile if faiFile is not None else fn + '.fai'
+    return os.path.exists(faiFile) and os.path.getmtime(faiFile) >= os.path.getmtime(fn)
+
+
+def iterContigLengths(fn):
+    """
+    Returns generator over (name, length) of the records of a FASTA file,
+    streamed from its index if it is up to date or else from the file,
+    without holding the index in memory.
+    """
+    records = iterFAIFile(fn + '.fai') if hasCurrentFAI(fn) else iterFAI(fn)
+    for rec in records:
+        yield rec[FAI_NAME], rec[FAI_LENGTH]
+    pass
+
+
+def writeFAI(records, fn):
+    # written atomically, as parallel jobs may index the same file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fn)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as out:
+            for rec in records:
+                out.write('\t'.join(map(str, rec[:5])) + '\n')
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, fn)
+    except:
+        os.remove(tmp)
+        raise
+    pass
+
+
+class FastaIndex(object):
+    """
+    Indexed access to a multi-FASTA file.
+    An existing, up-to-date <fn>.fai is used as is, otherwise the index is
+    built in one pass and written next to the FASTA file if possible.
+    """
+
+    def __init__(self, fn, faiFile=None):
+        self.fn = fn
+        self.faiFile = faiFile if faiFile is not None else fn + '.fai'
+        self.records = self._loadIndex()
+        self.index = {}
+        for rec in self.records:
+            self.index.setdefault(rec[FAI_NAME], rec)
+        self._handle, self._map = None, None
+
+    def _loadIndex(self):
+        if hasCurrentFAI(self.fn, self.faiFile):
+            return readFAI(self.faiFile)
+        records = buildFAI(self.fn)
+        # only regular files can be described by a samtools index
+        if all(rec[FAI_LINEBASES] for rec in records if rec[FAI_LENGTH]):
+            try:
+                writeFAI(records, self.faiFile)
+            except (IOError, OSError):
+                pass
+        return records
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.records)
+
+    def names(self):
+        """
+        Returns contig names in file order.
+        """
+        return [rec[FAI_NAME] for rec in self.records]
+
+    def getLength(self, name):
+        return self.index[name][FAI_LENGTH]
+
+    def getLengths(self):
+        """
+        Returns dictionary {contig: length}.
+        """
+        return dict((rec[FAI_NAME], rec[FAI_LENGTH]) for rec in self.records)
+
+    def _getMap(self):
+        if self._map is None:
+            self._handle = open(self.fn, 'rb')
+            self._map = mmap.mmap(self._handle.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        return self._map
+
+    def fetch(self, name, start=0, end=None):
+        """
+        Returns the subsequence name[start:end] (0-based, end exclusive,
+        clipped to the contig like a Python slice).
+        """
+        rec = self.index[name]
+        length = rec[FAI_LENGTH]
+        end = length if end is None else max(0, min(end, length))
+        start = max(0, min(start, end))
+        if start == end:
+            return ''
+        mm = self._getMap()
+        linebases, linewidth = rec[FAI_LINEBASES], rec[FAI_LINEWIDTH]
+        if not linebases:
+            # irregular record: read up to the next header and clean up
+            stop = mm.find(b'>', rec[FAI_OFFSET])
+            raw = mm[rec[FAI_OFFSET]:stop if stop != -1 else len(mm)]
+            seq = b''.join(raw.split())
+            return _native(seq[start:end])
+        first = rec[FAI_OFFSET] + \
+            (start // linebases) * linewidth + start % linebases
+        last = rec[FAI_OFFSET] + \
+            ((end - 1) // linebases) * linewidth + (end - 1) % linebases
+        raw = mm[first:last + 1]
+        if linewidth - linebases == 1:
+            return _native(raw.replace(b'\n', b''))
+        return _native(raw.replace(b'\r', b'').replace(b'\n', b''))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._handle.close()
+        self._handle, self._map = None, None
+        pass
+
+
+def main(argv):
+    """
+    Builds <fasta>.fai for each given file (cf. samtools faidx).
+    """
+    if not argv:
+        sys.stderr.write('Usage: faidx.py <fasta> [<fasta> ...]\n')
+        sys.exit(1)
+    for fn in argv:
+        writeFAI(buildFAI(fn), fn + '.fai')
+    pass
+
+if __name__ == '__main__': main(sys.argv[1:])
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+import os
+import re
+import ast
+import sys
+import binascii
+from array import array
+
+try:
+    import argparse
+except:
+    sys.stderr.write('TESTEXIT.\n')
+    sys.exit(0)
+
+from varianttable import CONTIGS, ALLELES, KEY_TYPECODE, KEY_SHIFT, POS_MASK, getContigRuns
+from indexedio import readLines, getContigSelection
+from telemetry import Telemetry
+from vcfdecoder import VCFDecoder, getGenotype, readSampleNames, GTYPE_HOMOZYGOUS_REF, \
+    GTYPE_HOMOZYGOUS_ALT, GTYPE_HETEROZYGOUS, GTYPE_UNKNOWN
+
+"""
+genotypematrix - N-way genotype comparison of any number of samples
+Genotypes of multi-sample VCFs and/or single-sample VCFs are collected in
+a position x sample matrix that stores one bitset per sample and genotype
+class (bit i set: position i has that genotype). Rules select positions
+with bitwise expressions over these bitsets, so that every rule is a few
+big-integer operations over all positions, and several rules are answered
+by a single pass over the inputs.
+
+Rule spec (one statement per line or separated by ';', '#' comments):
+
+    group sus = susP, susBulk
+    group ctrl = resP
+    rule common = all(ALT, sus) & none(VAR, ctrl)
+    drop common = ALT(susP) & ~ALT(susBulk) & none(VAR, ctrl)
+
+'rule' names a position set (a column of the output tables), 'drop'
+removes the contigs that contain any matching position from a rule.
+Genotype classes: REF (0/0), ALT (homozygous non-reference), HET,
+VAR (ALT or HET), CALLED (REF, ALT or HET), MISSING (no PASS record or
+no call). CLASS(sample) is the class bitset of a sample; all/any/none
+(CLASS, sample or group, ...) combine samples; operators: & | ^ ~ ().
+"""
+
+# stored genotype classes (0: missing)
+GT_REF, GT_ALT, GT_HET = 1, 2, 3
+STORED_CLASSES = (GT_REF, GT_ALT, GT_HET)
+GENOTYPE_LABELS = ['NA', 'REF', 'ALT', 'HET']
+CLASSES = ('REF', 'ALT', 'HET', 'VAR', 'CALLED', 'MISSING')
+QUANTIFIERS = ('all', 'any', 'none')
+
+# GTYPE_* flags of vcfdecoder -> stored classes
+FLAG_CLASSES = {GTYPE_HOMOZYGOUS_REF: GT_REF, GTYPE_HOMOZYGOUS_ALT: GT_ALT,
+                GTYPE_HETEROZYGOUS: GT_HET, GTYPE_UNKNOWN: 0}
+
+NONZERO_BYTES = re.compile(b'[^\x00]+')
+BIT_POSITIONS = [tuple(b for b in range(8) if x >> b & 1) for x in range(256)]
+
+if hasattr(int, 'from_bytes'):
+    def _bitsFromBytes(data):
+        return int.from_bytes(bytes(data), 'little')
+    def _bytesFromBits(bits, nbytes):
+        return bits.to_bytes(nbytes, 'little')
+else:
+    def _bitsFromBytes(data):
+        return int(binascii.hexlify(bytes(data[::-1])) or '0', 16)
+    def _bytesFromBits(bits, nbytes):
+        return binascii.unhexlify('%0*x' % (2 * nbytes, bits))[::-1]
+
+
+def getGenotypeClass(gt):
+    """
+    Returns the class (GT_REF/GT_ALT/GT_HET, 0 for no call) of a GT value;
+    phased and multi-allelic genotypes are accepted.
+    """
+    return FLAG_CLASSES[getGenotype(gt)[0]]
+
+
+def getSetBits(bits, n):
+    """
+    Returns the sorted indices of the set bits of a bitset over n positions.
+    """
+    if not bits:
+        return []
+    data = bytearray(_bytesFromBits(bits, (n + 7) >> 3))
+    indices = []
+    for match in NONZERO_BYTES.finditer(bytes(data)):
+        for p in range(match.start(), match.end()):
+            base = p << 3
+            indices.extend(base + b for b in BIT_POSITIONS[data[p]])
+    return indices
+
+
+def parseVCFSource(spec):
+    """
+    Returns (label, fn) of a '[label=]file' argument.
+    """
+    label, sep, fn = spec.partition('=')
+    if not sep or os.path.exists(spec):
+        return None, spec
+    return label, fn
+
+
+def readVCFGenotypes(fn, label=None, contigs=None):
+    """
+    Returns (sample names, records) of a VCF; records is a generator over
+    ((contig, pos), ref, alt, [genotype class per sample]) of the PASS
+    records. A label renames a single sample and prefixes several.
+    """
+    samples = readSampleNames(fn)
+    if not samples:
+        raise ValueError('%s has no sample columns.' % fn)
+    if label is not None:
+        samples = [label] if len(samples) == 1 else ['%s.%s' % (label, s) for s in samples]
+
+    def records():
+        nsamples = len(samples)
+        getLayout = VCFDecoder().getLayout
+        for line in readLines(fn, contigs):
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\r\n').split('\t')
+            if fields[6].strip() != 'PASS':
+                continue
+            gt = getLayout(fields[8])[0]
+            if gt is None:
+                classes = [0] * nsamples
+            else:
+                calls = [call.split(':') for call in fields[9:9 + nsamples]]
+                classes = [getGenotypeClass(call[gt]) if len(call) > gt else 0
+                           for call in calls]
+            yield (fields[0], int(fields[1])), fields[3], fields[4], classes
+        pass
+    return samples, records()
+
+
+class GenotypeMatrix(object):
+    """
+    Positions (packed keys as in VariantTable, sorted) x samples. Per sample,
+    codes holds the genotype class of every position (bytearray) and bits
+    the bitsets {class: int} of the stored classes.
+    """
+
+    def __init__(self, samples, keys, ref, alt, codes, contigs=None, alleles=None):
+        self.contigs = contigs if contigs is not None else CONTIGS
+        self.alleles = alleles if alleles is not None else ALLELES
+        self.samples = list(samples)
+        self.sampleIndex = dict((sample, i) for i, sample in enumerate(self.samples))
+        self.keys, self.ref, self.alt = keys, ref, alt
+        self.codes = codes
+        self.full = (1 << len(keys)) - 1
+        self.bits = [self._getBits(sampleCodes) for sampleCodes in codes]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def fromVCFs(cls, sources, contigs=None):
+        """
+        Returns the matrix of all PASS positions of the [(label, fn)] VCFs
+        (label None: sample names from the file). Reference/alternative
+        alleles are taken from the first file listing a position.
+        """
+        samples, perFile, alleleInfo = [], [], {}
+        for label, fn in sources:
+            names, records = readVCFGenotypes(fn, label=label, contigs=contigs)
+            for name in names:
+                if name in samples:
+                    raise ValueError('Sample %s occurs more than once (use label=file).' % name)
+            samples.extend(names)
+            genotypes = {}
+            for (contig, pos), ref, alt, classes in records:
+                key = (CONTIGS.intern(contig) << KEY_SHIFT) | pos
+                genotypes[key] = classes
+                if key not in alleleInfo:
+                    alleleInfo[key] = (ALLELES.intern(ref), ALLELES.intern(alt))
+            perFile.append((len(names), genotypes))
+
+        keys = array(KEY_TYPECODE, sorted(alleleInfo))
+        index = dict((key, i) for i, key in enumerate(keys))
+        ref = array('l', [alleleInfo[key][0] for key in keys])
+        alt = array('l', [alleleInfo[key][1] for key in keys])
+        codes = []
+        for nsamples, genotypes in perFile:
+            fileCodes = [bytearray(len(keys)) for _ in range(nsamples)]
+            for key, classes in genotypes.items():
+                i = index[key]
+                for sampleCodes, class_ in zip(fileCodes, classes):
+                    sampleCodes[i] = class_
+            codes.extend(fileCodes)
+        return cls(samples, keys, ref, alt, codes)
+
+    def _getBits(self, sampleCodes):
+        """
+        Returns {class: bitset} of one sample's genotype codes.
+        """
+        buffers = dict((class_, bytearray((len(sampleCodes) + 7) >> 3))
+                       for class_ in STORED_CLASSES)
+        for i, class_ in enumerate(sampleCodes):
+            if class_:
+                buffers[class_][i >> 3] |= 1 << (i & 7)
+        return dict((class_, _bitsFromBytes(buffers[class_])) for class_ in STORED_CLASSES)
+
+    def getClassBits(self, className, sample):
+        """
+        Returns the bitset of positions where sample has genotype class className.
+        """
+        if sample not in self.sampleIndex:
+            raise ValueError('Unknown sample %s.' % sample)
+        bits = self.bits[self.sampleIndex[sample]]
+        if className == 'REF':
+            return bits[GT_REF]
+        if className == 'ALT':
+            return bits[GT_ALT]
+        if className == 'HET':
+            return bits[GT_HET]
+        if className == 'VAR':
+            return bits[GT_ALT] | bits[GT_HET]
+        called = bits[GT_REF] | bits[GT_ALT] | bits[GT_HET]
+        if className == 'CALLED':
+            return called
+        return self.full ^ called
+
+    def getContigIds(self, indices):
+        """
+        Returns the set of contig ids of the given positions.
+        """
+        keys = self.keys
+        return set(keys[i] >> KEY_SHIFT for i in indices)
+
+    def sortedContigRuns(self):
+        """
+        Returns the (contig id, start, end) position ranges sorted by contig name.
+        """
+        return sorted(getContigRuns(self.keys), key=lambda run: self.contigs.name(run[0]))
+
+
+class RuleSet(object):
+    """
+    Sample groups and named rules parsed from a rule spec (cf. module doc).
+    """
+
+    def __init__(self, text):
+        self.groups, self.rules, self.drops = {}, [], {}
+        statements = []
+        for lineno, line in enumerate(text.splitlines(), 1):
+            for statement in line.split('#', 1)[0].split(';'):
+                if statement.strip():
+                    statements.append((lineno, statement.strip()))
+        for lineno, statement in statements:
+            try:
+                self._parseStatement(statement)
+            except (ValueError, SyntaxError) as err:
+                raise ValueError('Rule spec line %i (%s): %s' % (lineno, statement, err))
+        if not self.rules:
+            raise ValueError('Rule spec defines no rules.')
+        for name in self.drops:
+            if name not in dict(self.rules):
+                raise ValueError('drop %s refers to an undefined rule.' % name)
+
+    def _parseStatement(self, statement):
+        kind, _, rest = statement.partition(' ')
+        name, sep, value = rest.partition('=')
+        name = name.strip()
+        if kind not in ('group', 'rule', 'drop') or not sep or not re.match(r'^\w+$', name):
+            raise ValueError("expected 'group|rule|drop NAME = ...'")
+        if kind == 'group':
+            members = [member.strip() for member in value.split(',') if member.strip()]
+            if not members:
+                raise ValueError('empty group')
+            self.groups[name] = members
+            return
+        expr = ast.parse(value.strip(), mode='eval').body
+        self._check(expr)
+        if kind == 'rule':
+            if name in dict(self.rules):
+                raise ValueError('rule %s is defined twice' % name)
+            self.rules.append((name, expr))
+        else:
+            self.drops[name] = expr
+        pass
+
+    def _check(self, node):
+        """
+        Raises ValueError unless node is a valid rule expression.
+        """
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr, ast.BitXor)):
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+            self._check(node.operand)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+                not getattr(node, 'keywords', None) and \
+                all(isinstance(arg, ast.Name) for arg in node.args):
+            args = [arg.id for arg in node.args]
+            if node.func.id in CLASSES:
+                if len(args) != 1:
+                    raise ValueError('%s() takes one sample' % node.func.id)
+            elif node.func.id in QUANTIFIERS:
+                if len(args) < 2 or args[0] not in CLASSES:
+                    raise ValueError('%s() takes a genotype class and samples/groups' % node.func.id)
+            else:
+                raise ValueError('unknown function %s()' % node.func.id)
+        else:
+            raise ValueError('unsupported expression')
+        pass
+
+    def getSamples(self, names):
+        samples = []
+        for name in names:
+            samples.extend(self.groups.get(name, [name]))
+        return samples
+
+    def evaluate(self, node, matrix):
+        """
+        Returns the bitset of the positions of matrix matching expression node.
+        """
+        if isinstance(node, ast.BinOp):
+            left, right = self.evaluate(node.left, matrix), self.evaluate(node.right, matrix)
+            if isinstance(node.op, ast.BitAnd):
+                return left & right
+            if isinstance(node.op, ast.BitOr):
+                return left | right
+            return left ^ right
+        if isinstance(node, ast.UnaryOp):
+            return matrix.full ^ self.evaluate(node.operand, matrix)
+        func, args = node.func.id, [arg.id for arg in node.args]
+        if func in CLASSES:
+            if args[0] in self.groups:
+                raise ValueError('%s(%s): use all/any/none for groups.' % (func, args[0]))
+            return matrix.getClassBits(func, args[0])
+        bitsets = [matrix.getClassBits(args[0], sample) for sample in self.getSamples(args[1:])]
+        if func == 'all':
+            result = matrix.full
+            for bits in bitsets:
+                result &= bits
+            return result
+        result = 0
+        for bits in bitsets:
+            result |= bits
+        return result if func == 'any' else matrix.full ^ result
+
+    def apply(self, matrix):
+        """
+        Returns [(rule name, sorted position indices)], with the contigs of
+        a rule's drop expression removed.
+        """
+        results = []
+        for name, expr in self.rules:
+            selected = getSetBits(self.evaluate(expr, matrix), len(matrix))
+            if name in self.drops:
+                dropped = matrix.getContigIds(getSetBits(self.evaluate(self.drops[name], matrix),
+                                                         len(matrix)))
+                keys = matrix.keys
+                selected = [i for i in selected if keys[i] >> KEY_SHIFT not in dropped]
+            results.append((name, selected))
+        return results
+
+
+def writeResults(matrix, results, snpTable, contigSummary):
+    """
+    Writes the positions selected by any rule (with per-sample genotypes and
+    one YES/NO column per rule) and the per-contig counts per rule.
+    """
+    rules = [name for name, _ in results]
+    # one int of rule bits per position (any number of rules)
+    flags = [0] * len(matrix)
+    for r, (name, selected) in enumerate(results):
+        bit = 1 << r
+        for i in selected:
+            flags[i] |= bit
+    alleles = matrix.alleles.names
+
+    out_snpTable = open(snpTable, 'w')
+    out_snpTable.write('\t'.join(['contig', 'pos', 'refBase', 'altBase'] + matrix.samples + rules) + '\n')
+    out_contigSummary = open(contigSummary, 'w')
+    out_contigSummary.write('\t'.join(['contig'] + ['#SNPs(%s)' % name for name in rules]) + '\n')
+    nrows = 0
+    for cid, start, end in matrix.sortedContigRuns():
+        contig, counts = matrix.contigs.name(cid), [0] * len(rules)
+        rows = []
+        for i in range(start, end):
+            if not flags[i]:
+                continue
+            ruleFlags = [flags[i] >> r & 1 for r in range(len(rules))]
+            counts = [c + f for c, f in zip(counts, ruleFlags)]
+            rows.append('\t'.join([contig, str(matrix.keys[i] & POS_MASK),
+                                   alleles[matrix.ref[i]], alleles[matrix.alt[i]]] +
+                                  [GENOTYPE_LABELS[codes[i]] for codes in matrix.codes] +
+                                  ['YES' if f else 'NO' for f in ruleFlags]) + '\n')
+        if rows:
+            out_snpTable.write(''.join(rows))
+            out_contigSummary.write('\t'.join([contig] + list(map(str, counts))) + '\n')
+            nrows += len(rows)
+    out_snpTable.close()
+    out_contigSummary.close()
+    return nrows
+
+
+def main(argv):
+
+    descr = 'Compares the genotypes of any number of samples with declarative rules.'
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument('--vcf', action='append', default=[], help='VCF file, optionally labelled as label=file (repeatable; multi-sample VCFs contribute all their samples).')
+    parser.add_argument('--rules', help='Rule spec file, or the spec itself with statements separated by ";".')
+    parser.add_argument('--snp-table', help='Positions selected by any rule (tabular).')
+    parser.add_argument('--contig-summary', help='Number of selected positions per contig and rule (tabular).')
+    parser.add_argument('--regions', help='Comma-separated list of contigs to restrict the analysis to.')
+    parser.add_argument('--contigs-file', help='File with contigs (one per line) to restrict the analysis to.')
+    parser.add_argument('--logfile', help='A log file.', default='genotypematrix.log')
+    parser.add_argument('--metrics', help='Write per-stage metrics as JSON lines to this file.')
+    args = parser.parse_args(argv)
+
+    if not args.vcf or not args.rules or not args.snp_table or not args.contig_summary:
+        sys.stderr.write('Error: --vcf, --rules, --snp-table and --contig-summary are required.\n')
+        sys.exit(1)
+    try:
+        spec = open(args.rules).read() if os.path.isfile(args.rules) else args.rules
+        ruleSet = RuleSet(spec)
+    except ValueError as err:
+        sys.stderr.write('Error: %s\n' % err)
+        sys.exit(1)
+
+    contigs = getContigSelection(args.regions, args.contigs_file)
+    telemetry = Telemetry(metricsFile=args.metrics)
+    logfile = open(args.logfile, 'w')
+    sources = [parseVCFSource(spec) for spec in args.vcf]
+    try:
+        with telemetry.stage('Reading genotypes of %i VCF files' % len(sources), logfile,
+                             inputs=[fn for _, fn in sources]) as stage:
+            matrix = GenotypeMatrix.fromVCFs(sources, contigs=contigs)
+            stage.records = len(matrix)
+        logfile.write('samples: %s\n' % ', '.join(matrix.samples))
+        with telemetry.stage('Evaluating %i rules' % len(ruleSet.rules), logfile) as stage:
+            results = ruleSet.apply(matrix)
+            stage.records = len(matrix)
+    except ValueError as err:
+        sys.stderr.write('Error: %s\n' % err)
+        sys.exit(1)
+    for name, selected in results:
+        logfile.write('%s: %i\n' % (name, len(selected)))
+    with telemetry.stage('Writing results', logfile) as stage:
+        stage.records = writeResults(matrix, results, args.snp_table, args.contig_summary)
+    telemetry.close()
+    logfile.close()
+    pass
+
+if __name__ == '__main__': main(sys.argv[1:])
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+import os
+import gzip
+import zlib
+import struct
+import tempfile
+
+from blockreader import COMPRESSION_BGZF, COMPRESSION_NONE, getCompression, isBGZF, iterLines
+from blockreader import _native, _readBGZFHeader
+
+"""
+indexedio - transparent gzip/bgzip input and per-contig random access
+Line-oriented inputs (VCF, mpileup) whose first column is the contig can be
+read whole (plain, gzip or BGZF compressed) or restricted to a set of
+contigs. Restricted reads seek via a tabix (.tbi/.csi) index if present,
+otherwise via a contig offset index (<fn>.cidx) built on first use.
+Plain gzip and zstd files cannot be seeked and are filtered while streaming.
+Whole files are read ahead on a background thread (blockreader).
+"""
+
+TBI_PSEUDO_BIN = 37450
+CONTIG_INDEX_SUFFIX = '.cidx'
+
+def readBGZFBlock(handle):
+    """
+    Returns the uncompressed data of the BGZF block at the handle position
+    (None at end of file).
+    """
+    size = _readBGZFHeader(handle)
+    if size is None:
+        return None
+    cdata = handle.read(size)
+    handle.read(8)
+    return zlib.decompress(cdata, -15)
+
+
+def iterBGZFLines(fn, begin=0, end=None):
+    """
+    Returns generator over (virtual offset, line) of a BGZF file for the
+    lines starting at virtual offsets in [begin, end).
+    """
+    handle = open(fn, 'rb')
+    handle.seek(begin >> 16)
+    skip = begin & 0xffff
+    pending, pendingStart = b'', None
+    while True:
+        blockStart = handle.tell()
+        data = readBGZFBlock(handle)
+        if data is None:
+            break
+        pos, skip = skip, 0
+        while pos < len(data):
+            lineStart = pendingStart if pending else (blockStart << 16) | pos
+            if not pending and end is not None and lineStart >= end:
+                handle.close()
+                return
+            nl = data.find(b'\n', pos)
+            if nl == -1:
+                if not pending:
+                    pendingStart = lineStart
+                pending += data[pos:]
+                break
+            yield lineStart, _native(pending + data[pos:nl + 1])
+            pending, pos = b'', nl + 1
+    handle.close()
+    if pending:
+        yield pendingStart, _native(pending)
+    pass
+
+
+def iterPlainLines(fn, begin=0, end=None):
+    """
+    Returns generator over (byte offset, line) of an uncompressed file for
+    the lines starting at offsets in [begin, end).
+    """
+    handle = open(fn, 'rb')
+    handle.seek(begin)
+    offset = begin
+    while end is None or offset < end:
+        line = handle.readline()
+        if not line:
+            break
+        yield offset, _native(line)
+        offset += len(line)
+    handle.close()
+    pass
+
+
+def _readInt32(data, p, n=1):
+    return struct.unpack_from('<%ii' % n, data, p), p + 4 * n
+
+
+def _readTabixNames(data, p):
+    (fmt, colSeq, colBeg, colEnd, meta, skip, lnm), p = _readInt32(data, p, 7)
+    names = [_native(name) for name in data[p:p + lnm].split(b'\0') if name]
+    return names, p + lnm
+
+
+def readTabixIndex(fn):
+    """
+    Returns {contig: [(begin, end)]} virtual offset ranges from a .tbi file.
+    """
+    data = gzip.open(fn, 'rb').read()
+    if data[:4] != b'TBI\1':
+        raise IOError('%s is not a tabix index.' % fn)
+    (nref,), p = _readInt32(data, 4)
+    names, p = _readTabixNames(data, p)
+    index = {}
+    for name in names[:nref]:
+        (nbin,), p = _readInt32(data, p)
+        begin, end = None, None
+        for i in range(nbin):
+            bin_, nchunk = struct.unpack_from('<Ii', data, p)
+            p += 8
+            chunks = struct.unpack_from('<%iQ' % (2 * nchunk), data, p)
+            p += 16 * nchunk
+            if bin_ == TBI_PSEUDO_BIN:
+                continue
+            begin = min([begin] + list(chunks[0::2])) if begin is not None else min(chunks[0::2])
+            end = max([end] + list(chunks[1::2])) if end is not None else max(chunks[1::2])
+        (nintv,), p = _readInt32(data, p)
+        p += 8 * nintv
+        if begin is not None:
+            index[name] = [(begin, end)]
+    return index
+
+
+def readCSIIndex(fn):
+    """
+    Returns {contig: [(begin, end)]} virtual offset ranges from a .csi file
+    (tabix-style CSI, contig names in the auxiliary data).
+    """
+    data = gzip.open(fn, 'rb').read()
+    if data[:4] != b'CSI\1':
+        raise IOError('%s is not a CSI index.' % fn)
+    (minShift, depth, laux), p = _readInt32(data, 4, 3)
+    names = _readTabixNames(data[:p + laux], p)[0] if laux >= 28 else []
+    p += laux
+    pseudoBin = ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+    (nref,), p = _readInt32(data, p)
+    index = {}
+    for name in names[:nref]:
+        (nbin,), p = _readInt32(data, p)
+        begin, end = None, None
+        for i in range(nbin):
+            bin_, loffset, nchunk = struct.unpack_from('<IQi', data, p)
+            p += 16
+            chunks = struct.unpack_from('<%iQ' % (2 * nchunk), data, p)
+            p += 16 * nchunk
+            if bin_ == pseudoBin:
+                continue
+            begin = min([begin] + list(chunks[0::2])) if begin is not None else min(chunks[0::2])
+            end = max([end] + list(chunks[1::2])) if end is not None else max(chunks[1::2])
+        if begin is not None:
+            index[name] = [(begin, end)]
+    return index
+
+
+def buildContigIndex(fn):
+    """
+    Returns {contig: [(begin, end)]} offset ranges (virtual offsets for BGZF)
+    of the runs of lines per contig, skipping '#' header lines.
+    end is None for a run reaching the end of the file.
+    """
+    lines = iterBGZFLines(fn) if isBGZF(fn) else iterPlainLines(fn)
+    index = {}
+    current, begin = None, None
+    for offset, line in lines:
+        contig = None if line.startswith('#') else line.split('\t', 1)[0].strip()
+        if contig != current:
+            if current is not None:
+                index.setdefault(current, []).append((begin, offset))
+            current, begin = contig, offset
+    if current is not None:
+        index.setdefault(current, []).append((begin, None))
+    return index
+
+
+def readContigIndex(fn):
+    index = {}
+    for line in open(fn):
+        contig, begin, end = line.rstrip('\r\n').split('\t')
+        index.setdefault(contig, []).append((int(begin), int(end) if end != '-' else None))
+    return index
+
+
+def writeContigIndex(index, fn):
+    # written atomically, as parallel jobs may index the same file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fn)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as out:
+            for contig in index:
+                for begin, end in index[contig]:
+                    out.write('%s\t%i\t%s\n' % (contig, begin, '-' if end is None else end))
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, fn)
+    except:
+        os.remove(tmp)
+        raise
+    pass
+
+
+def _isFresh(indexFile, fn):
+    return os.path.exists(indexFile) and \
+        os.path.getmtime(indexFile) >= os.path.getmtime(fn)
+
+
+def getContigIndex(fn):
+    """
+    Returns {contig: [(begin, end)]} for a plain or BGZF file: from its
+    tabix/CSI index if available, else from (or into) <fn>.cidx.
+    """
+    if isBGZF(fn):
+        if _isFresh(fn + '.tbi', fn):
+            return readTabixIndex(fn + '.tbi')
+        if _isFresh(fn + '.csi', fn):
+            return readCSIIndex(fn + '.csi')
+    indexFile = fn + CONTIG_INDEX_SUFFIX
+    if _isFresh(indexFile, fn):
+        return readContigIndex(indexFile)
+    index = buildContigIndex(fn)
+    index.pop(None, None)
+    try:
+        writeContigIndex(index, indexFile)
+    except (IOError, OSError):
+        pass
+    return index
+
+
+def readLines(fn, contigs=None):
+    """
+    Returns iterator over the lines of fn (gzip/BGZF/zstd transparently);
+    restricted to the records of the given contigs (in file order) if any.
+    Header lines are only returned for unrestricted reads.
+    """
+    if contigs is None:
+        return iterLines(fn)
+    return _readContigLines(fn, contigs)
+
+
+def _readContigLines(fn, contigs):
+    compression = getCompression(fn)
+    if compression not in (COMPRESSION_NONE, COMPRESSION_BGZF):
+        for line in iterLines(fn):
+            if not line.startswith('#') and line.split('\t', 1)[0].strip() in contigs:
+                yield line
+        return
+    iterRange = iterBGZFLines if compression == COMPRESSION_BGZF else iterPlainLines
+    index = getContigIndex(fn)
+    ranges = sorted(r for contig in contigs for r in index.get(contig, []))
+    lastEnd = 0
+    for begin, end in ranges:
+        # do not read overlapping ranges twice
+        if lastEnd is None:
+            break
+        begin = max(begin, lastEnd)
+        if end is not None and begin >= end:
+            continue
+        lastEnd = end
+        for offset, line in iterRange(fn, begin, end):
+            # index ranges may cover neighbouring records
+            if not line.startswith('#') and line.split('\t', 1)[0].strip() in contigs:
+                yield line
+    pass
+
+
+def getContigSelection(regions=None, contigsFile=None):
+    """
+    Returns the set of contigs from a comma-separated list and/or a file
+    with one contig per line (first column), None if neither is given.
+    """
+    if regions is None and contigsFile is None:
+        return None
+    contigs = set()
+    if regions:
+        contigs.update(c.strip() for c in regions.split(',') if c.strip())
+    if contigsFile:
+        for line in iterLines(contigsFile):
+            line = line.strip().split()
+            if line and not line[0].startswith('#'):
+                contigs.add(line[0])
+    return contigs
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+import heapq
+
+"""
+intervalindex - labelled annotation intervals per contig
+Intervals (e.g. MAST/NLR-Parser motifs, syntenic gene spans) are kept per
+contig sorted by start. Batches of sorted positions are annotated in one
+merge-join sweep: intervals enter a heap ordered by end when the sweep
+reaches their start and leave it once it has passed their end, so a batch
+costs O((positions + intervals) log intervals) instead of a scan of all
+intervals per position.
+"""
+
+
+class IntervalIndex(object):
+    """
+    Closed intervals [start, end] (1-based) with a label, per contig.
+    """
+
+    def __init__(self):
+        self.intervals = {}
+        self.unsorted = set()
+
+    def __len__(self):
+        return sum(len(intervals) for intervals in self.intervals.values())
+
+    def add(self, contig, start, end, label):
+        self.intervals.setdefault(contig, []).append((min(start, end), max(start, end), label))
+        self.unsorted.add(contig)
+        pass
+
+    def getIntervals(self, contig):
+        """
+        Returns the (start, end, label) intervals of contig sorted by start.
+        """
+        if contig in self.unsorted:
+            self.intervals[contig].sort()
+            self.unsorted.discard(contig)
+        return self.intervals.get(contig, [])
+
+    def annotate(self, contig, positions, flank=0):
+        """
+        Returns the sorted labels of the intervals within flank bp of each
+        of the ascending positions of contig (one tuple per position).
+        """
+        intervals = self.getIntervals(contig)
+        if not intervals:
+            return [()] * len(positions)
+        result, active = [], []
+        i, n = 0, len(intervals)
+        for pos in positions:
+            while i < n and intervals[i][0] <= pos + flank:
+                heapq.heappush(active, (intervals[i][1], i))
+                i += 1
+            while active and active[0][0] < pos - flank:
+                heapq.heappop(active)
+            result.append(tuple(sorted(set(intervals[j][2] for _, j in active))) if active else ())
+        return result
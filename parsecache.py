@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+import os
+import errno
+import hashlib
+import tempfile
+import collections
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+"""
+parsecache - persistent cache of parsed inputs
+Parsed inputs (contig lengths, variant tables, coverage) are stored as
+binary sidecar files in a cache directory, keyed by a hash over the input
+path, size and mtime and the parse options. Entries are written atomically
+(temporary file + rename), so parallel jobs can share a cache directory;
+the total size is bounded by least-recently-used eviction. MemoryCache
+keeps entries resident in a long-running process (cf. snplrrd.py).
+"""
+
+# bump to invalidate entries written by older code
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.snpc'
+DEFAULT_CACHE_SIZE = 10 * (1 << 30)
+
+
+def getCacheKey(fn, kind, **options):
+    """
+    Returns the cache key for parsing fn as kind with the given options.
+    """
+    st = os.stat(fn)
+    desc = repr((CACHE_VERSION, os.path.abspath(fn), st.st_size, st.st_mtime,
+                 kind, sorted((k, v if not isinstance(v, (set, frozenset)) else sorted(v))
+                              for k, v in options.items())))
+    return hashlib.sha1(desc if isinstance(desc, bytes) else desc.encode('utf-8')).hexdigest()
+
+
+def getAvailableMemory():
+    """
+    Returns the memory available to new allocations in bytes
+    (MemAvailable of /proc/meminfo; None where unavailable).
+    """
+    try:
+        with open('/proc/meminfo') as handle:
+            for line in handle:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) << 10
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+class BaseCache(object):
+    """
+    Common interface of the caches: get(key), put(key, obj), cached().
+    """
+
+    def cached(self, fn, kind, parse, **options):
+        """
+        Returns parse() for fn, from the cache if the same input was
+        parsed with the same options before.
+        """
+        key = getCacheKey(fn, kind, **options)
+        obj = self.get(key)
+        if obj is None:
+            obj = parse()
+            self.put(key, obj)
+        return obj
+
+
+class ParseCache(BaseCache):
+    """
+    Content-keyed store of pickled (protocol 2) objects in cacheDir.
+    """
+
+    def __init__(self, cacheDir, maxSize=DEFAULT_CACHE_SIZE):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        try:
+            os.makedirs(cacheDir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _path(self, key):
+        return os.path.join(self.cacheDir, key + CACHE_SUFFIX)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """
+        Returns the cached object or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as handle:
+                obj = pickle.load(handle)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            # mtime serves as last-access time for the LRU eviction
+            os.utime(path, None)
+        except OSError:
+            pass
+        return obj
+
+    def put(self, key, obj):
+        """
+        Stores obj under key; failures (full disk, permissions) are ignored.
+        """
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.cacheDir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as handle:
+                pickle.dump(obj, handle, 2)
+            os.rename(tmp, self._path(key))
+        except (IOError, OSError):
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+        pass
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits maxSize.
+        """
+        lock = None
+        if fcntl is not None:
+            lock = open(os.path.join(self.cacheDir, '.lock'), 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            entries = []
+            for name in os.listdir(self.cacheDir):
+                if not name.endswith(CACHE_SUFFIX):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.cacheDir, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, name in sorted(entries):
+                if total <= self.maxSize:
+                    break
+                try:
+                    os.remove(os.path.join(self.cacheDir, name))
+                except OSError:
+                    pass
+                total -= size
+        finally:
+            if lock is not None:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                lock.close()
+        pass
+
+
+class MemoryCache(BaseCache):
+    """
+    In-memory store with the ParseCache interface. Least recently used
+    entries are evicted while their total (pickled) size exceeds maxSize
+    or less than minAvailable bytes of system memory are available.
+    """
+
+    def __init__(self, maxSize=DEFAULT_CACHE_SIZE, minAvailable=0):
+        self.maxSize = maxSize
+        self.minAvailable = minAvailable
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """
+        Returns the cached object or None.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        # most recently used entries are kept last
+        self.entries[key] = entry
+        return entry[0]
+
+    def put(self, key, obj, size=None):
+        """
+        Stores obj under key; size defaults to the length of its pickle.
+        """
+        if size is None:
+            size = len(pickle.dumps(obj, 2))
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        if size > self.maxSize:
+            return
+        self.entries[key] = (obj, size)
+        self.size += size
+        self.evict()
+        pass
+
+    def evict(self):
+        """
+        Removes least recently used entries until the limits are met.
+        """
+        while self.entries and (self.size > self.maxSize or self._isMemoryLow()):
+            key, (obj, size) = self.entries.popitem(last=False)
+            self.size -= size
+        pass
+
+    def _isMemoryLow(self):
+        if not self.minAvailable:
+            return False
+        available = getAvailableMemory()
+        return available is not None and available < self.minAvailable
@@ -12,7 +12,10 @@ except:
     sys.exit(0)
 
 
-import vcf
+from faidx import FastaIndex
+from pileupstats import getContigDepthStats, formatDepthStats
+from indexedio import readLines, getContigSelection
+from parsecache import ParseCache
 
 GTYPE_HOMOZYGOUS_REF = 1
 GTYPE_HOMOZYGOUS_ALT = 2
@@ -24,51 +27,54 @@ GENOTYPES = {'0/0': GTYPE_HOMOZYGOUS_REF,
              '0/1': GTYPE_HETEROZYGOUS}
 
 logfile = None
+# ParseCache for per-contig coverage (None: caching disabled)
+cache = None
 
 def anabl_getSeqsFromFASTA(fn):
     """
     Returns generator object to access sequences from a multi-FASTA file.
     Originates from 'anabl' - BLAST analysing tool, hence the prefix.
     """
-    head, seq = None, ''
-    for line in open(fn):
+    head, seq = None, []
+    for line in readLines(fn):
         if line[0] == '>':
             if head is not None:
-                yield (head, seq) 
-            head, seq = line.strip().strip('>'), ''
+                yield (head, ''.join(seq))
+            head, seq = line.strip().strip('>'), []
         else:
-            seq += line.strip()
-    yield (head, seq)
+            seq.append(line.strip())
+    yield (head, ''.join(seq))
 
 def getSequenceLengths(fn):
     """
-    Returns sequence lengths from a FastX file
-    """ 
-    return dict([(head, len(seq)) 
-                 for head, seq in anabl_getSeqsFromFASTA(fn)])
+    Returns sequence lengths from a Fasta file (via its .fai index)
+    """
+    return FastaIndex(fn).getLengths()
 
-def getAverageContigCoverage(fn, contigLengths, fo):
+def getAverageContigCoverage(fn, contigLengths, fo, contigs=None):
     """
-    Returns the average read coverage for a contig
+    Returns the average read coverage for a contig (first sample)
+    and writes mean, breadth, median, min and max depth per contig and
+    sample (multi-sample mpileup: one set of columns per sample) to fo.
     """
+    if cache is not None:
+        stats = cache.cached(fn, 'depthStats',
+                             lambda: getContigDepthStats(fn, contigLengths, contigs=contigs),
+                             contigs=contigs, lengths=sorted(contigLengths.items()))
+    else:
+        stats = getContigDepthStats(fn, contigLengths, contigs=contigs)
     out = open(fo, 'wb')
-    coverage = dict([(cid, 0.0) for cid in contigLengths])
-    for line in open(fn):
-        line = line.strip().split()
-        coverage[line[0]] += int(line[3])
-    for cid in sorted(coverage):
-        coverage[cid] = coverage[cid] / contigLengths[cid]
-        out.write('%s\t%.05f\n' % (cid, coverage[cid]))
-        out.flush()
+    out.write(''.join('%s\t%s\n' % (cid, formatDepthStats(stats[cid]))
+                      for cid in sorted(stats)))
     out.close()
 
-    return coverage
+    return dict((cid, stats[cid][0][0]) for cid in stats)
 
 def getTimeDelta(t):
     now = time.time()
     return now - t, now
 
-def extractCoverage(pileup, refcontigs, out):
+def extractCoverage(pileup, refcontigs, out, contigs=None):
 
     global logfile
 
@@ -82,7 +88,7 @@ def extractCoverage(pileup, refcontigs, out):
     logfile.flush()
     tstamp = time.time()
     
-    avgCov = getAverageContigCoverage(pileup, seqLengths, out)
+    avgCov = getAverageContigCoverage(pileup, seqLengths, out, contigs=contigs)
     logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
     return avgCov
     # pass
@@ -101,6 +107,10 @@ def main(argv):
     parser.add_argument('--pileup', help='Pileup file with coverage information for each position in each contig.')
     parser.add_argument('--out', help='The output file (tabular).')
     parser.add_argument('--logfile', help='A log file.', default='snplrr.log')
+    parser.add_argument('--cache-dir', default=os.environ.get('SNPLRR_CACHE_DIR'), help='Directory for cached parsed inputs (default: $SNPLRR_CACHE_DIR, no caching if unset).')
+    parser.add_argument('--cache-size', type=int, default=10240, help='Size limit of the cache directory in MB.')
+    parser.add_argument('--regions', help='Comma-separated list of contigs to restrict the output to.')
+    parser.add_argument('--contigs-file', help='File with contigs (one per line) to restrict the output to.')
 
     args = parser.parse_args()
 
@@ -110,11 +120,16 @@ def main(argv):
         sys.stderr.write('Error: Invalid input parameters.\n')
         sys.exit(1)
 
+    global cache
+    if args.cache_dir:
+        cache = ParseCache(args.cache_dir, maxSize=args.cache_size << 20)
+
     global logfile 
     logfile = open(args.logfile, 'wb')
     # logfile.write(str(input) + '\n')
     #coverage = extractCoverage(args.pileup, args.refcontigs)
-    extractCoverage(args.pileup, args.refcontigs, args.out)
+    extractCoverage(args.pileup, args.refcontigs, args.out,
+                    contigs=getContigSelection(args.regions, args.contigs_file))
     #open(args.out, 'wb').write('\n'.join(['%s\t%.07f' % (cid, coverage[cid])
     #                                      for cid in sorted(coverage)]))
   
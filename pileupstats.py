@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+import operator
+import itertools
+import collections
+
+from indexedio import readLines
+from blockreader import _native, iterLineBuffers
+
+"""
+pileupstats - chunked per-contig depth statistics from (multi-sample) mpileup
+Pileup files are read in large line-aligned blocks on a background thread
+(blockreader); contig and depth columns are extracted and grouped into
+contig runs with C-level map/compress calls instead of per-line Python loops.
+"""
+
+BLOCK_SIZE = 1 << 23
+BLOCK_LINES = 1 << 16
+
+# mpileup columns: contig, pos, ref, then (depth, bases, quals) per sample
+PILEUP_DEPTH_COLUMN = 3
+PILEUP_SAMPLE_COLUMNS = 3
+
+def readLineBlocks(fn, blockSize=BLOCK_SIZE, contigs=None):
+    """
+    Returns generator over lists of complete lines (without line breaks)
+    read from fn in blocks of about blockSize bytes (gzip/BGZF/zstd
+    transparently). With contigs, only their records are read via the
+    file's contig index.
+    """
+    if contigs is not None:
+        lines = readLines(fn, contigs)
+        while True:
+            block = [line.rstrip('\r\n') for line in itertools.islice(lines, BLOCK_LINES)]
+            if not block:
+                break
+            yield block
+        return
+    for block in iterLineBuffers(fn, blockSize=blockSize):
+        block = _native(block)
+        if block.endswith('\n'):
+            yield block[:-1].split('\n')
+        elif block.strip():
+            # unterminated last line
+            yield [block]
+    pass
+
+
+def getSampleCount(fn):
+    """
+    Returns the number of samples in an mpileup file (from its first line).
+    """
+    for line in readLines(fn):
+        if line.strip():
+            return (len(line.rstrip('\r\n').split('\t')) - PILEUP_DEPTH_COLUMN) // PILEUP_SAMPLE_COLUMNS
+    return 1
+
+
+class DepthAccumulator(object):
+    """
+    Running depth statistics of one contig in one sample.
+    """
+
+    def __init__(self):
+        self.total, self.covered, self.positions = 0, 0, 0
+        self.minDepth, self.maxDepth = None, 0
+        self.histogram = collections.Counter()
+
+    def update(self, depths):
+        if not depths:
+            return
+        self.total += sum(depths)
+        self.positions += len(depths)
+        self.covered += len(depths) - depths.count(0)
+        low, high = min(depths), max(depths)
+        self.minDepth = low if self.minDepth is None else min(self.minDepth, low)
+        self.maxDepth = max(self.maxDepth, high)
+        self.histogram.update(depths)
+        pass
+
+    def getStats(self, length):
+        """
+        Returns (mean, breadth, median, min, max) over length positions;
+        positions missing from the pileup count as depth 0.
+        """
+        length = max(length, self.positions)
+        if not length:
+            return (0.0, 0.0, 0, 0, 0)
+        missing = length - self.positions
+        histogram = self.histogram.copy()
+        if missing:
+            histogram[0] += missing
+        minDepth = 0 if missing or self.minDepth is None else self.minDepth
+        return (self.total / float(length), self.covered / float(length),
+                getMedian(histogram, length), minDepth, self.maxDepth)
+
+
+def getMedian(histogram, n):
+    """
+    Returns the median of n values given as {value: count}.
+    """
+    lower, upper = (n - 1) // 2, n // 2
+    seen, low = 0, None
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if low is None and seen > lower:
+            low = value
+        if seen > upper:
+            return (low + value) / 2.0 if low != value else value
+    return 0
+
+
+def getContigRuns(contigs):
+    """
+    Returns [(contig, start, end)] for runs of equal values in contigs.
+    """
+    n = len(contigs)
+    starts = [0] + list(itertools.compress(range(1, n),
+                                           map(operator.ne, contigs[:-1], contigs[1:])))
+    ends = starts[1:] + [n]
+    return [(contigs[start], start, end) for start, end in zip(starts, ends)]
+
+
+def _scanDepths(fn, nsamples, contigs=None, positions=None):
+    """
+    Returns ({contig: [DepthAccumulator per sample]},
+             {(contig, pos): [depth per sample]} for the requested positions).
+    """
+    split = operator.methodcaller('split', '\t')
+    getContig = operator.itemgetter(0)
+    getPos = operator.itemgetter(1)
+    depthColumns = [operator.itemgetter(PILEUP_DEPTH_COLUMN + PILEUP_SAMPLE_COLUMNS * i)
+                    for i in range(nsamples)]
+    accumulators, depthsAt = {}, {}
+    for lines in readLineBlocks(fn, contigs=contigs):
+        rows = list(map(split, filter(None, lines)))
+        if not rows:
+            continue
+        rowContigs = list(map(getContig, rows))
+        depths = [list(map(int, map(column, rows))) for column in depthColumns]
+        for contig, start, end in getContigRuns(rowContigs):
+            if contig not in accumulators:
+                accumulators[contig] = [DepthAccumulator() for i in range(nsamples)]
+            for acc, sampleDepths in zip(accumulators[contig], depths):
+                acc.update(sampleDepths[start:end])
+            if positions and contig in positions:
+                wanted = positions[contig]
+                runPos = list(map(int, map(getPos, rows[start:end])))
+                for i in itertools.compress(range(end - start), map(wanted.__contains__, runPos)):
+                    depthsAt[(contig, runPos[i])] = [d[start + i] for d in depths]
+    return accumulators, depthsAt
+
+
+def _getStats(accumulators, contigLengths, nsamples):
+    stats = {}
+    for contig in set(contigLengths).union(accumulators):
+        length = contigLengths.get(contig, 0)
+        acc = accumulators.get(contig, [DepthAccumulator() for i in range(nsamples)])
+        stats[contig] = [a.getStats(length) for a in acc]
+    return stats
+
+
+def getContigDepthStats(fn, contigLengths, nsamples=None, contigs=None):
+    """
+    Returns dictionary {contig: [(mean, breadth, median, min, max) per sample]}
+    for all contigs in contigLengths (and any further contig in the pileup),
+    or only for the given contigs.
+    """
+    if contigs is not None:
+        contigLengths = dict((contig, contigLengths.get(contig, 0)) for contig in contigs)
+    if nsamples is None:
+        nsamples = getSampleCount(fn)
+    accumulators = _scanDepths(fn, nsamples, contigs=contigs)[0]
+    return _getStats(accumulators, contigLengths, nsamples)
+
+
+def getContigDepthStatsAt(fn, contigLengths, positions, nsamples=None, contigs=None):
+    """
+    Returns (getContigDepthStats(...), {(contig, pos): [depth per sample]})
+    where the second dictionary holds the depths at positions
+    ({contig: set(pos)}) collected in the same pass; positions missing
+    from the pileup have depth 0 and are not listed.
+    """
+    if contigs is not None:
+        contigLengths = dict((contig, contigLengths.get(contig, 0)) for contig in contigs)
+    if nsamples is None:
+        nsamples = getSampleCount(fn)
+    accumulators, depthsAt = _scanDepths(fn, nsamples, contigs=contigs, positions=positions)
+    return _getStats(accumulators, contigLengths, nsamples), depthsAt
+
+
+def formatDepthStats(sampleStats):
+    """
+    Returns the tab-separated mean, breadth, median, min, max per sample.
+    """
+    return '\t'.join('%.05f\t%.05f\t%.1f\t%i\t%i' % (mean, breadth, median, low, high)
+                     for mean, breadth, median, low, high in sampleStats)
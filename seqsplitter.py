@@ -1,8 +1,33 @@
 #!/usr/bin/env python
+import io
+import os
 import sys
+import shutil
 import argparse
+import tempfile
+import multiprocessing
 
-from snplrr import anabl_getSeqsFromFASTA as getSequences
+from faidx import FastaIndex, FAI_NAME, FAI_LENGTH, FAI_OFFSET
+
+"""
+seqsplitter - splits FASTA sequences into overlapping fragments
+Sequences are streamed through a fixed-size buffer of fragsize plus one
+read block, so memory does not depend on the contig length. Fragments are
+written as memoryview slices of that buffer into a large output buffer.
+With several workers, batches of contigs are split in parallel and the
+parts are concatenated in input order.
+"""
+
+OUTPUT_BUFFER_SIZE = 1 << 22
+# sequence bytes collected from the input before they are fed to the buffer
+READ_BLOCK_SIZE = 1 << 16
+
+if bytes is str:
+    def _bytes(s):
+        return s
+else:
+    def _bytes(s):
+        return s.encode()
 
 
 def splitSequence(id_, seq, fragsize, overlap):
@@ -14,6 +39,183 @@ def splitSequence(id_, seq, fragsize, overlap):
         p += (fragsize - overlap)
 
 
+class FragmentSplitter(object):
+    """
+    Streaming equivalent of splitSequence: sequence is fed in blocks and
+    the fragments are written to out (a binary file) as soon as they are
+    complete. lineWidth > 0 wraps the fragment sequences.
+    """
+
+    def __init__(self, out, fragsize, overlap, lineWidth=0):
+        self.out = out
+        self.fragsize, self.step = fragsize, fragsize - overlap
+        self.lineWidth = lineWidth
+        self.buffer = bytearray(fragsize + READ_BLOCK_SIZE)
+        self.view = memoryview(self.buffer)
+        self.name = None
+        self.fragments = 0
+
+    def start(self, name):
+        """
+        Starts a new sequence (name as bytes).
+        """
+        self.name = name
+        # filled: bytes in buffer, offset: sequence position of buffer[0],
+        # p: start of the next fragment
+        self.filled, self.offset, self.p = 0, 0, 0
+        pass
+
+    def feed(self, data):
+        """
+        Appends sequence data (bytes without line breaks).
+        """
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            if not self.filled and self.p > self.offset:
+                # gap between fragments (overlap < 0)
+                skip = min(self.p - self.offset, len(data) - pos)
+                self.offset += skip
+                pos += skip
+                continue
+            n = min(len(data) - pos, len(self.buffer) - self.filled)
+            self.view[self.filled:self.filled + n] = data[pos:pos + n]
+            self.filled += n
+            pos += n
+            # only emit while more sequence follows: the last fragments
+            # depend on the total length
+            while self.p + self.fragsize < self.offset + self.filled:
+                self._write(self.p, self.p + self.fragsize)
+                self.p += self.step
+            self._compact()
+        pass
+
+    def finish(self):
+        """
+        Writes the remaining fragments of the current sequence.
+        """
+        length = self.offset + self.filled
+        while self.p < length - 1:
+            self._write(self.p, min(length, self.p + self.fragsize))
+            self.p += self.step
+        self.name = None
+        pass
+
+    def _compact(self):
+        drop = min(self.p - self.offset, self.filled)
+        if drop > 0:
+            keep = self.filled - drop
+            # same-size assignment: the buffer is never resized
+            self.buffer[:keep] = self.buffer[drop:self.filled]
+            self.filled, self.offset = keep, self.offset + drop
+        pass
+
+    def _write(self, start, end):
+        self.out.write(b'>%s:%i-%i\n' % (self.name, start + 1, end))
+        first, last = start - self.offset, end - self.offset
+        width = self.lineWidth or (last - first)
+        for p in range(first, last, width):
+            self.out.write(self.view[p:min(last, p + width)])
+            self.out.write(b'\n')
+        self.fragments += 1
+        pass
+
+
+def splitRecords(lines, splitter, single=None):
+    """
+    Splits the FASTA records read from lines (binary). With single (the
+    record name), lines start at the sequence of that record and reading
+    stops at the next header.
+    """
+    batch, size = [], 0
+    if single is not None:
+        splitter.start(single)
+    for line in lines:
+        if line[:1] == b'>':
+            if batch:
+                splitter.feed(b''.join(batch))
+                batch, size = [], 0
+            if splitter.name is not None:
+                splitter.finish()
+            if single is not None:
+                return
+            name = line[1:].strip().split()
+            splitter.start(name[0] if name else b'')
+            continue
+        if splitter.name is None:
+            continue
+        line = line.rstrip()
+        batch.append(line)
+        size += len(line)
+        if size >= READ_BLOCK_SIZE:
+            splitter.feed(b''.join(batch))
+            batch, size = [], 0
+    if batch:
+        splitter.feed(b''.join(batch))
+    if splitter.name is not None:
+        splitter.finish()
+    pass
+
+
+def _splitBatch(job):
+    """
+    Splits the records [(name, offset)] of a batch into a temporary file;
+    returns its path.
+    """
+    fn, records, fragsize, overlap, lineWidth, tmpdir = job
+    fd, partFile = tempfile.mkstemp(dir=tmpdir, suffix='.fa')
+    with io.open(fd, 'wb', buffering=OUTPUT_BUFFER_SIZE) as out:
+        splitter = FragmentSplitter(out, fragsize, overlap, lineWidth=lineWidth)
+        with open(fn, 'rb') as handle:
+            for name, offset in records:
+                handle.seek(offset)
+                splitRecords(handle, splitter, single=_bytes(name))
+    return partFile
+
+
+def getBatches(records, nbatches):
+    """
+    Returns consecutive batches of .fai records of about equal total length.
+    """
+    total = sum(rec[FAI_LENGTH] for rec in records)
+    target = max(1, total // max(1, nbatches))
+    batches, batch, size = [], [], 0
+    for rec in records:
+        batch.append(rec)
+        size += rec[FAI_LENGTH]
+        if size >= target:
+            batches.append(batch)
+            batch, size = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def splitFastaParallel(fn, out, fragsize, overlap, lineWidth=0, workers=2):
+    """
+    Splits the records of an indexed FASTA file on a pool of processes and
+    writes the fragments to out in input order.
+    """
+    reference = FastaIndex(fn)
+    records = reference.records
+    reference.close()
+    tmpdir = tempfile.mkdtemp(prefix='seqsplitter.')
+    jobs = [(fn, [(rec[FAI_NAME], rec[FAI_OFFSET]) for rec in batch],
+             fragsize, overlap, lineWidth, tmpdir)
+            for batch in getBatches(records, 4 * workers)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        for partFile in pool.imap(_splitBatch, jobs, chunksize=1):
+            with open(partFile, 'rb') as part:
+                shutil.copyfileobj(part, out, OUTPUT_BUFFER_SIZE)
+            os.remove(partFile)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    pass
+
+
 def main():
 
     descr = ''
@@ -22,12 +224,22 @@ def main():
     parser.add_argument('--fragsize', type=int, default=10000, help='Size of the sequence fragments in bp.')
     parser.add_argument('--overlap', type=int, default=1000, help='Size of overlap between sequence fragments in bp.')
     parser.add_argument('--output', help='Output Fasta file.')
+    parser.add_argument('--line-width', type=int, default=0, help='Wrap fragment sequences after this many bases (0: one line per fragment).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes splitting contigs in parallel.')
     args = parser.parse_args()
 
-    with open(args.output, 'wb') as fo:
-        for id_, seq in getSequences(args.input):
-            for fragid, fragseq in splitSequence(id_, seq, args.fragsize, args.overlap):
-                fo.write('>%s\n%s\n' % (fragid, fragseq))
+    if args.fragsize < 1 or args.overlap >= args.fragsize:
+        sys.stderr.write('Error: --fragsize must be positive and larger than --overlap.\n')
+        sys.exit(1)
+
+    with io.open(args.output, 'wb', buffering=OUTPUT_BUFFER_SIZE) as fo:
+        if args.workers > 1:
+            splitFastaParallel(args.input, fo, args.fragsize, args.overlap,
+                               lineWidth=args.line_width, workers=args.workers)
+        else:
+            splitter = FragmentSplitter(fo, args.fragsize, args.overlap, lineWidth=args.line_width)
+            with open(args.input, 'rb') as handle:
+                splitRecords(handle, splitter)
 
 
 
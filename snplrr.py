@@ -1,10 +1,17 @@
 #!/usr/bin/env python
 
+import io
 import os
 import csv
 import sys
 import time
+import heapq
+import operator
 import datetime
+import tempfile
+import itertools
+import traceback
+import multiprocessing
 
 try:
     import argparse
@@ -12,6 +19,23 @@ except:
     sys.stderr.write('TESTEXIT.\n')
     sys.exit(0)
 
+from faidx import FastaIndex, iterContigLengths
+from varianttable import VariantTable, Interner, KEY_SHIFT, POS_MASK
+from indexedio import readLines, getContigSelection
+from blockreader import COMPRESSION_NONE, COMPRESSION_BGZF, getCompression, iterLines
+from parsecache import ParseCache, getCacheKey
+from pileupstats import getContigDepthStatsAt
+from telemetry import Telemetry
+from columnar import ColumnarWriter
+from intervalindex import IntervalIndex
+from vcfdecoder import VCFDecoder, DECODER_VERSION, GTYPE_HOMOZYGOUS_REF, \
+    GTYPE_HOMOZYGOUS_ALT, GTYPE_UNKNOWN, GENOTYPES
+from snpwindows import REGION_TABLEHEADER, getCleanRegions, getRegionValues, formatRegionBlock
+from stagegraph import StageGraph
+from extsort import externalSort, SortedLookup
+from contigshards import SHARD_WEIGHTS, LAYOUT_CONTIG, LAYOUT_ROWS, parseShard, getShardFile, \
+    getRecordWeights, getShardContigs, mergeTSV, mergeColumnar
+
 
 CONTIG_TABLEHEADER = ['contig', 'length',
                       'avg(coverage, susP)', 'avg(coverage, susBulk)',
@@ -26,34 +50,75 @@ SNP_TABLEHEADER = ['contig', 'pos',
                    'susBulk/Ref:base','susBulk/Ref:coverage',
                    'susP identical to susBulk?']
 
+# appended if mpileup files are given
+PILEUP_SAMPLES = ['resP', 'susP', 'susBulk']
+CONTIG_PILEUP_TABLEHEADER = [h % s for s in PILEUP_SAMPLES
+                             for h in ('avg(depth, %s)', 'breadth(%s)')]
+SNP_PILEUP_TABLEHEADER = ['%s/Ref:depth' % s for s in PILEUP_SAMPLES]
+# appended with --annotate-snps
+SNP_ANNOTATION_TABLEHEADER = ['Synteny_GM(SNP)', 'NLR-motifs(SNP)']
+
+# column types of the columnar output (cf. columnar.py)
+# the contig SNP counts are f8, as the TSV contig summary prints them with decimals
+CONTIG_COLUMN_TYPES = ['str', 'i8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'f8', 'str', 'str']
+CONTIG_PILEUP_COLUMN_TYPES = ['f8'] * len(CONTIG_PILEUP_TABLEHEADER)
+SNP_COLUMN_TYPES = ['str', 'i8', 'str', 'str', 'i8', 'str', 'i8', 'bool']
+SNP_PILEUP_COLUMN_TYPES = ['i8'] * len(SNP_PILEUP_TABLEHEADER)
+SNP_ANNOTATION_COLUMN_TYPES = ['str'] * len(SNP_ANNOTATION_TABLEHEADER)
+REGION_COLUMN_TYPES = ['str', 'i8', 'i8', 'i8', 'i8', 'i8', 'f8', 'f8', 'bool']
+OUTPUT_FORMATS = ['tsv', 'columnar']
+
 NO_FILTER = 0
-GTYPE_HOMOZYGOUS_REF = 1
-GTYPE_HOMOZYGOUS_ALT = 2
-GTYPE_HETEROZYGOUS = 4
-GTYPE_UNKNOWN = 8
 
-GENOTYPES = {'0/0': GTYPE_HOMOZYGOUS_REF,
-             '1/1': GTYPE_HOMOZYGOUS_ALT,
-             '0/1': GTYPE_HETEROZYGOUS}
+SPILL_BLOCK_SIZE = 1 << 20
+# rows formatted/written per output block
+OUTPUT_BLOCK_ROWS = 1 << 16
+# smallest byte range of a VCF that is handed to a parser process
+MIN_CHUNK_SIZE = 1 << 24
+# columns of a batch manifest, named after the corresponding options
+BATCH_COLUMNS = ['susP-vs-resVCF', 'susBulk-vs-resVCF', 'contig-summary', 'snp-table']
+BATCH_OPTIONAL_COLUMNS = ['label', 'susP-vs-resMP', 'susBulk-vs-resMP', 'region-table', 'logfile']
+# --max-memory: approximate memory of a VCF record in a sort run (bytes), of the
+# parsed VCFs per byte of VCF text and the expansion of compressed VCF text
+SORT_RECORD_SIZE = 400
+VCF_MEMORY_FACTOR = 4
+GZIP_RATIO = 5
+MIN_SORT_RECORDS = 1000
 
 logfile = None
+# ParseCache for parsed inputs (None: caching disabled)
+cache = None
+# per-stage metrics (--metrics, --profile)
+telemetry = Telemetry()
 
-def getMASTInformation(fn):
-    global logfile
-    reader = csv.reader(open(fn), delimiter='\t', quotechar='"')
+def _hasInterval(row, i):
+    return len(row) > i + 1 and row[i].isdigit() and row[i + 1].isdigit()
+
+def getMASTInformation(fn, intervals=None):
+    """
+    Returns {contig: set((class, motifs))}; motif coordinates (columns
+    4/5) are added to the IntervalIndex intervals if given.
+    """
+    reader = csv.reader(readLines(fn), delimiter='\t', quotechar='"')
     mastInfo = {}
     for row in reader:
-        logfile.write(str(row) + '\n')
         if row[0].startswith('#') or len(row) < 3:
             continue
         if row[0] not in mastInfo:
             mastInfo[row[0]] = set([])
-        mastInfo[row[0]].add((row[1].replace('N/A', '???'), row[2]))
+        motif = (row[1].replace('N/A', '???'), row[2])
+        mastInfo[row[0]].add(motif)
+        if intervals is not None and _hasInterval(row, 3):
+            intervals.add(row[0], int(row[3]), int(row[4]), '%s/%s' % motif)
     return mastInfo
 
 
-def getSyntenyInformation(fn):
-    reader = csv.reader(open(fn), delimiter='\t', quotechar='"')
+def getSyntenyInformation(fn, intervals=None):
+    """
+    Returns {contig: set(G. max gene)}; gene spans (columns 3/4, written
+    by synteny_parse.py) are added to the IntervalIndex intervals if given.
+    """
+    reader = csv.reader(readLines(fn), delimiter='\t', quotechar='"')
     syntenyInfo = {}
     for row in reader:
         if row[0].startswith('#'):
@@ -61,6 +126,8 @@ def getSyntenyInformation(fn):
         if row[0] not in syntenyInfo:
             syntenyInfo[row[0]] = set()
         syntenyInfo[row[0]].add(row[1])
+        if intervals is not None and _hasInterval(row, 2):
+            intervals.add(row[0], int(row[2]), int(row[3]), row[1])
     return syntenyInfo
 
 
@@ -69,15 +136,15 @@ def anabl_getSeqsFromFASTA(fn):
     Returns generator object to access sequences from a multi-FASTA file.
     Originates from 'anabl' - BLAST analysing tool, hence the prefix.
     """
-    head, seq = None, ''
-    for line in open(fn):
+    head, seq = None, []
+    for line in readLines(fn):
         if line[0] == '>':
             if head is not None:
-                yield (head, seq)
-            head, seq = line.strip().strip('>'), ''
+                yield (head, ''.join(seq))
+            head, seq = line.strip().strip('>'), []
         else:
-            seq += line.strip()
-    yield (head, seq)
+            seq.append(line.strip())
+    yield (head, ''.join(seq))
 
 def getSNPPositions(vcf_handle, crit=None, sample='Sample1'):
     """
@@ -86,54 +153,62 @@ def getSNPPositions(vcf_handle, crit=None, sample='Sample1'):
     positions = set()
     for record in vcf_handle:
         genotype = GENOTYPES.get(record.genotype(sample).data[0],
-                                 GTYPE_UNKNOWN)
+                                 (GTYPE_UNKNOWN,))[0]
         if (genotype & crit) == crit:
             key = (record.CHROM, record.POS)
             positions.add(key)
     return positions
 
 def getSNPPositionsFast(vcf_handle, crit=None, sample='Sample1'):
-    return set(((record.CHROM, record.POS, record.genotype(sample).data[0]) for record in vcf_handle if (GENOTYPES.get(record.genotype(sample).data[0], GTYPE_UNKNOWN) & crit) == crit))
+    return set(((record.CHROM, record.POS, record.genotype(sample).data[0]) for record in vcf_handle if (GENOTYPES.get(record.genotype(sample).data[0], (GTYPE_UNKNOWN,))[0] & crit) == crit))
 
-def readVCFQuick(fn, crit=0):
+def readLineRange(fn, start=0, end=None):
     """
-    Returns dictionary over all variant positions: {(contig, pos): (count, alt, genotype)}
+    Returns iterator over the lines of fn that start within the byte range
+    [start, end). Consecutive ranges partition the file along line boundaries.
     """
-    for line in open(fn):
-        if line.startswith('#'): continue
-        line = line.strip().split()
-        if line[6].strip() != 'PASS': continue
-        contig, pos = line[:2]
-        ref, alt = line[3:5]
-        genotype_fields = line[9].split(':')
-        genotype = GENOTYPES.get(genotype_fields[0], GTYPE_UNKNOWN)
-        yield ((contig, int(pos)),
-               (int(genotype_fields[3]), alt, ref, genotype))
-        #if (genotype & crit) == crit:
-        #    yield ((contig, int(pos)), (int(genotype_fields[3]), baseCall))
-    pass
+    if start == 0 and end is None:
+        return readLines(fn)
+    return iterLines(fn, start=start, end=end)
+
+def getByteRanges(fn, nchunks):
+    """
+    Returns nchunks (start, end) byte ranges covering fn
+    (a single range for compressed files).
+    """
+    if getCompression(fn) != COMPRESSION_NONE:
+        return [(0, None)]
+    size = os.path.getsize(fn)
+    nchunks = max(1, min(nchunks, size // MIN_CHUNK_SIZE))
+    bounds = [size * i // nchunks for i in range(nchunks + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def readVCFQuick(fn, crit=0, start=0, end=None, contigs=None):
+    """
+    Returns generator over the PASS records ((contig, pos), (depth, alt, ref, genotype))
+    of a VCF, cf. VCFDecoder (restricted to the lines starting within bytes [start, end) if given,
+    or to the records of a set of contigs via the file's contig index)
+    """
+    if contigs is not None:
+        lines = readLines(fn, contigs)
+    else:
+        lines = readLineRange(fn, start, end)
+    return VCFDecoder.fromFile(fn).decodeLines(lines)
 
 
 def getSequenceLengths(fn):
     """
-    Returns sequence lengths from a FastX file
+    Returns sequence lengths from a Fasta file (via its .fai index)
     """
-    return dict([(head, len(seq))
-                 for head, seq in anabl_getSeqsFromFASTA(fn)])
+    return FastaIndex(fn).getLengths()
 
 def getAverageSNPCoverage(SNPpos, contigLengths):
-    coverage = dict([(cid, []) for cid in contigLengths])
-    global logfile
-    logfile.write(str(coverage.keys()) + '\n')
-
-    for snp in SNPpos:
-        logfile.write(str(snp) + '\n')
-        coverage[snp[0]].append(SNPpos[snp][0])
-    for contig in coverage:
-        if coverage[contig]:
-            coverage[contig] = sum(coverage[contig])/float(len(coverage[contig]))
-        else:
-            coverage[contig] = 0
+    """
+    Returns the average SNP depth per contig from a VariantTable
+    (0 for contigs without SNPs)
+    """
+    coverage = dict([(cid, 0) for cid in contigLengths])
+    coverage.update(SNPpos.meanDepthPerContig())
     return coverage
 
 def getAverageContigCoverage(fn, contigLengths):
@@ -141,7 +216,7 @@ def getAverageContigCoverage(fn, contigLengths):
     Returns the average read coverage for a contig
     """
     coverage = dict([(cid, 0.0) for cid in contigLengths])
-    for line in open(fn):
+    for line in readLines(fn):
         line = line.strip().split()
         coverage[line[0]] += int(line[3])
     for cid in coverage:
@@ -152,7 +227,7 @@ def getAverageContigCoverage(fn, contigLengths):
 def getAverageContigCoverageQuick(fn, contigLengths):
     coverage = {}
     currentContig, count = None, 0
-    for line in open(fn):
+    for line in readLines(fn):
         line = line.strip().split()
         if line[0] != currentContig:
             if currentContig is not None:
@@ -164,55 +239,613 @@ def getAverageContigCoverageQuick(fn, contigLengths):
 
 
 def countSNPsPerContig(positions):
-    snpCount = {}
-    for pos in positions:
-        snpCount[pos[0]] = snpCount.get(pos[0], 0) + 1
-    return snpCount
+    return positions.countPerContig()
 
 def getTimeDelta(t):
     now = time.time()
     return now - t, now
 
 def getContigLengths_(refContigs, logfile=sys.stdout):
-    logfile.write('Getting contig lengths...')
-    logfile.flush()
-    tstamp = time.time()
-    contigLengths = getSequenceLengths(refContigs)
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+    with telemetry.stage('Getting contig lengths', logfile, inputs=[refContigs]) as stage:
+        if cache is not None:
+            contigLengths = cache.cached(refContigs, 'contigLengths',
+                                         lambda: getSequenceLengths(refContigs))
+        else:
+            contigLengths = getSequenceLengths(refContigs)
+        stage.records = len(contigLengths)
     return contigLengths
 
-def getVariantData_(vcf, setLabel='', crit=NO_FILTER, logfile=sys.stdout):
-    logfile.write('Reading SNP data from %s...' % setLabel)
-    logfile.flush()
-    tstamp = time.time()
-    snpsDict = dict(readVCFQuick(vcf, crit=NO_FILTER))
-    filtered = set([snp for snp in snpsDict
-                    if (snpsDict[snp][-1] & crit) == crit])
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
-    return snpsDict, filtered
+def getAnnotations_(syntenyTable, mastTable, annotateSNPs=False, motifFlank=0):
+    """
+    Returns (syntenyInfo, mastInfo, SNP annotations); loading is recorded as
+    a silent stage. With annotateSNPs, the SNP annotations are the
+    [(IntervalIndex, flank)] of synteny gene spans and MAST motifs
+    (SNP_ANNOTATION_TABLEHEADER), else None.
+    """
+    with telemetry.stage('Loading synteny/MAST tables', inputs=[syntenyTable, mastTable]) as stage:
+        syntenyIntervals = IntervalIndex() if annotateSNPs else None
+        mastIntervals = IntervalIndex() if annotateSNPs else None
+        syntenyInfo = getSyntenyInformation(syntenyTable, intervals=syntenyIntervals)
+        mastInfo = getMASTInformation(mastTable, intervals=mastIntervals)
+        stage.records = len(syntenyInfo) + len(mastInfo)
+    annotations = None
+    if annotateSNPs:
+        annotations = [(syntenyIntervals, 0), (mastIntervals, motifFlank)]
+    return syntenyInfo, mastInfo, annotations
+
+def _getVariantCacheKey(vcf, crit, contigs):
+    if cache is None:
+        return None
+    return getCacheKey(vcf, 'variants', crit=crit, contigs=contigs, decoder=DECODER_VERSION)
+
+def _restoreVariantData(buffers):
+    """
+    Returns (snps, filtered) tables from cached (snps, filtered) buffers.
+    """
+    return tuple(VariantTable.concatenate([VariantTable.fromBuffers(buf)])
+                 for buf in buffers)
+
+def getVariantData_(vcf, setLabel='', crit=NO_FILTER, contigs=None, logfile=sys.stdout):
+    with telemetry.stage('Reading SNP data from %s' % setLabel, logfile, inputs=[vcf]) as stage:
+        key = _getVariantCacheKey(vcf, crit, contigs)
+        buffers = cache.get(key) if key is not None else None
+        if buffers is not None:
+            logfile.write(' (cached)')
+            snps, filtered = _restoreVariantData(buffers)
+        else:
+            snps = VariantTable.fromRecords(readVCFQuick(vcf, crit=NO_FILTER, contigs=contigs))
+            filtered = snps.filter(crit)
+            if key is not None:
+                cache.put(key, (snps.toBuffers(), filtered.toBuffers()))
+        stage.records = len(snps)
+    return snps, filtered
+
+def readVCFPositions(fn, contigs=None):
+    """
+    Returns {contig: set(pos)} of the PASS records of a VCF.
+    """
+    positions = {}
+    for line in readLines(fn, contigs):
+        if line.startswith('#'):
+            continue
+        line = line.split('\t', 7)
+        if line[6].strip() != 'PASS':
+            continue
+        positions.setdefault(line[0], set()).add(int(line[1]))
+    return positions
+
+def _scanPileup(job):
+    """
+    Scans one mpileup in a worker process; returns ({contig: (mean, breadth)},
+    {(contig, pos): depth}) for the PASS positions of positionsVCF.
+    """
+    pileup, contigLengths, positionsVCF, contigs = job
+    positions = readVCFPositions(positionsVCF, contigs)
+    stats, depthsAt = getContigDepthStatsAt(pileup, contigLengths, positions,
+                                            nsamples=1, contigs=contigs)
+    return (dict((contig, stats[contig][0][:2]) for contig in stats),
+            dict((key, depthsAt[key][0]) for key in depthsAt))
+
+def scanPileups_(pileups, contigLengths, positionsVCF, contigs=None, logfile=sys.stdout,
+                 background=True):
+    """
+    Starts scanning the mpileup files (None entries are skipped) on a pool
+    of processes, one per file, so that they are read while the VCFs are
+    parsed. Returns a function that waits for and returns the results
+    ([(contigStats, depthsAt) or None per pileup]). With background=False
+    (e.g. in a worker process, which cannot start a pool), the files are
+    scanned one after the other when the results are collected.
+    """
+    logfile.write('Scanning %i pileup files%s.\n' % (len([fn for fn in pileups if fn]),
+                                                     ' in the background' if background else ''))
+    results = [None] * len(pileups)
+    keys = [None] * len(pileups)
+    jobs = []
+    for i, pileup in enumerate(pileups):
+        if not pileup:
+            continue
+        if cache is not None:
+            keys[i] = getCacheKey(pileup, 'pileupDepths', contigs=contigs,
+                                  positions=getCacheKey(positionsVCF, 'positions'),
+                                  lengths=sorted(contigLengths.items()))
+            results[i] = cache.get(keys[i])
+        if results[i] is None:
+            jobs.append((i, (pileup, contigLengths, positionsVCF, contigs)))
+    pool, pending = None, None
+    if jobs and background:
+        pool = multiprocessing.Pool(len(jobs))
+        pending = pool.map_async(_scanPileup, [job for _, job in jobs], chunksize=1)
+
+    def collect():
+        if jobs:
+            label = 'Waiting for pileup data' if background else 'Scanning pileup data'
+            with telemetry.stage(label, logfile, inputs=[pileups[i] for i, _ in jobs]) as stage:
+                try:
+                    if pending is not None:
+                        scanned = pending.get()
+                    else:
+                        scanned = map(_scanPileup, [job for _, job in jobs])
+                    for (i, _), result in zip(jobs, scanned):
+                        results[i] = result
+                        if keys[i] is not None:
+                            cache.put(keys[i], result)
+                finally:
+                    if pool is not None:
+                        pool.close()
+                        pool.join()
+                stage.records = sum(len(results[i][1]) for i, _ in jobs)
+        return results
+    return collect
+
+def getPileupValues(pileupData, contig):
+    """
+    Returns the CONTIG_PILEUP_TABLEHEADER values (None if a pileup is missing).
+    """
+    row = []
+    for data in pileupData:
+        if data is None:
+            row.extend([None, None])
+        else:
+            row.extend(data[0].get(contig, (0, 0)))
+    return row
+
+def _readVCFChunk(job):
+    """
+    Parses one byte range of a VCF in a worker process; returns the
+    compact VariantTable buffers rather than pickled records.
+    """
+    fn, start, end, contigs = job
+    records = readVCFQuick(fn, crit=NO_FILTER, start=start, end=end, contigs=contigs)
+    table = VariantTable.fromRecords(records, contigs=Interner(), alleles=Interner())
+    return table.toBuffers()
+
+def getVariantDataParallel_(vcfs, setLabels, crits, workers=2, contigs=None, logfile=sys.stdout):
+    """
+    Parses several VCFs at once on a pool of worker processes. Each file is
+    split into line-aligned byte ranges so that a single large file is
+    parsed in parallel as well.
+    Returns [(snps, filtered), ...] as getVariantData_ does for each file.
+    """
+    label = 'Reading SNP data from %s (%i workers)' % ('/'.join(setLabels), workers)
+    with telemetry.stage(label, logfile, inputs=vcfs) as stage:
+        data = [None] * len(vcfs)
+        keys = [_getVariantCacheKey(vcf, crit, contigs) for vcf, crit in zip(vcfs, crits)]
+        for i, key in enumerate(keys):
+            buffers = cache.get(key) if key is not None else None
+            if buffers is not None:
+                data[i] = _restoreVariantData(buffers)
+        totalSize = sum(os.path.getsize(vcf) for vcf in vcfs) or 1
+        jobs = []
+        for i, vcf in enumerate(vcfs):
+            if data[i] is not None:
+                continue
+            # aim at ~4 ranges per worker, proportional to file size
+            nchunks = (4 * workers * os.path.getsize(vcf)) // totalSize
+            if contigs is not None:
+                jobs.append((i, (vcf, 0, None, contigs)))
+                continue
+            jobs.extend((i, (vcf, start, end, None)) for start, end in getByteRanges(vcf, nchunks))
+        buffers = []
+        if jobs:
+            pool = multiprocessing.Pool(workers)
+            try:
+                buffers = pool.map(_readVCFChunk, [job for _, job in jobs], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        for i, crit in enumerate(crits):
+            if data[i] is not None:
+                continue
+            parts = [VariantTable.fromBuffers(buf)
+                     for (j, _), buf in zip(jobs, buffers) if j == i]
+            snps = VariantTable.concatenate(parts)
+            data[i] = (snps, snps.filter(crit))
+            if keys[i] is not None:
+                cache.put(keys[i], (snps.toBuffers(), data[i][1].toBuffers()))
+        stage.records = sum(len(snps) for snps, filtered in data)
+    return data
+
+def readVCFSorted(fn, contigRank, index=0, contigs=None):
+    """
+    Returns generator over ((rank, pos), index, data) records of a VCF that is
+    coordinate-sorted in reference contig order.
+    """
+    last = None
+    for (contig, pos), data in readVCFQuick(fn, contigs=contigs):
+        if contig not in contigRank:
+            raise ValueError('%s: contig %s is not in the reference.' % (fn, contig))
+        key = (contigRank[contig], pos)
+        if last is not None and key < last:
+            raise ValueError('%s is not coordinate-sorted (%s:%i).' % (fn, contig, pos))
+        last = key
+        yield key, index, data
+
+def mergeSortedVCFs(fns, contigRank, contigs=None):
+    """
+    Returns generator over ((rank, pos), [data_1, ..., data_n]) walking
+    coordinate-sorted VCFs in lockstep (data_i is None if file i has
+    no record at that position).
+    """
+    streams = [readVCFSorted(fn, contigRank, i, contigs=contigs)
+               for i, fn in enumerate(fns)]
+    for key, records in itertools.groupby(heapq.merge(*streams),
+                                          key=lambda x: x[0]):
+        data = [None] * len(fns)
+        for _, i, d in records:
+            data[i] = d
+        yield key, data
+
+def _iterVariantRecords(fn, index, contigs=None):
+    for n, ((contig, pos), data) in enumerate(readVCFQuick(fn, contigs=contigs)):
+        yield (contig, pos, index, n) + tuple(data)
+    pass
+
+def mergeVariantRuns(fns, maxRecords, contigs=None, tmpdir=None):
+    """
+    Returns generator over ((contig, pos), [data_1, ..., data_n]) of unsorted
+    VCFs in contig name order, externally sorted in runs of maxRecords records
+    (data_i is None if file i has no record at that position, the last
+    of several records of a file wins).
+    """
+    records = externalSort(itertools.chain(*[_iterVariantRecords(fn, i, contigs=contigs)
+                                             for i, fn in enumerate(fns)]),
+                           maxRecords, tmpdir=tmpdir)
+    for key, group in itertools.groupby(records, key=lambda x: x[:2]):
+        data = [None] * len(fns)
+        for record in group:
+            data[record[2]] = record[4:]
+        yield key, data
+
+def getSortedContigLengths(fn, maxRecords, tmpdir=None):
+    """
+    Returns a SortedLookup of the contig lengths of a FASTA file (0 for
+    unknown contigs; the first of several records of a name wins) that is
+    queried in contig name order.
+    """
+    records = externalSort(((name, i, length) for i, (name, length) in enumerate(iterContigLengths(fn))),
+                           maxRecords, tmpdir=tmpdir)
+    return SortedLookup(((name, length) for name, i, length in records), default=0)
+
+def estimateVariantMemory(vcfs):
+    """
+    Returns the approximate memory (bytes) of parsing and comparing the VCFs in memory.
+    """
+    return sum(os.path.getsize(fn) * (GZIP_RATIO if getCompression(fn) != COMPRESSION_NONE else 1)
+               for fn in vcfs if fn) * VCF_MEMORY_FACTOR
+
+def getContigValues(contig, length, coverage_susP, coverage_susB,
+                    snpCount_susP, snpCount_susB, snpCount_common,
+                    synteny, mast):
+    """
+    Returns the typed CONTIG_TABLEHEADER values of a contig
+    (SNP frequencies are None for contigs of unknown length).
+    """
+    row = [contig, length,
+           coverage_susP,
+           coverage_susB,
+           int(snpCount_susP),
+           int(snpCount_susB),
+           int(snpCount_common)]
+    if row[1] == 0:
+        row.extend([None, None, None])
+    else:
+        row.extend([row[-3]/float(row[1]),
+                    row[-2]/float(row[1]),
+                    row[-1]/float(row[1])])
+
+    row.append(','.join(sorted(synteny)))
+
+    # don't like this so much
+    def f(x):
+        return ('%s/%s' % x) if x != 'NA' else x
+    row.append(','.join(sorted(map(f, mast))))
+    return row
+
+def formatContigValues(row):
+    """
+    Returns a contig summary line from getContigValues (+ getPileupValues).
+    """
+    row = row[:2] + ['NA' if x is None else '%.3f' % x for x in row[2:10]] + \
+        row[10:12] + ['NA' if x is None else '%.3f' % x for x in row[12:]]
+    return '\t'.join(map(str, row)) + '\n'
+
+def formatContigBlock(columns):
+    """
+    Returns the contig summary lines of a block of columns.
+    """
+    return ''.join(map(formatContigValues, map(list, zip(*columns))))
+
+def formatSNPRow(contig, pos, susPData, susBData):
+    """
+    Returns a SNP table line (SNP_TABLEHEADER columns) from the
+    (depth, alt, ref, genotype) records of susP and susBulk.
+    """
+    #                (int(genotype_fields[3]), alt, ref, genotype))
+    # ref, alt, cov, alt, cov
+    # (list(reversed(resPSNPs_d.get((contig, pos), NA)[:-1]))) + \
+    row = [contig, pos,] + \
+           (list(reversed(susPData[:-1]))) + \
+           (list(reversed(susBData[:-2])))
+    row.append('YES' if row[-2] == row[-4] else 'NO')
+    return '\t'.join(map(str, row)) + '\n'
+
+def getSNPHeader(pileupData, annotations):
+    """
+    Returns (column names, column types) of the SNP table.
+    """
+    header, types = SNP_TABLEHEADER[:], SNP_COLUMN_TYPES[:]
+    if pileupData:
+        header, types = header + SNP_PILEUP_TABLEHEADER, types + SNP_PILEUP_COLUMN_TYPES
+    if annotations:
+        header, types = header + SNP_ANNOTATION_TABLEHEADER, types + SNP_ANNOTATION_COLUMN_TYPES
+    return header, types
+
+def getSNPExtraColumns(contig, positions, pileupData=None, annotations=None):
+    """
+    Returns the SNP_PILEUP_TABLEHEADER/SNP_ANNOTATION_TABLEHEADER columns
+    for ascending positions of contig.
+    """
+    n, columns = len(positions), []
+    for data in pileupData or []:
+        if data is None:
+            columns.append([None] * n)
+        else:
+            columns.append(list(map(data[1].get, zip(itertools.repeat(contig, n), positions),
+                                    itertools.repeat(0, n))))
+    for intervals, flank in annotations or []:
+        columns.append([','.join(labels) or 'NA'
+                        for labels in intervals.annotate(contig, positions, flank=flank)])
+    return columns
+
+def getSNPColumns(common, commonB, start, end, pileupData=None, annotations=None):
+    """
+    Returns the SNP table columns (cf. getSNPHeader) of rows [start, end)
+    of one contig run of the common SNPs, with commonB the aligned susBulk
+    records.
+    """
+    n = end - start
+    contig = common.contigs.name(common.keys[start] >> KEY_SHIFT)
+    allelesP, allelesB = common.alleles.names, commonB.alleles.names
+    positions = list(map(POS_MASK.__and__, common.keys[start:end]))
+    altP = list(map(allelesP.__getitem__, common.alt[start:end]))
+    altB = list(map(allelesB.__getitem__, commonB.alt[start:end]))
+    columns = [[contig] * n, positions,
+               list(map(allelesP.__getitem__, common.ref[start:end])),
+               altP, common.depth[start:end], altB, commonB.depth[start:end],
+               list(map(operator.eq, altB, altP))]
+    return columns + getSNPExtraColumns(contig, positions, pileupData=pileupData,
+                                        annotations=annotations)
+
+def parseSNPRows(lines):
+    """
+    Returns the SNP_TABLEHEADER columns of formatSNPRow lines.
+    """
+    rows = [line.rstrip('\n').split('\t') for line in lines]
+    columns = [list(column) for column in zip(*rows)]
+    for i in (1, 4, 6):
+        columns[i] = list(map(int, columns[i]))
+    columns[7] = [x == 'YES' for x in columns[7]]
+    return columns
+
+def formatSNPBlock(columns):
+    """
+    Returns the SNP table lines of getSNPColumns columns, formatted
+    column-wise in one pass.
+    """
+    n = len(columns[0])
+    strColumns = columns[:7] + [list(map(['NO', 'YES'].__getitem__, columns[7]))]
+    for column in columns[8:]:
+        strColumns.append(itertools.repeat('NA', n) if n and column[0] is None else column)
+    template = '\t'.join(['%s'] * len(strColumns)) + '\n'
+    return ''.join(map(template.__mod__, zip(*strColumns)))
+
+
+class TSVWriter(object):
+    """
+    TSV counterpart of ColumnarWriter: blocks of columns are turned into
+    lines by formatBlock and written in one call.
+    """
+
+    def __init__(self, fn, header, formatBlock):
+        self.out = open(fn, 'wb')
+        self.out.write('\t'.join(header) + '\n')
+        self.formatBlock = formatBlock
+
+    def writeBlock(self, columns):
+        if columns and len(columns[0]):
+            self.out.write(self.formatBlock(columns))
+        pass
+
+    def writeLines(self, data):
+        self.out.write(data)
+        pass
+
+    def close(self):
+        self.out.close()
+        pass
+
+
+def openTable(fn, header, types, formatBlock, outputFormat='tsv'):
+    """
+    Returns a writer (writeBlock(columns), close()) for a result table.
+    """
+    if outputFormat == 'columnar':
+        return ColumnarWriter(fn, header, types)
+    return TSVWriter(fn, header, formatBlock)
+
+def writeContigSummary(fn, rows, pileupData, outputFormat='tsv'):
+    """
+    Writes getContigValues rows (with pileup columns if available).
+    """
+    header = CONTIG_TABLEHEADER + (CONTIG_PILEUP_TABLEHEADER if pileupData else [])
+    types = CONTIG_COLUMN_TYPES + (CONTIG_PILEUP_COLUMN_TYPES if pileupData else [])
+    out = openTable(fn, header, types, formatContigBlock, outputFormat=outputFormat)
+    for start in range(0, len(rows), OUTPUT_BLOCK_ROWS):
+        block = rows[start:start + OUTPUT_BLOCK_ROWS]
+        if pileupData:
+            block = [row + getPileupValues(pileupData, row[0]) for row in block]
+        out.writeBlock([list(column) for column in zip(*block)])
+    out.close()
+    pass
+
+def writeRegionTable(fn, rows, outputFormat='tsv'):
+    """
+    Writes the candidate regions of the window scan (getRegionValues rows).
+    """
+    out = openTable(fn, REGION_TABLEHEADER, REGION_COLUMN_TYPES, formatRegionBlock,
+                    outputFormat=outputFormat)
+    for start in range(0, len(rows), OUTPUT_BLOCK_ROWS):
+        out.writeBlock([list(column) for column in zip(*rows[start:start + OUTPUT_BLOCK_ROWS])])
+    out.close()
+    pass
+
+def readVariants_(vcf, setLabel, crit, workers=1, contigs=None, logfile=sys.stdout):
+    """
+    Returns (snps, filtered) of a VCF, parsed on workers processes if > 1.
+    """
+    if workers > 1:
+        return getVariantDataParallel_([vcf], [setLabel], [crit], workers=workers,
+                                       contigs=contigs, logfile=logfile)[0]
+    return getVariantData_(vcf, setLabel=setLabel, crit=crit, contigs=contigs, logfile=logfile)
+
+def _encodeVariantData(data):
+    return tuple(table.toBuffers() for table in data)
+
+# VariantTables of a comparison (compareVariants_)
+COMPARISON_TABLES = ['commonSusSNPs', 'commonSusBSNPs', 'susPOnlySNPs']
+
+def _encodeComparison(comparison):
+    encoded = dict(comparison)
+    for name in COMPARISON_TABLES:
+        encoded[name] = comparison[name].toBuffers()
+    return encoded
+
+def _decodeComparison(encoded):
+    comparison = dict(encoded)
+    for name in COMPARISON_TABLES:
+        comparison[name] = VariantTable.concatenate([VariantTable.fromBuffers(encoded[name])])
+    return comparison
 
 def run_snplrr(refContigs, contigSummary, snpTable,
                resP_vs_refMP, resP_vs_refVCF,
                susP_vs_refMP, susP_vs_refVCF,
                susB_vs_refMP, susB_vs_refVCF,
-               syntenyTable, mastTable):
-
+               syntenyTable, mastTable, workers=1, contigs=None,
+               outputFormat='tsv', annotateSNPs=False, motifFlank=0,
+               regionTable=None, windowSize=10000, windowStep=5000, minWindowSNPs=1,
+               jobs=1, checkpoints=None, resume=False):
+    """
+    Runs the comparison as a StageGraph: reference lengths, pileup scan,
+    the three VCF parses and the synteny/MAST loads are independent and
+    run concurrently with jobs > 1 (with jobs == 1 and workers > 1, the
+    VCFs are parsed in one stage on a shared pool); comparison, window
+    scan and output follow. Stage results are checkpointed in checkpoints (if given) and
+    reused with resume, e.g. a new MAST table only re-runs its loading
+    and the output.
+    """
     global logfile
-    contigLengths = getContigLengths_(refContigs, logfile=logfile)
-    crit = GTYPE_HOMOZYGOUS_ALT|GTYPE_HOMOZYGOUS_REF
-    resPSNPs_d, resPSNPs = getVariantData_(resP_vs_refVCF, crit=crit,
-                                           setLabel='resP', logfile=logfile)
-    logfile.write('resPSNPs_d/resPSNPs: %i/%i\n' % (len(resPSNPs), len(resPSNPs)))
-    crit = GTYPE_HOMOZYGOUS_ALT
-    susPSNPs_d, susPSNPs = getVariantData_(susP_vs_refVCF, crit=crit,
-                                           setLabel='susP', logfile=logfile)
-    logfile.write('susPSNPs_d/susPSNPs: %i/%i\n' % (len(susPSNPs), len(susPSNPs)))
-    susBSNPs_d, susBSNPs = getVariantData_(susB_vs_refVCF, crit=crit,
-                                           setLabel='susBulk', logfile=logfile)
-    logfile.write('susBSNPs_d/susBSNPs: %i/%i\n' % (len(susBSNPs), len(susBSNPs)))
+    graph = StageGraph(checkpoints=checkpoints, resume=resume, logfile=logfile)
+
+    def getLengths(results, log):
+        contigLengths = getContigLengths_(refContigs, logfile=log)
+        if contigs is not None:
+            contigLengths = dict((contig, contigLengths[contig])
+                                 for contig in contigs if contig in contigLengths)
+        return contigLengths
+    graph.add('contigLengths', getLengths, inputs=[refContigs], options=dict(contigs=contigs))
+
+    pileups = [resP_vs_refMP, susP_vs_refMP, susB_vs_refMP]
+    if any(pileups):
+        graph.add('pileups', lambda results, log: scanPileups_(pileups, results['contigLengths'],
+                                                               susP_vs_refVCF, contigs=contigs,
+                                                               logfile=log),
+                  deps=['contigLengths'], inputs=pileups + [susP_vs_refVCF],
+                  options=dict(contigs=contigs), deferred=True)
+
+    ctrlCrit = GTYPE_HOMOZYGOUS_ALT|GTYPE_HOMOZYGOUS_REF
+    labels = ['resP', 'susP', 'susBulk']
+    vcfs = [resP_vs_refVCF, susP_vs_refVCF, susB_vs_refVCF]
+    crits = [ctrlCrit, GTYPE_HOMOZYGOUS_ALT, GTYPE_HOMOZYGOUS_ALT]
+    if jobs == 1 and workers > 1:
+        # stages run one at a time: parse the three VCFs concurrently on one pool
+        graph.add('variants', lambda results, log:
+                  getVariantDataParallel_(vcfs, labels, crits, workers=workers,
+                                          contigs=contigs, logfile=log),
+                  inputs=vcfs, options=dict(crits=crits, contigs=contigs, decoder=DECODER_VERSION),
+                  encode=lambda data: [_encodeVariantData(d) for d in data],
+                  decode=lambda encoded: [_restoreVariantData(e) for e in encoded])
+        variantStages = ['variants']
+    else:
+        for label, vcf, crit in zip(labels, vcfs, crits):
+            graph.add(label, lambda results, log, label=label, vcf=vcf, crit=crit:
+                      readVariants_(vcf, label, crit, workers=workers, contigs=contigs, logfile=log),
+                      inputs=[vcf], options=dict(crit=crit, contigs=contigs, decoder=DECODER_VERSION),
+                      encode=_encodeVariantData, decode=_restoreVariantData)
+        variantStages = labels
+
+    def loadSynteny(results, log):
+        with telemetry.stage('Loading synteny table', inputs=[syntenyTable]) as stage:
+            intervals = IntervalIndex() if annotateSNPs else None
+            syntenyInfo = getSyntenyInformation(syntenyTable, intervals=intervals)
+            stage.records = len(syntenyInfo)
+        return syntenyInfo, intervals
+    graph.add('synteny', loadSynteny, inputs=[syntenyTable], options=dict(annotateSNPs=annotateSNPs))
+
+    def loadMAST(results, log):
+        with telemetry.stage('Loading MAST table', inputs=[mastTable]) as stage:
+            intervals = IntervalIndex() if annotateSNPs else None
+            mastInfo = getMASTInformation(mastTable, intervals=intervals)
+            stage.records = len(mastInfo)
+        return mastInfo, intervals
+    graph.add('mast', loadMAST, inputs=[mastTable], options=dict(annotateSNPs=annotateSNPs))
+
+    def compare(results, log):
+        (resPSNPs_d, resPSNPs), (susPSNPs_d, susPSNPs), (susBSNPs_d, susBSNPs) = \
+            results['variants'] if 'variants' in results else [results[label] for label in labels]
+        log.write('resPSNPs_d/resPSNPs: %i/%i\n' % (len(resPSNPs), len(resPSNPs)))
+        log.write('susPSNPs_d/susPSNPs: %i/%i\n' % (len(susPSNPs), len(susPSNPs)))
+        log.write('susBSNPs_d/susBSNPs: %i/%i\n' % (len(susBSNPs), len(susBSNPs)))
+        return compareVariants_(results['contigLengths'], resPSNPs, susPSNPs_d, susPSNPs,
+                                susBSNPs_d, susBSNPs, logfile=log)
+    graph.add('comparison', compare, deps=['contigLengths'] + variantStages,
+              encode=_encodeComparison, decode=_decodeComparison)
+
+    if regionTable is not None:
+        graph.add('regions', lambda results, log: scanRegions_(results['comparison'],
+                                                               results['contigLengths'],
+                                                               windowSize, windowStep,
+                                                               minWindowSNPs=minWindowSNPs,
+                                                               logfile=log),
+                  deps=['contigLengths', 'comparison'],
+                  options=dict(windowSize=windowSize, windowStep=windowStep,
+                               minWindowSNPs=minWindowSNPs))
+
+    def output(results, log):
+        syntenyInfo, syntenyIntervals = results['synteny']
+        mastInfo, mastIntervals = results['mast']
+        annotations = None
+        if annotateSNPs:
+            annotations = [(syntenyIntervals, 0), (mastIntervals, motifFlank)]
+        writeResults_(results['contigLengths'], results['comparison'], syntenyInfo, mastInfo,
+                      annotations, results.get('pileups'), contigSummary, snpTable,
+                      outputFormat=outputFormat, regionTable=regionTable,
+                      regionRows=results.get('regions'), logfile=log)
+    graph.add('output', output, deps=['contigLengths', 'comparison', 'synteny', 'mast'] +
+              (['pileups'] if any(pileups) else []) + (['regions'] if regionTable is not None else []),
+              checkpoint=False)
+
+    graph.run(jobs=jobs)
+    pass
 
-    syntenyInfo = getSyntenyInformation(syntenyTable)
-    mastInfo = getMASTInformation(mastTable)
+
+def compareVariants_(contigLengths, resPSNPs, susPSNPs_d, susPSNPs, susBSNPs_d, susBSNPs,
+                     logfile=sys.stdout):
+    """
+    Compares the susP/susBulk variants (all calls and filtered) against the
+    filtered control variants. Returns {name: value} with the per-contig
+    coverage and SNP counts, the susHomocontigs, the commonSusSNPs (with
+    the aligned susBulk records commonSusBSNPs) and the susPOnlySNPs.
+    """
 
     # variant positions common to susceptible parents and bulk
     #susVarCommon = susPSNPs.intersection(susBSNPs)
@@ -228,30 +861,24 @@ def run_snplrr(refContigs, contigSummary, snpTable,
     # logfile.write('susInvCommon: %i\n' % len(susInvCommon))
     # return None
 
-    logfile.write('Calculating SNP coverage/contig...')
-    logfile.flush()
-    tstamp = time.time()
-    coverage_susP = getAverageSNPCoverage(susPSNPs_d, contigLengths)
-    coverage_susB = getAverageSNPCoverage(susBSNPs_d, contigLengths)
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+    with telemetry.stage('Calculating SNP coverage/contig', logfile) as stage:
+        coverage_susP = getAverageSNPCoverage(susPSNPs_d, contigLengths)
+        coverage_susB = getAverageSNPCoverage(susBSNPs_d, contigLengths)
+        stage.records = len(susPSNPs_d) + len(susBSNPs_d)
 
-    logfile.write('Counting SNPs per contig...')
-    logfile.flush()
-    tstamp = time.time()
-    snpCount_susP = countSNPsPerContig(susPSNPs)
-    snpCount_susB = countSNPsPerContig(susBSNPs)
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+    with telemetry.stage('Counting SNPs per contig', logfile) as stage:
+        snpCount_susP = countSNPsPerContig(susPSNPs)
+        snpCount_susB = countSNPsPerContig(susBSNPs)
+        stage.records = len(susPSNPs) + len(susBSNPs)
 
     # first step
     # any position in the control set that shows a variant
     # cannot be reliably used
     # remove those positions from the susceptible sets
-    logfile.write('Getting rid off variant positions in reference...')
-    logfile.flush()
-    tstamp = time.time()
-    susPSNPs.difference_update(resPSNPs)
-    susBSNPs.difference_update(resPSNPs)
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+    with telemetry.stage('Getting rid off variant positions in reference', logfile) as stage:
+        stage.records = len(susPSNPs) + len(susBSNPs)
+        susPSNPs = susPSNPs.difference(resPSNPs)
+        susBSNPs = susBSNPs.difference(resPSNPs)
     #logfile.write('Getting rid off heterozygous positions in resP...')
     #logfile.flush()
     #tstamp = time.time()
@@ -260,26 +887,21 @@ def run_snplrr(refContigs, contigSummary, snpTable,
     # second step
     # all homozygous SNPs that are common between susceptible parents
     # and bulk may indicate NB-LRR contigs
-    logfile.write('Finding common SNPs between susP and susB...')
-    logfile.flush()
-    tstamp = time.time()
-    commonSusSNPs = susPSNPs.intersection(susBSNPs)
-    snpCount_common = countSNPsPerContig(commonSusSNPs)
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+    with telemetry.stage('Finding common SNPs between susP and susB', logfile) as stage:
+        commonSusSNPs = susPSNPs.intersection(susBSNPs)
+        snpCount_common = countSNPsPerContig(commonSusSNPs)
+        stage.records = len(commonSusSNPs)
 
     # third step
     # take all contigs that contain exclusively common bulk/susP SNPs
     # and no non-shared SNPs
-    logfile.write('Gathering non-chimeric contigs...')
-    logfile.flush()
-    tstamp = time.time()
-    susPOnlySNPs = susPSNPs.difference(susBSNPs)
-    susPOnlyContigs = set([x[0] for x in susPOnlySNPs])
-
-    commonSusContigs = set([x[0] for x in commonSusSNPs])
-    susHomocontigs = commonSusContigs.difference(susPOnlyContigs)
+    with telemetry.stage('Gathering non-chimeric contigs', logfile) as stage:
+        susPOnlySNPs = susPSNPs.difference(susBSNPs)
+        susPOnlyContigs = susPOnlySNPs.getContigs()
 
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+        commonSusContigs = commonSusSNPs.getContigs()
+        susHomocontigs = commonSusContigs.difference(susPOnlyContigs)
+        stage.records = len(susHomocontigs)
 
     logfile.write('commonSusSNPs: %i\n' % len(commonSusSNPs))
     logfile.write('commonSusContigs: %i\n' % len(commonSusContigs))
@@ -287,59 +909,423 @@ def run_snplrr(refContigs, contigSummary, snpTable,
     logfile.write('susPOnlyContigs: %i\n' % len(susPOnlyContigs))
     logfile.write('susHomocontigs: %i\n' % len(susHomocontigs))
 
-    logfile.write('Writing contig information...')
-    logfile.flush()
-    tstamp = time.time()
-    out_contigSummary = open(contigSummary, 'wb')
-
-    out_contigSummary.write('\t'.join(CONTIG_TABLEHEADER) + '\n')
-
+    return dict(coverage_susP=coverage_susP, coverage_susB=coverage_susB,
+                snpCount_susP=snpCount_susP, snpCount_susB=snpCount_susB,
+                snpCount_common=snpCount_common, susHomocontigs=susHomocontigs,
+                commonSusSNPs=commonSusSNPs, commonSusBSNPs=commonSusSNPs.align(susBSNPs),
+                susPOnlySNPs=susPOnlySNPs)
 
 
+def scanRegions_(comparison, contigLengths, windowSize, windowStep, minWindowSNPs=1,
+                 logfile=sys.stdout):
+    """
+    Returns the region table rows (getRegionValues) of the partially
+    chimeric contigs: clean windows with common but without susP-only SNPs.
+    """
+    commonSusSNPs, susPOnlySNPs = comparison['commonSusSNPs'], comparison['susPOnlySNPs']
+    with telemetry.stage('Scanning SNP windows', logfile) as stage:
+        privateRuns = dict((cid, (start, end)) for cid, start, end in susPOnlySNPs.contigRuns())
+        regionRows = []
+        for cid, start, end in commonSusSNPs.sortedContigRuns():
+            contig = commonSusSNPs.contigs.name(cid)
+            pStart, pEnd = privateRuns.get(cid, (0, 0))
+            regions = getCleanRegions(list(map(POS_MASK.__and__, commonSusSNPs.keys[start:end])),
+                                      list(map(POS_MASK.__and__, susPOnlySNPs.keys[pStart:pEnd])),
+                                      contigLengths.get(contig, 0), windowSize, windowStep,
+                                      minSNPs=minWindowSNPs)
+            regionRows.extend(getRegionValues(contig, regions, windowSize, pEnd > pStart))
+        stage.records = len(commonSusSNPs) + len(susPOnlySNPs)
+    logfile.write('candidate regions: %i\n' % len(regionRows))
+    return regionRows
+
+
+def writeResults_(contigLengths, comparison, syntenyInfo, mastInfo, annotations, pileupData,
+                  contigSummary, snpTable, outputFormat='tsv', regionTable=None, regionRows=None,
+                  logfile=sys.stdout):
+    """
+    Writes the contig summary, the SNP table and (with regionTable) the
+    region table of a comparison (compareVariants_).
+    """
+    if regionTable is not None:
+        writeRegionTable(regionTable, regionRows, outputFormat=outputFormat)
+
+    commonSusSNPs, commonSusBSNPs = comparison['commonSusSNPs'], comparison['commonSusBSNPs']
+    susHomocontigs = comparison['susHomocontigs']
+    with telemetry.stage('Writing contig information', logfile) as stage:
+        rows = [getContigValues(contig, contigLengths.get(contig, 0),
+                                comparison['coverage_susP'].get(contig, 0),
+                                comparison['coverage_susB'].get(contig, 0),
+                                comparison['snpCount_susP'].get(contig, 0),
+                                comparison['snpCount_susB'].get(contig, 0),
+                                comparison['snpCount_common'].get(contig, 0),
+                                syntenyInfo.get(contig, ['NA']),
+                                mastInfo.get(contig, ['NA']))
+                for contig in sorted(susHomocontigs)]
+        writeContigSummary(contigSummary, rows, pileupData, outputFormat=outputFormat)
+
+        header, types = getSNPHeader(pileupData, annotations)
+        out_snpTable = openTable(snpTable, header, types, formatSNPBlock,
+                                 outputFormat=outputFormat)
+        for cid, start, end in commonSusSNPs.sortedContigRuns():
+            for blockStart in range(start, end, OUTPUT_BLOCK_ROWS):
+                out_snpTable.writeBlock(getSNPColumns(commonSusSNPs, commonSusBSNPs, blockStart,
+                                                      min(end, blockStart + OUTPUT_BLOCK_ROWS),
+                                                      pileupData=pileupData,
+                                                      annotations=annotations))
+        out_snpTable.close()
+        stage.records = len(susHomocontigs) + len(commonSusSNPs)
+    pass
 
 
-    for contig in sorted(susHomocontigs):
-        row = [contig, contigLengths.get(contig, 0),
-               '%.3f' % coverage_susP.get(contig, 0),
-               '%.3f' % coverage_susB.get(contig, 0),
-               int(snpCount_susP.get(contig, 0)),
-               int(snpCount_susB.get(contig, 0)),
-               int(snpCount_common.get(contig, 0))]
-        if row[1] == 0:
-            row.extend(['NA', 'NA', 'NA'])
-        else:
-            row.extend(['%.3f' % (row[-3]/float(row[1])),
-                        '%.3f' % (row[-2]/float(row[1])),
-                        '%.3f' % (row[-1]/float(row[1]))])
-        row[4:7] = map(lambda x:'%.3f'%x, row[4:7])
+def compareSamples_(contigLengths, resPSNPs, susPSNPs_d, susPSNPs, susBSNPs_d, susBSNPs,
+                    syntenyInfo, mastInfo, annotations, collectPileups,
+                    contigSummary, snpTable, outputFormat='tsv',
+                    regionTable=None, windowSize=10000, windowStep=5000, minWindowSNPs=1):
+    """
+    Compares the susP/susBulk variants (all calls and filtered) against the
+    filtered control variants and writes the contig summary, the SNP table
+    and (optionally) the region table.
+    """
+    global logfile
+    comparison = compareVariants_(contigLengths, resPSNPs, susPSNPs_d, susPSNPs,
+                                  susBSNPs_d, susBSNPs, logfile=logfile)
+    regionRows = None
+    if regionTable is not None:
+        regionRows = scanRegions_(comparison, contigLengths, windowSize, windowStep,
+                                  minWindowSNPs=minWindowSNPs, logfile=logfile)
+    pileupData = collectPileups() if collectPileups is not None else None
+    writeResults_(contigLengths, comparison, syntenyInfo, mastInfo, annotations, pileupData,
+                  contigSummary, snpTable, outputFormat=outputFormat, regionTable=regionTable,
+                  regionRows=regionRows, logfile=logfile)
+    pass
 
-        row.append(','.join(sorted(syntenyInfo.get(contig, ['NA']))))
 
-        # don't like this so much
-        def f(x):
-            return ('%s/%s' % x) if x != 'NA' else x
-        row.append(','.join(sorted(map(f, mastInfo.get(contig, ['NA'])))))
+def run_snplrr_merge(refContigs, contigSummary, snpTable,
+                     resP_vs_refMP, resP_vs_refVCF,
+                     susP_vs_refMP, susP_vs_refVCF,
+                     susB_vs_refMP, susB_vs_refVCF,
+                     syntenyTable, mastTable, contigs=None, outputFormat='tsv',
+                     annotateSNPs=False, motifFlank=0,
+                     regionTable=None, windowSize=10000, windowStep=5000, minWindowSNPs=1,
+                     maxMemory=None):
+    """
+    Streaming variant of run_snplrr for VCFs that are coordinate-sorted in
+    reference order: the three VCFs are merged position by position and
+    only the state of the current contig is kept in memory.
+    With maxMemory (bytes), the VCFs need not be sorted: their records are
+    sorted externally in runs that fit into maxMemory and merged in contig
+    name order, contig lengths are looked up in an externally sorted stream
+    of the index, and the pileups are scanned afterwards for the contigs
+    with common SNPs only.
+    """
+    global logfile
+    ctrlCrit = GTYPE_HOMOZYGOUS_ALT|GTYPE_HOMOZYGOUS_REF
+    susCrit = GTYPE_HOMOZYGOUS_ALT
+    vcfs = [resP_vs_refVCF, susP_vs_refVCF, susB_vs_refVCF]
+    pileups = [resP_vs_refMP, susP_vs_refMP, susB_vs_refMP]
+    tmpdir = os.path.dirname(os.path.abspath(snpTable))
+    collectPileups, reference = None, None
+    if maxMemory is None:
+        reference = FastaIndex(refContigs)
+        contigNames = reference.names()
+        contigLengths = reference.getLengths()
+        contigRank = dict((contig, i) for i, contig in enumerate(contigNames))
+        if contigs is not None:
+            contigLengths = dict((contig, contigLengths[contig])
+                                 for contig in contigs if contig in contigLengths)
+        getLength = lambda contig: contigLengths.get(contig, 0)
+        records = (((contigNames[rank], pos), data) for (rank, pos), data
+                   in mergeSortedVCFs(vcfs, contigRank, contigs=contigs))
+        if any(pileups):
+            collectPileups = scanPileups_(pileups, contigLengths, susP_vs_refVCF,
+                                          contigs=contigs, logfile=logfile)
+        label = 'Merging sorted SNP data from resP/susP/susBulk'
+    else:
+        maxRecords = max(MIN_SORT_RECORDS, maxMemory // SORT_RECORD_SIZE)
+        logfile.write('Sorting SNP data externally in runs of %i records.\n' % maxRecords)
+        getLength = getSortedContigLengths(refContigs, maxRecords, tmpdir=tmpdir).get
+        records = mergeVariantRuns(vcfs, maxRecords, contigs=contigs, tmpdir=tmpdir)
+        label = 'Sorting and merging SNP data from resP/susP/susBulk'
+    # lengths of the contigs with common SNPs (pileup scan after the merge)
+    snpContigLengths = {}
+    syntenyInfo, mastInfo, annotations = getAnnotations_(syntenyTable, mastTable,
+                                                         annotateSNPs=annotateSNPs,
+                                                         motifFlank=motifFlank)
+
+    with telemetry.stage(label, logfile, inputs=vcfs) as stage:
+        summaryRows = {}
+        # SNP rows are spilled per contig and reassembled in sorted contig order
+        snpChunks = {}
+        spill = tempfile.TemporaryFile(dir=tmpdir)
+        counts = dict(commonSusSNPs=0, commonSusContigs=0, susPOnlySNPs=0,
+                      susPOnlyContigs=0, susHomocontigs=0)
+        # window scan (regionTable): {contig: region rows}
+        regionRows = {}
+
+        def flushContig(contig, state):
+            length = getLength(contig)
+            depthP, nP, depthB, nB, countP, countB, common, pOnly, offset, \
+                commonPositions, privatePositions = state
+            if common:
+                snpChunks[contig] = (offset, spill.tell())
+                snpContigLengths[contig] = length
+                counts['commonSusContigs'] += 1
+                if regionTable is not None:
+                    regions = getCleanRegions(commonPositions, privatePositions,
+                                              length, windowSize, windowStep,
+                                              minSNPs=minWindowSNPs)
+                    regionRows[contig] = getRegionValues(contig, regions, windowSize, pOnly > 0)
+            if pOnly:
+                counts['susPOnlyContigs'] += 1
+            counts['commonSusSNPs'] += common
+            counts['susPOnlySNPs'] += pOnly
+            if common and not pOnly:
+                counts['susHomocontigs'] += 1
+                summaryRows[contig] = getContigValues(
+                    contig, length,
+                    depthP / float(nP) if nP else 0,
+                    depthB / float(nB) if nB else 0,
+                    countP, countB, common,
+                    syntenyInfo.get(contig, ['NA']),
+                    mastInfo.get(contig, ['NA']))
+            pass
+
+        currentContig, state, nrecords = None, None, 0
+        for (contig, pos), (dR, dP, dB) in records:
+            nrecords += 1
+            if contig != currentContig:
+                if currentContig is not None:
+                    flushContig(currentContig, state)
+                currentContig = contig
+                state = [0, 0, 0, 0, 0, 0, 0, 0, spill.tell(), [], []]
+            inP = dP is not None and (dP[-1] & susCrit) == susCrit
+            inB = dB is not None and (dB[-1] & susCrit) == susCrit
+            if dP is not None:
+                state[0] += dP[0]
+                state[1] += 1
+            if dB is not None:
+                state[2] += dB[0]
+                state[3] += 1
+            state[4] += inP
+            state[5] += inB
+            # any position in the control set that shows a variant
+            # cannot be reliably used
+            if dR is not None and (dR[-1] & ctrlCrit) == ctrlCrit:
+                continue
+            if inP and inB:
+                state[6] += 1
+                spill.write(formatSNPRow(contig, pos, dP, dB))
+                if regionTable is not None:
+                    state[9].append(pos)
+            elif inP:
+                state[7] += 1
+                if regionTable is not None:
+                    state[10].append(pos)
+        if currentContig is not None:
+            flushContig(currentContig, state)
+        stage.records = nrecords
+
+    if maxMemory is not None and any(pileups):
+        collectPileups = scanPileups_(pileups, snpContigLengths, susP_vs_refVCF,
+                                      contigs=set(snpContigLengths), logfile=logfile)
+
+    for key in ['commonSusSNPs', 'commonSusContigs', 'susPOnlySNPs',
+                'susPOnlyContigs', 'susHomocontigs']:
+        logfile.write('%s: %i\n' % (key, counts[key]))
+
+    if regionTable is not None:
+        with telemetry.stage('Writing candidate regions', logfile) as stage:
+            rows = [row for contig in sorted(regionRows) for row in regionRows[contig]]
+            writeRegionTable(regionTable, rows, outputFormat=outputFormat)
+            stage.records = len(rows)
+        logfile.write('candidate regions: %i\n' % len(rows))
+
+    pileupData = collectPileups() if collectPileups is not None else None
+
+    with telemetry.stage('Writing contig information', logfile) as stage:
+        writeContigSummary(contigSummary, [summaryRows[contig] for contig in sorted(summaryRows)],
+                           pileupData, outputFormat=outputFormat)
+
+        header, types = getSNPHeader(pileupData, annotations)
+        out_snpTable = openTable(snpTable, header, types, formatSNPBlock,
+                                 outputFormat=outputFormat)
+        # spilled rows are copied as they are unless columns are added
+        reformat = outputFormat == 'columnar' or pileupData or annotations
+        for contig in sorted(snpChunks):
+            start, end = snpChunks[contig]
+            spill.seek(start)
+            while reformat and start < end:
+                lines = []
+                while start < end and len(lines) < OUTPUT_BLOCK_ROWS:
+                    lines.append(spill.readline())
+                    start += len(lines[-1])
+                columns = parseSNPRows(lines)
+                columns.extend(getSNPExtraColumns(contig, columns[1], pileupData=pileupData,
+                                                  annotations=annotations))
+                out_snpTable.writeBlock(columns)
+            while start < end:
+                block = spill.read(min(SPILL_BLOCK_SIZE, end - start))
+                out_snpTable.writeLines(block)
+                start += len(block)
+        out_snpTable.close()
+        spill.close()
+        if reference is not None:
+            reference.close()
+        stage.records = len(summaryRows) + counts['commonSusSNPs']
+    pass
 
-        out_contigSummary.write('\t'.join(map(str, row)) + '\n')
-    out_contigSummary.close()
 
-    out_snpTable = open(snpTable, 'wb')
-    out_snpTable.write('\t'.join(SNP_TABLEHEADER) + '\n')
+def readBatchManifest(fn):
+    """
+    Returns the sample pairs ({column: value or None}) of a tab-separated
+    batch manifest. The header line names the columns (BATCH_COLUMNS are
+    required, BATCH_OPTIONAL_COLUMNS optional); empty values and '-' are
+    missing values, lines starting with '#' are comments.
+    """
+    pairs, header = [], None
+    for line in open(fn):
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if header is None:
+            header = [field.strip() for field in fields]
+            unknown = [col for col in header if col not in BATCH_COLUMNS + BATCH_OPTIONAL_COLUMNS]
+            missing = [col for col in BATCH_COLUMNS if col not in header]
+            if unknown or missing:
+                raise ValueError('%s: unknown columns %s, missing columns %s.' %
+                                 (fn, ','.join(unknown) or '-', ','.join(missing) or '-'))
+            continue
+        if len(fields) > len(header):
+            raise ValueError('%s: too many fields in line %s.' % (fn, line))
+        fields += [''] * (len(header) - len(fields))
+        pair = dict.fromkeys(BATCH_COLUMNS + BATCH_OPTIONAL_COLUMNS)
+        for col, value in zip(header, fields):
+            if value.strip() not in ('', '-'):
+                pair[col] = value.strip()
+        missing = [col for col in BATCH_COLUMNS if pair[col] is None]
+        if missing:
+            raise ValueError('%s: no %s in line %s.' % (fn, ','.join(missing), line))
+        if pair['label'] is None:
+            pair['label'] = 'pair%i' % (len(pairs) + 1)
+        pairs.append(pair)
+    return pairs
+
+# inputs shared by the sample pairs of a batch run (inherited by the workers)
+batchInputs = None
+
+def _runBatchPair(pair):
+    """
+    Compares one sample pair of a batch against the shared inputs;
+    returns (success, log).
+    """
+    global logfile
+    contigLengths, resP_vs_refMP, resPSNPs, syntenyInfo, mastInfo, annotations, options = batchInputs
+    batchLogfile, logfile = logfile, io.BytesIO()
+    try:
+        try:
+            pileups = [resP_vs_refMP, pair['susP-vs-resMP'], pair['susBulk-vs-resMP']]
+            collectPileups = None
+            if any(pileups):
+                collectPileups = scanPileups_(pileups, contigLengths, pair['susP-vs-resVCF'],
+                                              contigs=options['contigs'], logfile=logfile,
+                                              background=False)
+            crit = GTYPE_HOMOZYGOUS_ALT
+            susPSNPs_d, susPSNPs = getVariantData_(pair['susP-vs-resVCF'], crit=crit, setLabel='susP',
+                                                   contigs=options['contigs'], logfile=logfile)
+            susBSNPs_d, susBSNPs = getVariantData_(pair['susBulk-vs-resVCF'], crit=crit, setLabel='susBulk',
+                                                   contigs=options['contigs'], logfile=logfile)
+            logfile.write('susPSNPs_d/susPSNPs: %i/%i\n' % (len(susPSNPs), len(susPSNPs)))
+            logfile.write('susBSNPs_d/susBSNPs: %i/%i\n' % (len(susBSNPs), len(susBSNPs)))
+            compareSamples_(contigLengths, resPSNPs, susPSNPs_d, susPSNPs, susBSNPs_d, susBSNPs,
+                            syntenyInfo, mastInfo, annotations, collectPileups,
+                            pair['contig-summary'], pair['snp-table'],
+                            outputFormat=options['outputFormat'], regionTable=pair['region-table'],
+                            windowSize=options['windowSize'], windowStep=options['windowStep'],
+                            minWindowSNPs=options['minWindowSNPs'])
+            success = True
+        except Exception:
+            logfile.write('\n' + traceback.format_exc())
+            success = False
+        return success, logfile.getvalue()
+    finally:
+        logfile = batchLogfile
+
+
+def run_snplrr_batch(refContigs, pairs, resP_vs_refMP, resP_vs_refVCF,
+                     syntenyTable, mastTable, workers=1, contigs=None,
+                     outputFormat='tsv', annotateSNPs=False, motifFlank=0,
+                     windowSize=10000, windowStep=5000, minWindowSNPs=1):
+    """
+    Compares many susP/susBulk pairs (readBatchManifest) against one
+    control: the reference, the control VCF and the annotation tables are
+    loaded once, then the pairs are compared on a pool of worker processes
+    that share the loaded inputs copy-on-write. Each pair's log goes to
+    its logfile or, without one, into the batch log in manifest order.
+    Returns the number of failed pairs.
+    """
+    global logfile
+    global batchInputs
+    contigLengths = getContigLengths_(refContigs, logfile=logfile)
+    if contigs is not None:
+        contigLengths = dict((contig, contigLengths[contig])
+                             for contig in contigs if contig in contigLengths)
+    resPSNPs_d, resPSNPs = getVariantData_(resP_vs_refVCF, crit=GTYPE_HOMOZYGOUS_ALT|GTYPE_HOMOZYGOUS_REF,
+                                           setLabel='resP', contigs=contigs, logfile=logfile)
+    logfile.write('resPSNPs_d/resPSNPs: %i/%i\n' % (len(resPSNPs), len(resPSNPs)))
+    syntenyInfo, mastInfo, annotations = getAnnotations_(syntenyTable, mastTable,
+                                                         annotateSNPs=annotateSNPs,
+                                                         motifFlank=motifFlank)
+    batchInputs = (contigLengths, resP_vs_refMP, resPSNPs, syntenyInfo, mastInfo, annotations,
+                   dict(contigs=contigs, outputFormat=outputFormat, windowSize=windowSize,
+                        windowStep=windowStep, minWindowSNPs=minWindowSNPs))
+
+    workers = max(1, min(workers, len(pairs)))
+    label = 'Comparing %i sample pairs (%i workers)' % (len(pairs), workers)
+    with telemetry.stage(label, logfile, inputs=[pair[col] for pair in pairs for col in
+                                                 ['susP-vs-resVCF', 'susBulk-vs-resVCF']]) as stage:
+        if workers > 1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_runBatchPair, pairs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_runBatchPair(pair) for pair in pairs]
+        stage.records = len(pairs)
+    batchInputs = None
+
+    failed = 0
+    for pair, (success, log) in zip(pairs, results):
+        logfile.write('%s: %s\n' % (pair['label'], 'done' if success else 'FAILED'))
+        if pair['logfile'] is not None:
+            with open(pair['logfile'], 'wb') as out:
+                out.write(log)
+        else:
+            logfile.write(log)
+        failed += not success
+    return failed
 
-    #                (int(genotype_fields[3]), alt, ref, genotype))
-    # ref, alt, cov, alt, cov
 
-    NA = ('NA', 'NA')
-    for contig, pos in sorted(commonSusSNPs, key=lambda x:(x[0],int(x[1]))):
-        # (list(reversed(resPSNPs_d.get((contig, pos), NA)[:-1]))) + \
-        row = [contig, pos,] + \
-               (list(reversed(susPSNPs_d.get((contig, pos), NA)[:-1]))) + \
-               (list(reversed(susBSNPs_d.get((contig, pos), NA)[:-2])))
-        row.append('YES' if row[-2] == row[-4] else 'NO')
-        out_snpTable.write('\t'.join(map(str, row)) + '\n')
-    out_snpTable.close()
-
-    logfile.write(' %is\n' % int((time.time() - tstamp) + 0.5))
+def mergeShards(nshards, contigSummary, snpTable, regionTable=None, outputFormat='tsv'):
+    """
+    Merges the partial outputs of shards 1..nshards (getShardFile) into
+    the given result tables.
+    """
+    tables = [(contigSummary, LAYOUT_ROWS), (snpTable, LAYOUT_CONTIG), (regionTable, LAYOUT_ROWS)]
+    try:
+        for fn, layout in tables:
+            if fn is None:
+                continue
+            partials = [getShardFile(fn, shard, nshards) for shard in range(1, nshards + 1)]
+            if outputFormat == 'columnar':
+                mergeColumnar(partials, fn, layout, OUTPUT_BLOCK_ROWS)
+            else:
+                mergeTSV(partials, fn)
+    except (IOError, ValueError) as e:
+        sys.stderr.write('Error: %s\n' % e)
+        sys.exit(1)
     pass
 
 
@@ -362,6 +1348,29 @@ def main(argv):
     parser.add_argument('--synteny-table')
     parser.add_argument('--mast-table')
     parser.add_argument('--logfile', help='A log file.', default='snplrr.log')
+    parser.add_argument('--regions', help='Comma-separated list of contigs to restrict the analysis to.')
+    parser.add_argument('--contigs-file', help='File with contigs (one per line) to restrict the analysis to.')
+    parser.add_argument('--cache-dir', default=os.environ.get('SNPLRR_CACHE_DIR'), help='Directory for cached parsed inputs (default: $SNPLRR_CACHE_DIR, no caching if unset).')
+    parser.add_argument('--cache-size', type=int, default=10240, help='Size limit of the cache and checkpoint directories in MB.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes used to parse the VCF files.')
+    parser.add_argument('--max-memory', type=int, metavar='MB', help='Memory budget in MB: if the VCFs would not fit, their records are sorted externally in runs on disk (next to the SNP table) and merged, and the pileups are only scanned for contigs with common SNPs.')
+    parser.add_argument('--sorted-input', action='store_true', help='VCF files are coordinate-sorted in reference order: compare them in a single streaming merge with memory bounded by one contig.')
+    parser.add_argument('--metrics', help='Write per-stage metrics (wall/CPU time, records, bytes read, peak RSS) as JSON lines to this file.')
+    parser.add_argument('--profile', help='Dump cProfile statistics of each stage into this directory.')
+    parser.add_argument('--annotate-snps', action='store_true', help='Add the synteny genes and MAST motifs overlapping each SNP to the SNP table (needs coordinates in the synteny/MAST tables).')
+    parser.add_argument('--motif-flank', type=int, default=0, help='With --annotate-snps, also report motifs within this many bp of a SNP.')
+    parser.add_argument('--region-table', help='Scan common/susP-only SNPs in sliding windows and write the maximal clean windows of every contig with common SNPs as candidate regions (tabular).')
+    parser.add_argument('--window-size', type=int, default=10000, help='Window size of the region scan in bp.')
+    parser.add_argument('--window-step', type=int, help='Step between windows of the region scan in bp (default: half the window size).')
+    parser.add_argument('--min-window-snps', type=int, default=1, help='Minimum number of common SNPs in a clean window.')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='tsv', help='Format of the contig summary and SNP table: tab-separated text or binary columnar tables (read with columnar.py).')
+    parser.add_argument('--stage-jobs', type=int, default=1, help='Number of independent stages (reference, VCF parses, annotation tables) run concurrently in separate processes.')
+    parser.add_argument('--checkpoint-dir', help='Directory for checkpoints of the stage results.')
+    parser.add_argument('--resume', action='store_true', help='Reuse the checkpoints in --checkpoint-dir: only stages whose inputs or options changed (and the stages depending on them) run again.')
+    parser.add_argument('--shard', help='Run shard i/N (e.g. 3/8) of the contigs only; outputs, logfile and metrics get the suffix .shard<i>of<N>.')
+    parser.add_argument('--shard-weight', choices=SHARD_WEIGHTS, default='length', help='Balance the shards by contig length or by the size of the susP VCF records per contig (a proxy for SNP counts).')
+    parser.add_argument('--merge-shards', type=int, metavar='N', help='Merge the outputs of shards 1/N..N/N of an otherwise identical command line into the contig summary, SNP table and region table.')
+    parser.add_argument('--batch', help='Tab-separated manifest of susP/susBulk pairs to compare against the same control in one run: the reference, control VCF and synteny/MAST tables are loaded once and --workers pairs are compared at a time. The header names the columns after the options (%s; optional: %s).' % (', '.join(BATCH_COLUMNS), ', '.join(BATCH_OPTIONAL_COLUMNS)))
 
 
     args = parser.parse_args()
@@ -376,16 +1385,128 @@ def main(argv):
         sys.stderr.write('Error: Invalid input parameters.\n')
         sys.exit(1)
 
+    contigs = getContigSelection(args.regions, args.contigs_file)
+
+    windowStep = args.window_step if args.window_step is not None else max(1, args.window_size // 2)
+    if args.window_size < 1 or not 1 <= windowStep <= args.window_size:
+        sys.stderr.write('Error: --window-size must be positive and --window-step between 1 and the window size.\n')
+        sys.exit(1)
+
+    if args.merge_shards is not None:
+        if args.merge_shards < 1 or args.shard or args.batch:
+            sys.stderr.write('Error: --merge-shards needs a positive number of shards and excludes --shard/--batch.\n')
+            sys.exit(1)
+        mergeShards(args.merge_shards, args.contig_summary, args.snp_table, args.region_table,
+                    outputFormat=args.output_format)
+        return
+
+    if args.shard:
+        if args.batch:
+            sys.stderr.write('Error: --shard cannot be combined with --batch.\n')
+            sys.exit(1)
+        try:
+            shard, nshards = parseShard(args.shard)
+            if args.shard_weight == 'snps':
+                if getCompression(args.susP_vs_resVCF) not in (COMPRESSION_NONE, COMPRESSION_BGZF):
+                    raise ValueError('--shard-weight snps needs a plain or BGZF susP VCF.')
+                weights = getRecordWeights(args.susP_vs_resVCF)
+            else:
+                weights = FastaIndex(args.refcontigs).getLengths()
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write('Error: %s\n' % e)
+            sys.exit(1)
+        if contigs is not None:
+            weights = dict((contig, weights[contig]) for contig in weights if contig in contigs)
+        contigs = getShardContigs(weights, shard, nshards)
+        for name in ['contig_summary', 'snp_table', 'region_table', 'logfile', 'metrics']:
+            if getattr(args, name) is not None:
+                setattr(args, name, getShardFile(getattr(args, name), shard, nshards))
+
+    pairs = None
+    if args.batch:
+        if args.sorted_input:
+            sys.stderr.write('Error: --batch cannot be combined with --sorted-input.\n')
+            sys.exit(1)
+        try:
+            pairs = readBatchManifest(args.batch)
+        except (IOError, ValueError) as e:
+            sys.stderr.write('Error: %s\n' % e)
+            sys.exit(1)
+
+    if args.stage_jobs < 1 or (args.resume and not args.checkpoint_dir):
+        sys.stderr.write('Error: --stage-jobs must be positive and --resume needs --checkpoint-dir.\n')
+        sys.exit(1)
+    maxMemory = None
+    if args.max_memory is not None:
+        if args.max_memory < 1 or args.batch:
+            sys.stderr.write('Error: --max-memory must be positive and cannot be combined with --batch.\n')
+            sys.exit(1)
+        try:
+            estimate = estimateVariantMemory([args.controlVCF, args.susP_vs_resVCF, args.susBulk_vs_resVCF])
+        except OSError as e:
+            sys.stderr.write('Error: %s\n' % e)
+            sys.exit(1)
+        # in-memory comparison as long as it fits
+        if estimate > args.max_memory << 20:
+            maxMemory = args.max_memory << 20
+    checkpoints = None
+    if args.checkpoint_dir:
+        checkpoints = ParseCache(args.checkpoint_dir, maxSize=args.cache_size << 20)
+
+    global cache
+    if args.cache_dir:
+        cache = ParseCache(args.cache_dir, maxSize=args.cache_size << 20)
+
+    global telemetry
+    telemetry = Telemetry(metricsFile=args.metrics, profileDir=args.profile)
+
     global logfile
     logfile = open(args.logfile, 'wb')
     logfile.write(str(input) + '\n')
+    if maxMemory is not None:
+        logfile.write('The VCFs exceed the memory budget of %i MB: sorting them externally.\n' % args.max_memory)
     #logfile.close()
     #sys.exit()
-    run_snplrr(args.refcontigs, args.contig_summary, args.snp_table,
-               args.controlMP, args.controlVCF, args.susP_vs_resMP,
-               args.susP_vs_resVCF, args.susBulk_vs_resMP, args.susBulk_vs_resVCF,
-               args.synteny_table, args.mast_table)
+    failed = 0
+    if pairs is not None:
+        failed = run_snplrr_batch(args.refcontigs, pairs, args.controlMP, args.controlVCF,
+                                  args.synteny_table, args.mast_table, workers=args.workers,
+                                  contigs=contigs, outputFormat=args.output_format,
+                                  annotateSNPs=args.annotate_snps, motifFlank=args.motif_flank,
+                                  windowSize=args.window_size, windowStep=windowStep,
+                                  minWindowSNPs=args.min_window_snps)
+    elif args.sorted_input or maxMemory is not None:
+        try:
+            run_snplrr_merge(args.refcontigs, args.contig_summary, args.snp_table,
+                             args.controlMP, args.controlVCF, args.susP_vs_resMP,
+                             args.susP_vs_resVCF, args.susBulk_vs_resMP, args.susBulk_vs_resVCF,
+                             args.synteny_table, args.mast_table, contigs=contigs,
+                             outputFormat=args.output_format, annotateSNPs=args.annotate_snps,
+                             motifFlank=args.motif_flank, regionTable=args.region_table,
+                             windowSize=args.window_size, windowStep=windowStep,
+                             minWindowSNPs=args.min_window_snps, maxMemory=maxMemory)
+        except ValueError as e:
+            # readVCFSorted: unsorted input or contigs missing from the reference
+            hint = ''
+            if maxMemory is None:
+                hint = ' Run without --sorted-input or with --max-memory.'
+            sys.stderr.write('Error: %s%s\n' % (e, hint))
+            sys.exit(1)
+    else:
+        run_snplrr(args.refcontigs, args.contig_summary, args.snp_table,
+                   args.controlMP, args.controlVCF, args.susP_vs_resMP,
+                   args.susP_vs_resVCF, args.susBulk_vs_resMP, args.susBulk_vs_resVCF,
+                   args.synteny_table, args.mast_table, workers=args.workers,
+                   contigs=contigs, outputFormat=args.output_format,
+                   annotateSNPs=args.annotate_snps, motifFlank=args.motif_flank,
+                   regionTable=args.region_table, windowSize=args.window_size,
+                   windowStep=windowStep, minWindowSNPs=args.min_window_snps,
+                   jobs=args.stage_jobs, checkpoints=checkpoints, resume=args.resume)
+    telemetry.close()
     logfile.close()
+    if failed:
+        sys.stderr.write('Error: %i of %i sample pairs failed (see %s).\n' % (failed, len(pairs), args.logfile))
+        sys.exit(1)
 
     pass
 
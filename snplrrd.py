@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import socket
+import tempfile
+import traceback
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import argparse
+except:
+    sys.stderr.write('TESTEXIT.\n')
+    sys.exit(0)
+
+from parsecache import BaseCache, MemoryCache, DEFAULT_CACHE_SIZE
+
+"""
+snplrrd - resident service for snplrr.py, consnptor.py and pileup2coverage.py
+'snplrrd.py serve' imports the tools once and keeps the inputs they parse
+(contig lengths, variant tables, coverage; everything that goes through
+the tools' parse cache) resident in memory. Jobs arrive over a Unix socket
+and/or as files dropped into a queue directory. Every job runs in a
+forked child, which sees the resident data copy-on-write and reports
+newly parsed inputs back, so follow-up runs on the same reference and
+control VCF skip parsing. Only inputs parsed in the job process itself
+become resident: the stage processes of snplrr --stage-jobs > 1 parse
+into their own copy of the cache, which is discarded. At most --jobs jobs run at once; resident data
+is evicted least recently used first when it exceeds --max-resident-mb or
+system memory runs low.
+
+The client takes the tool's own arguments:
+
+    snplrrd.py --socket /tmp/snplrrd.sock snplrr --refcontigs ref.fa ...
+
+and falls back to running the tool directly if no service is reachable.
+A service on a queue directory keeps the mtime of its heartbeat file
+(HEARTBEAT_FILE, holding its pid) current; clients only queue jobs while
+the heartbeat is fresh and take a job back if it is not picked up in time.
+"""
+
+TOOLS = ['snplrr', 'consnptor', 'pileup2coverage']
+# polling interval of the queue directory (and shutdown checks) in seconds
+POLL_INTERVAL = 0.2
+READ_SIZE = 1 << 16
+JOB_SUFFIX, RUNNING_SUFFIX, DONE_SUFFIX = '.job', '.running', '.done'
+# heartbeat of the service in the queue directory: touched every
+# HEARTBEAT_INTERVAL seconds, stale after HEARTBEAT_TIMEOUT seconds
+HEARTBEAT_FILE = 'snplrrd.pid'
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 10.0
+# seconds a client waits for a queued job to be picked up
+QUEUE_TIMEOUT = 30.0
+
+if bytes is str:
+    def _bytes(s):
+        return s
+    def _native(b):
+        return b
+else:
+    def _bytes(s):
+        return s.encode('utf-8')
+    def _native(b):
+        return b.decode('utf-8', 'replace')
+
+
+class RecordingCache(BaseCache):
+    """
+    Cache of a job process: reads from the (inherited) resident cache and
+    records the entries put during the job.
+    """
+
+    def __init__(self, resident):
+        self.resident = resident
+        self.puts = []
+
+    def get(self, key):
+        return self.resident.get(key)
+
+    def put(self, key, obj):
+        self.puts.append((key, pickle.dumps(obj, 2)))
+        pass
+
+
+def runTool(tool, argv, cache=None):
+    """
+    Runs a tool's main() in this process; returns its exit status.
+    """
+    module = __import__(tool)
+    if cache is not None and hasattr(module, 'cache'):
+        module.cache = cache
+    sys.argv = ['%s.py' % tool] + list(argv)
+    try:
+        if module.main.__code__.co_argcount:
+            module.main(list(argv))
+        else:
+            module.main()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write('%s\n' % e.code)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _writeAll(fd, data):
+    with os.fdopen(fd, 'wb') as out:
+        out.write(data)
+    pass
+
+
+class Job(object):
+    """
+    A tool run requested by a client; reply(status, output) answers it.
+    """
+
+    def __init__(self, request, reply):
+        self.tool = request.get('tool')
+        self.argv = request.get('argv', [])
+        self.cwd = request.get('cwd', '/')
+        self.reply = reply
+        self.pid, self.fd, self.output = None, None, None
+        self.data = []
+
+
+class Daemon(object):
+    """
+    Accepts jobs on socketPath and/or from queueDir and runs at most
+    maxJobs of them at once.
+    """
+
+    def __init__(self, socketPath=None, queueDir=None, maxJobs=2, resident=None, logfile=None):
+        self.socketPath, self.queueDir = socketPath, queueDir
+        self.maxJobs = maxJobs
+        self.resident = resident if resident is not None else MemoryCache()
+        self.logfile = logfile if logfile is not None else sys.stderr
+        self.listener = None
+        # connections still sending their request: {socket: data}
+        self.connections = {}
+        self.pending, self.running = [], {}
+        self.stopping = False
+        self.heartbeat = None
+
+    def log(self, message):
+        self.logfile.write('%s %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), message))
+        self.logfile.flush()
+        pass
+
+    def stop(self, *args):
+        self.stopping = True
+        pass
+
+    def serve(self):
+        for tool in TOOLS:
+            __import__(tool)
+        if self.socketPath:
+            if os.path.exists(self.socketPath):
+                os.remove(self.socketPath)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(self.socketPath)
+            self.listener.listen(16)
+        if self.queueDir:
+            if not os.path.isdir(self.queueDir):
+                os.makedirs(self.queueDir)
+            self._writeHeartbeat()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.log('serving on %s' % ', '.join(x for x in [self.socketPath, self.queueDir] if x))
+        try:
+            while not self.stopping or self.running:
+                self._poll()
+        finally:
+            if self.listener is not None:
+                self.listener.close()
+                os.remove(self.socketPath)
+            if self.queueDir:
+                try:
+                    os.remove(os.path.join(self.queueDir, HEARTBEAT_FILE))
+                except OSError:
+                    pass
+        self.log('stopped')
+        pass
+
+    def _writeHeartbeat(self):
+        path = os.path.join(self.queueDir, HEARTBEAT_FILE)
+        fd, tmp = tempfile.mkstemp(dir=self.queueDir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as handle:
+            handle.write('%i\n' % os.getpid())
+        os.rename(tmp, path)
+        self.heartbeat = time.time()
+        pass
+
+    def _poll(self):
+        readers = list(self.connections) + list(self.running)
+        if self.listener is not None and not self.stopping:
+            readers.append(self.listener)
+        try:
+            readable = select.select(readers, [], [], POLL_INTERVAL)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = []
+        for reader in readable:
+            if reader is self.listener:
+                conn = self.listener.accept()[0]
+                self.connections[conn] = b''
+            elif reader in self.connections:
+                self._readRequest(reader)
+            else:
+                self._readResult(reader)
+        if self.queueDir and not self.stopping:
+            if time.time() - self.heartbeat >= HEARTBEAT_INTERVAL:
+                self._writeHeartbeat()
+            self._scanQueue()
+        while self.pending and len(self.running) < self.maxJobs:
+            self._start(self.pending.pop(0))
+        pass
+
+    def _readRequest(self, conn):
+        data = conn.recv(READ_SIZE)
+        self.connections[conn] += data
+        if data and b'\n' not in self.connections[conn]:
+            return
+        line = self.connections.pop(conn).split(b'\n', 1)[0]
+
+        def reply(status, output):
+            try:
+                conn.sendall(_bytes(json.dumps({'status': status, 'output': output}) + '\n'))
+            except socket.error:
+                pass
+            conn.close()
+        self._submit(line, reply)
+        pass
+
+    def _scanQueue(self):
+        for name in sorted(os.listdir(self.queueDir)):
+            if not name.endswith(JOB_SUFFIX):
+                continue
+            path = os.path.join(self.queueDir, name)
+            claimed = path[:-len(JOB_SUFFIX)] + RUNNING_SUFFIX
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, 'rb') as handle:
+                line = handle.read()
+
+            def reply(status, output, claimed=claimed):
+                base = claimed[:-len(RUNNING_SUFFIX)]
+                with open(base + DONE_SUFFIX + '.tmp', 'w') as handle:
+                    json.dump({'status': status, 'output': output}, handle)
+                os.rename(base + DONE_SUFFIX + '.tmp', base + DONE_SUFFIX)
+                os.remove(claimed)
+            self._submit(line, reply)
+        pass
+
+    def _submit(self, line, reply):
+        try:
+            request = json.loads(_native(line))
+        except ValueError:
+            reply(1, 'Error: invalid request.\n')
+            return
+        if request.get('tool') == 'status':
+            reply(0, 'resident entries: %i (%.1f MB), running jobs: %i, pending jobs: %i\n' %
+                  (len(self.resident), self.resident.size / float(1 << 20),
+                   len(self.running), len(self.pending)))
+            return
+        if request.get('tool') not in TOOLS:
+            reply(1, 'Error: unknown tool %s.\n' % request.get('tool'))
+            return
+        self.pending.append(Job(request, reply))
+        pass
+
+    def _start(self, job):
+        rfd, wfd = os.pipe()
+        job.output = tempfile.TemporaryFile()
+        job.started = time.time()
+        pid = os.fork()
+        if pid == 0:
+            # job process: output to job.output, new cache entries to the pipe
+            os.close(rfd)
+            status = 1
+            try:
+                # the listener, requests and pipes of other jobs stay with the service
+                if self.listener is not None:
+                    self.listener.close()
+                for conn in self.connections:
+                    conn.close()
+                for fd in self.running:
+                    os.close(fd)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                os.chdir(job.cwd)
+                os.dup2(job.output.fileno(), 1)
+                os.dup2(job.output.fileno(), 2)
+                cache = RecordingCache(self.resident)
+                status = runTool(job.tool, job.argv, cache=cache)
+                sys.stdout.flush()
+                sys.stderr.flush()
+                _writeAll(wfd, pickle.dumps(cache.puts, 2))
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        os.close(wfd)
+        job.pid, job.fd = pid, rfd
+        self.running[rfd] = job
+        self.log('started %s (pid %i): %s' % (job.tool, pid, ' '.join(job.argv)))
+        pass
+
+    def _readResult(self, fd):
+        job = self.running[fd]
+        data = os.read(fd, READ_SIZE)
+        if data:
+            job.data.append(data)
+            return
+        del self.running[fd]
+        os.close(fd)
+        status = os.waitpid(job.pid, 0)[1]
+        status = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+        data = b''.join(job.data)
+        if data:
+            for key, obj in pickle.loads(data):
+                self.resident.put(key, pickle.loads(obj), size=len(obj))
+        job.output.seek(0)
+        output = _native(job.output.read())
+        job.output.close()
+        self.log('finished %s (pid %i): status %i, %.2fs, resident %i entries (%.1f MB)' %
+                 (job.tool, job.pid, status, time.time() - job.started,
+                  len(self.resident), self.resident.size / float(1 << 20)))
+        job.reply(status, output)
+        pass
+
+
+def submitSocket(socketPath, request):
+    """
+    Returns the (status, output) reply of the service to request, or None
+    if no service listens on socketPath.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socketPath)
+    except socket.error:
+        conn.close()
+        return None
+    conn.sendall(_bytes(json.dumps(request) + '\n'))
+    data = []
+    while True:
+        chunk = conn.recv(READ_SIZE)
+        if not chunk:
+            break
+        data.append(chunk)
+    conn.close()
+    reply = json.loads(_native(b''.join(data)))
+    return reply['status'], reply['output']
+
+
+def isQueueServed(queueDir):
+    """
+    Returns True if a service has recently updated its heartbeat in queueDir.
+    """
+    try:
+        age = time.time() - os.path.getmtime(os.path.join(queueDir, HEARTBEAT_FILE))
+    except OSError:
+        return False
+    return age < HEARTBEAT_TIMEOUT
+
+
+def submitQueue(queueDir, request, timeout=QUEUE_TIMEOUT):
+    """
+    Drops request into queueDir and returns the (status, output) reply,
+    or None if no service is running on queueDir, does not pick up the
+    job within timeout seconds or stops while running it.
+    """
+    if not isQueueServed(queueDir):
+        return None
+    fd, path = tempfile.mkstemp(dir=queueDir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as handle:
+        json.dump(request, handle)
+    base = path[:-len('.tmp')]
+    os.rename(path, base + JOB_SUFFIX)
+    deadline = time.time() + timeout
+    while not os.path.exists(base + DONE_SUFFIX):
+        served = isQueueServed(queueDir)
+        if not served or time.time() > deadline:
+            # take the job back unless the service has claimed it
+            try:
+                os.rename(base + JOB_SUFFIX, path)
+                os.remove(path)
+                return None
+            except OSError:
+                if not served and not os.path.exists(base + DONE_SUFFIX):
+                    return None
+        time.sleep(POLL_INTERVAL / 2)
+    with open(base + DONE_SUFFIX) as handle:
+        reply = json.load(handle)
+    os.remove(base + DONE_SUFFIX)
+    return reply['status'], reply['output']
+
+
+def serve(argv, socketPath=None, queueDir=None):
+    """
+    Runs the service; socketPath/queueDir (e.g. given before 'serve') are
+    the defaults of its --socket/--queue-dir.
+    """
+    parser = argparse.ArgumentParser(prog='snplrrd.py serve', description='Runs the resident service.')
+    parser.add_argument('--socket', default=socketPath or os.environ.get('SNPLRRD_SOCKET'), help='Unix socket to accept jobs on (default: $SNPLRRD_SOCKET).')
+    parser.add_argument('--queue-dir', default=queueDir or os.environ.get('SNPLRRD_QUEUE'), help='Directory polled for job files (default: $SNPLRRD_QUEUE).')
+    parser.add_argument('--jobs', type=int, default=2, help='Maximum number of concurrently running jobs.')
+    parser.add_argument('--max-resident-mb', type=int, default=DEFAULT_CACHE_SIZE >> 20, help='Size limit of the resident parsed inputs in MB.')
+    parser.add_argument('--min-free-mb', type=int, default=1024, help='Evict resident inputs while less system memory is available (MB).')
+    parser.add_argument('--logfile', help='A log file (default: stderr).')
+    args = parser.parse_args(argv)
+    if not args.socket and not args.queue_dir:
+        sys.stderr.write('Error: --socket and/or --queue-dir required.\n')
+        sys.exit(1)
+    if args.jobs < 1:
+        sys.stderr.write('Error: --jobs must be positive.\n')
+        sys.exit(1)
+    resident = MemoryCache(maxSize=args.max_resident_mb << 20, minAvailable=args.min_free_mb << 20)
+    logfile = open(args.logfile, 'a') if args.logfile else None
+    Daemon(socketPath=args.socket, queueDir=args.queue_dir, maxJobs=args.jobs,
+           resident=resident, logfile=logfile).serve()
+    pass
+
+
+def main(argv):
+
+    descr = 'Runs snplrr tools on a resident snplrrd service (or directly if none is reachable).'
+    parser = argparse.ArgumentParser(description=descr)
+    parser.add_argument('--socket', default=os.environ.get('SNPLRRD_SOCKET'), help='Unix socket of the service (default: $SNPLRRD_SOCKET).')
+    parser.add_argument('--queue-dir', default=os.environ.get('SNPLRRD_QUEUE'), help='Queue directory of the service (default: $SNPLRRD_QUEUE).')
+    parser.add_argument('--timeout', type=float, default=QUEUE_TIMEOUT, help='Seconds to wait for the service to pick up a queued job before running the tool directly.')
+    parser.add_argument('command', choices=['serve', 'status'] + TOOLS, help='serve: run the service; status: show the state of the service; otherwise a tool to run.')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments of the tool.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(args.args, socketPath=args.socket, queueDir=args.queue_dir)
+        return
+
+    request = {'tool': args.command, 'argv': args.args, 'cwd': os.getcwd()}
+    reply = None
+    if args.socket:
+        reply = submitSocket(args.socket, request)
+    if reply is None and args.queue_dir and os.path.isdir(args.queue_dir):
+        reply = submitQueue(args.queue_dir, request, timeout=args.timeout)
+    if reply is None:
+        if args.command == 'status':
+            sys.stderr.write('No snplrrd service is reachable.\n')
+            sys.exit(1)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        sys.exit(runTool(args.command, args.args))
+    status, output = reply
+    sys.stderr.write(output)
+    sys.exit(status)
+    pass
+
+if __name__ == '__main__': main(sys.argv[1:])
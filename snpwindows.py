@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import bisect
+import operator
+import itertools
+
+"""
+snpwindows - sliding-window SNP density scan along contigs
+Windows of a fixed size are laid along a contig at a fixed step. The SNP
+count of every window is the difference of the cumulative SNP counts
+(ranks in the sorted position array) at its end and start, computed for
+all windows at once with C-level map/bisect instead of a Python loop over
+positions. Runs of clean windows (enough common SNPs, no susP-only SNP)
+are merged into maximal candidate regions, so that locally chimeric
+contigs are not discarded as a whole.
+"""
+
+REGION_TABLEHEADER = ['contig', 'start', 'end', 'length', '#windows',
+                      '#SNPs(common)', 'SNPs/kb(common)', 'max SNPs/kb(common, window)',
+                      'chimeric contig?']
+
+
+def getWindowStarts(length, size, step):
+    """
+    Returns the 1-based starts of the windows covering [1, length].
+    """
+    nwindows = 1 + max(0, -(-(length - size) // step))
+    return list(range(1, 1 + nwindows * step, step))
+
+
+def countInWindows(positions, starts, size):
+    """
+    Returns the number of the sorted positions in each window
+    [start, start + size).
+    """
+    n = len(starts)
+    ends = map(operator.add, starts, itertools.repeat(size, n))
+    right = map(bisect.bisect_left, itertools.repeat(positions, n), ends)
+    left = map(bisect.bisect_left, itertools.repeat(positions, n), starts)
+    return list(map(operator.sub, right, left))
+
+
+def getCleanRegions(common, private, length, size, step, minSNPs=1):
+    """
+    Returns the maximal regions (start, end, #windows, #common SNPs,
+    max common SNPs per window) covered by consecutive windows with at
+    least minSNPs common and no private SNPs (positions sorted, 1-based).
+    """
+    if not common:
+        return []
+    length = max(length, common[-1])
+    starts = getWindowStarts(length, size, step)
+    commonCounts = countInWindows(common, starts, size)
+    clean = map(operator.ge, commonCounts, itertools.repeat(minSNPs, len(starts)))
+    if private:
+        privateCounts = countInWindows(private, starts, size)
+        clean = map(operator.and_, clean, map(operator.not_, privateCounts))
+    regions = []
+    index = 0
+    for isClean, run in itertools.groupby(clean):
+        nwindows = len(list(run))
+        if isClean:
+            start = starts[index]
+            end = min(length, starts[index + nwindows - 1] + size - 1)
+            nCommon = bisect.bisect_right(common, end) - bisect.bisect_left(common, start)
+            regions.append((start, end, nwindows, nCommon,
+                            max(commonCounts[index:index + nwindows])))
+        index += nwindows
+    return regions
+
+
+def getRegionValues(contig, regions, size, chimeric):
+    """
+    Returns REGION_TABLEHEADER rows of the getCleanRegions regions of a contig.
+    """
+    return [[contig, start, end, end - start + 1, nwindows, nCommon,
+             1000.0 * nCommon / (end - start + 1), 1000.0 * maxCommon / size, chimeric]
+            for start, end, nwindows, nCommon, maxCommon in regions]
+
+
+def formatRegionBlock(columns):
+    """
+    Returns the region table lines of a block of columns.
+    """
+    return ''.join('%s\t%i\t%i\t%i\t%i\t%i\t%.3f\t%.3f\t%s\n' % (row[:8] + ('YES' if row[8] else 'NO',))
+                   for row in zip(*columns))
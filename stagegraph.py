@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+import io
+import os
+import sys
+import errno
+import select
+import hashlib
+import traceback
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from parsecache import getCacheKey
+
+"""
+stagegraph - a pipeline as a dependency graph of named stages
+Stages are added in dependency order, each with the names of the stages
+whose results it takes. With jobs > 1 every stage whose dependencies are
+done runs in a forked process (at most jobs at a time) and sends its
+result back pickled; with jobs == 1 the stages run in order in this
+process, where a deferred stage (returning a function that completes it,
+e.g. a scan in the background) is only completed once a stage needs it.
+Stage results are checkpointed in a store with the ParseCache interface
+under a key over the stage's input files (path, size, mtime), options
+and the keys of its dependencies. A resumed run loads the results of
+unchanged stages (only those a re-run stage needs) and re-runs the
+invalidated stages and everything depending on them.
+"""
+
+# bump to invalidate checkpoints written by older code
+STAGE_VERSION = 1
+READ_SIZE = 1 << 16
+
+_newLog = io.BytesIO if bytes is str else io.StringIO
+
+
+def _identity(obj):
+    return obj
+
+
+class Stage(object):
+    """
+    A named step: run({dependency: result}, logfile) returns its result.
+    encode/decode convert results to and from a picklable form that does
+    not depend on process state (for checkpoints and worker processes).
+    """
+
+    def __init__(self, name, run, deps=(), inputs=(), options=None,
+                 checkpoint=True, deferred=False, encode=None, decode=None):
+        self.name, self.run = name, run
+        self.deps, self.inputs = list(deps), list(inputs)
+        self.options = options if options is not None else {}
+        self.checkpoint, self.deferred = checkpoint, deferred
+        self.encode = encode if encode is not None else _identity
+        self.decode = decode if decode is not None else _identity
+
+
+class StageGraph(object):
+    """
+    Runs stages (add()) in dependency order; checkpoints the results of
+    stages with checkpoint=True in checkpoints (if given) and, with
+    resume, loads them from there instead of running the stages again.
+    """
+
+    def __init__(self, checkpoints=None, resume=False, logfile=sys.stdout):
+        self.checkpoints, self.resume = checkpoints, resume
+        self.logfile = logfile
+        self.stages, self.byName = [], {}
+        self.keys, self.results, self.deferred = {}, {}, {}
+
+    def add(self, name, run, **kwargs):
+        stage = Stage(name, run, **kwargs)
+        if name in self.byName:
+            raise ValueError('Duplicate stage %s.' % name)
+        for dep in stage.deps:
+            if dep not in self.byName:
+                raise ValueError('Stage %s depends on unknown stage %s.' % (name, dep))
+        self.stages.append(stage)
+        self.byName[name] = stage
+        pass
+
+    def getKey(self, name):
+        """
+        Returns the checkpoint key of a stage.
+        """
+        if name not in self.keys:
+            stage = self.byName[name]
+            desc = repr((STAGE_VERSION, name,
+                         [getCacheKey(fn, name) if fn else None for fn in stage.inputs],
+                         sorted((k, v if not isinstance(v, (set, frozenset)) else sorted(v))
+                                for k, v in stage.options.items()),
+                         [self.getKey(dep) for dep in stage.deps]))
+            self.keys[name] = hashlib.sha1(desc if isinstance(desc, bytes) else desc.encode('utf-8')).hexdigest()
+        return self.keys[name]
+
+    def _isCheckpointed(self, stage):
+        return self.resume and stage.checkpoint and self.checkpoints is not None and \
+            self.getKey(stage.name) in self.checkpoints
+
+    def _finish(self, stage, result, encoded=None):
+        self.results[stage.name] = result
+        if stage.checkpoint and self.checkpoints is not None:
+            self.checkpoints.put(self.getKey(stage.name),
+                                 encoded if encoded is not None else stage.encode(result))
+        pass
+
+    def _getResult(self, name):
+        if name in self.deferred:
+            self._finish(self.byName[name], self.deferred.pop(name)())
+        elif name not in self.results:
+            stage = self.byName[name]
+            encoded = self.checkpoints.get(self.getKey(name))
+            if encoded is None:
+                raise IOError('The checkpoint of stage %s vanished, run again without resuming.' % name)
+            self.logfile.write('Loading checkpoint of %s\n' % name)
+            self.results[name] = stage.decode(encoded)
+        return self.results[name]
+
+    def run(self, jobs=1):
+        """
+        Runs the graph with at most jobs stages at a time; returns
+        {stage: result} of the stages that were run or loaded.
+        """
+        torun = [stage for stage in self.stages if not self._isCheckpointed(stage)]
+        if len(torun) < len(self.stages):
+            self.logfile.write('Checkpointed stages: %s\n' % ', '.join(stage.name for stage in self.stages
+                                                                      if stage not in torun))
+        if jobs > 1:
+            self._runProcesses(torun, jobs)
+        else:
+            for stage in torun:
+                result = stage.run(dict((dep, self._getResult(dep)) for dep in stage.deps),
+                                   self.logfile)
+                if stage.deferred:
+                    self.deferred[stage.name] = result
+                else:
+                    self._finish(stage, result)
+            for name in list(self.deferred):
+                self._getResult(name)
+        return self.results
+
+    def _start(self, stage):
+        inputs = dict((dep, self._getResult(dep)) for dep in stage.deps)
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(rfd)
+            log = _newLog()
+            try:
+                result = stage.run(inputs, log)
+                if stage.deferred:
+                    result = result()
+                data = pickle.dumps((True, stage.encode(result), log.getvalue()), 2)
+            except BaseException:
+                data = pickle.dumps((False, traceback.format_exc(), log.getvalue()), 2)
+            try:
+                with os.fdopen(wfd, 'wb') as out:
+                    out.write(data)
+            finally:
+                os._exit(0)
+        os.close(wfd)
+        return rfd, pid
+
+    def _runProcesses(self, torun, jobs):
+        pending = list(torun)
+        running, failed = {}, []
+        while running or (pending and not failed):
+            names = set(stage.name for stage in pending) | \
+                set(stage.name for stage, _, _ in running.values())
+            for stage in list(pending):
+                if len(running) >= jobs or failed:
+                    break
+                if any(dep in names for dep in stage.deps):
+                    continue
+                pending.remove(stage)
+                fd, pid = self._start(stage)
+                running[fd] = (stage, pid, [])
+            if not running:
+                break
+            try:
+                readable = select.select(list(running), [], [])[0]
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            for fd in readable:
+                stage, pid, chunks = running[fd]
+                data = os.read(fd, READ_SIZE)
+                if data:
+                    chunks.append(data)
+                    continue
+                del running[fd]
+                os.close(fd)
+                os.waitpid(pid, 0)
+                try:
+                    success, payload, log = pickle.loads(b''.join(chunks))
+                except (EOFError, pickle.UnpicklingError):
+                    success, payload, log = False, 'The process of stage %s died.\n' % stage.name, ''
+                self.logfile.write(log)
+                if success:
+                    self._finish(stage, stage.decode(payload), encoded=payload)
+                else:
+                    failed.append((stage.name, payload))
+        if failed:
+            raise RuntimeError(''.join('Stage %s failed:\n%s' % failure for failure in failed))
+        pass
@@ -1,51 +1,312 @@
 #!/usr/bin/env python
 
 import os
+import re
 import sys
+import heapq
 import argparse
 
-#from Bio import Blast
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
 
-from Bio.Blast import NCBIXML
-# from Blast import NCBIXML
+"""
+synteny_parse - filters BLAST hits of contigs against G. max
+BLAST XML is parsed incrementally (iterparse): only the fields needed by
+the filters are read and every element is cleared once processed.
+BLAST tabular output (-outfmt '6 std qlen' or '7 std qlen') is read in
+blocks of lines without any XML parsing. Memory stays constant in the
+number of hits in both cases.
+Hits of seqsplitter fragments (contig:start-end) can be lifted back to
+their contig and reduced to the best G. max genes per contig, written in
+the contig<TAB>GM-id format of snplrr's --synteny-table.
+"""
 
-TABLEHEADER = ['contigID', 'refID', 'refIDlong', 'e-value', 
+TABLEHEADER = ['contigID', 'refID', 'refIDlong', 'e-value',
                'query_coverage', 'query_length', 'alignment_length', 'identity']
 
+INPUT_BLOCK_SIZE = 1 << 22
+OUTPUT_BLOCK_RECORDS = 1 << 14
+
+SYNTENY_TABLEHEADER = ['contigID', 'refID', 'start', 'end']
+# seqsplitter fragment ids: contig:start-end (1-based, inclusive)
+FRAGMENT_ID = re.compile(r'^(.+):(\d+)-(\d+)$')
+
+# -outfmt 6 specifiers of 'std qlen'
+DEFAULT_TABULAR_FIELDS = ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen',
+                          'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore', 'qlen']
+# '# Fields:' names of -outfmt 7
+TABULAR_FIELD_NAMES = {'query id': 'qseqid', 'query acc.': 'qacc', 'query acc.ver': 'qaccver',
+                       'subject id': 'sseqid', 'subject acc.': 'sacc', 'subject acc.ver': 'saccver',
+                       '% identity': 'pident', 'alignment length': 'length',
+                       'mismatches': 'mismatch', 'gap opens': 'gapopen',
+                       'q. start': 'qstart', 'q. end': 'qend', 's. start': 'sstart', 's. end': 'send',
+                       'evalue': 'evalue', 'bit score': 'bitscore', 'query length': 'qlen',
+                       'subject length': 'slen', 'identical': 'nident', 'subject title': 'stitle'}
+
+
+def parseBlastXML(fn, evalue, minIdentity, minQueryCoverage):
+    """
+    Returns generator over the passing hits
+    (qid, tid, sid, e-value, query coverage, query length, alignment length, identity,
+     query start, query end)
+    of a BLAST XML file, in file order (as Bio.Blast.NCBIXML would give them).
+    """
+    headerQuery, headerLength = None, None
+    query, qlen, hitId, hitDef = None, None, '', ''
+    iterations = None
+    for event, elem in ElementTree.iterparse(fn, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'Iteration':
+                query, qlen = None, None
+            elif tag == 'Hit':
+                hitId, hitDef = '', ''
+            elif tag == 'BlastOutput_iterations':
+                iterations = elem
+            continue
+        if tag == 'Hsp':
+            expect = float(elem.findtext('Hsp_evalue'))
+            if expect >= evalue:
+                elem.clear()
+                continue
+            length = qlen or headerLength
+            qstart, qend = int(elem.findtext('Hsp_query-from')), int(elem.findtext('Hsp_query-to'))
+            qcov = (qend - qstart + 1.0) / length
+            if qcov < minQueryCoverage:
+                elem.clear()
+                continue
+            alen = int(elem.findtext('Hsp_align-len'))
+            identity = int(elem.findtext('Hsp_identity')) / float(alen)
+            elem.clear()
+            if identity < minIdentity:
+                continue
+            sid = (hitId + ' ' + hitDef).split()[1]
+            yield (query or headerQuery, sid.split('|')[0], sid, expect, qcov, length, alen, identity,
+                   qstart, qend)
+        elif tag == 'Hit':
+            elem.clear()
+        elif tag == 'Iteration':
+            elem.clear()
+            if iterations is not None:
+                iterations.clear()
+        elif tag == 'Hit_id':
+            hitId = (elem.text or '').strip()
+        elif tag == 'Hit_def':
+            hitDef = (elem.text or '').strip()
+        elif tag == 'Iteration_query-def':
+            query = (elem.text or '').strip()
+        elif tag == 'Iteration_query-len':
+            qlen = int(elem.text)
+        elif tag == 'BlastOutput_query-def':
+            headerQuery = (elem.text or '').strip()
+        elif tag == 'BlastOutput_query-len':
+            headerLength = int(elem.text)
+    pass
+
+
+def getTabularColumns(fields):
+    """
+    Returns the column indices (qid, sid, evalue, qstart, qend, qlen,
+    length, nident, pident) of a list of -outfmt 6 specifiers
+    (nident/pident are None if absent).
+    """
+    if fields and fields[0] in ('6', '7'):
+        fields = fields[1:]
+    expanded = []
+    for f in fields:
+        expanded.extend(DEFAULT_TABULAR_FIELDS[:12] if f == 'std' else [f])
+    fields = expanded
+    column = dict((f, i) for i, f in reversed(list(enumerate(fields))))
+    qid = [column[f] for f in ('qseqid', 'qaccver', 'qacc') if f in column]
+    sid = [column[f] for f in ('sseqid', 'saccver', 'sacc') if f in column]
+    missing = [f for f in ('evalue', 'qstart', 'qend', 'qlen', 'length') if f not in column]
+    if not qid or not sid or missing or ('nident' not in column and 'pident' not in column):
+        raise ValueError('Tabular BLAST output needs the columns qseqid, sseqid, pident (or nident), ' +
+                         'length, qstart, qend, evalue and qlen (e.g. -outfmt "6 std qlen"); got %s.' %
+                         ' '.join(fields))
+    return (qid[0], sid[0], column['evalue'], column['qstart'], column['qend'], column['qlen'],
+            column['length'], column.get('nident'), column.get('pident'))
+
+
+def parseBlastTabular(fn, evalue, minIdentity, minQueryCoverage, fields=DEFAULT_TABULAR_FIELDS):
+    """
+    Returns generator over the passing hits (as parseBlastXML) of a BLAST
+    tabular file (-outfmt 6 with the given fields, or -outfmt 7 whose
+    '# Fields:' lines override them).
+    """
+    qidCol, sidCol, eCol, qstartCol, qendCol, qlenCol, lenCol, nidentCol, pidentCol = \
+        getTabularColumns(fields)
+    handle = open(fn)
+    while True:
+        lines = handle.readlines(INPUT_BLOCK_SIZE)
+        if not lines:
+            break
+        for line in lines:
+            if line.startswith('#'):
+                if line.startswith('# Fields:'):
+                    names = [f.strip() for f in line[len('# Fields:'):].split(',')]
+                    qidCol, sidCol, eCol, qstartCol, qendCol, qlenCol, lenCol, nidentCol, pidentCol = \
+                        getTabularColumns([TABULAR_FIELD_NAMES.get(f, f) for f in names])
+                continue
+            row = line.rstrip('\r\n').split('\t')
+            if len(row) < 2:
+                continue
+            expect = float(row[eCol])
+            if expect >= evalue:
+                continue
+            qlen = int(row[qlenCol])
+            qstart, qend = int(row[qstartCol]), int(row[qendCol])
+            qcov = (qend - qstart + 1.0) / qlen
+            if qcov < minQueryCoverage:
+                continue
+            alen = int(row[lenCol])
+            if nidentCol is not None:
+                identity = int(row[nidentCol]) / float(alen)
+            else:
+                identity = float(row[pidentCol]) / 100.0
+            if identity < minIdentity:
+                continue
+            sid = row[sidCol].split()[0]
+            yield (row[qidCol], sid.split('|')[0], sid, expect, qcov, qlen, alen, identity,
+                   qstart, qend)
+    handle.close()
+    pass
+
+
+def liftoverQuery(qid, qstart, qend):
+    """
+    Returns (contig, start, end) of a query range on a seqsplitter fragment
+    (contig:start-end); other query ids are returned unchanged.
+    """
+    match = FRAGMENT_ID.match(qid)
+    if match is None:
+        return qid, qstart, qend
+    offset = int(match.group(2)) - 1
+    return match.group(1), qstart + offset, qend + offset
+
+
+class BestHitReducer(object):
+    """
+    Keeps the topk best G. max genes per contig. HSPs of a contig are
+    collected while its hits arrive consecutively (BLAST reports queries
+    in input order, seqsplitter writes the fragments of a contig in a
+    row); overlapping HSPs of the same gene, e.g. from overlapping
+    fragments, are merged. Genes are ranked by their best e-value, then by
+    the number of contig bases covered.
+    """
+
+    def __init__(self, topk=1):
+        self.topk = topk
+        self.best = {}
+        self.contig, self.hsps = None, {}
+
+    def add(self, contig, gene, start, end, expect):
+        if contig != self.contig:
+            self._flush()
+            self.contig = contig
+        self.hsps.setdefault(gene, []).append((min(start, end), max(start, end), expect))
+        pass
+
+    def _flush(self):
+        if self.contig is None:
+            return
+        ranked = []
+        for gene, hsps in self.hsps.items():
+            hsps.sort()
+            covered, curStart, curEnd = 0, None, None
+            for start, end, expect in hsps:
+                if curEnd is not None and start <= curEnd + 1:
+                    curEnd = max(curEnd, end)
+                    continue
+                if curEnd is not None:
+                    covered += curEnd - curStart + 1
+                curStart, curEnd = start, end
+            covered += curEnd - curStart + 1
+            ranked.append((min(expect for start, end, expect in hsps), -covered, gene,
+                           hsps[0][0], max(end for start, end, expect in hsps)))
+        # a contig seen again (unsorted input) competes with its earlier best genes
+        previous = dict((key[2], key) for key in self.best.get(self.contig, []))
+        for expect, negCovered, gene, start, end in ranked:
+            if gene in previous:
+                pExpect, pNegCovered, _, pStart, pEnd = previous[gene]
+                expect, negCovered = min((expect, negCovered), (pExpect, pNegCovered))
+                start, end = min(start, pStart), max(end, pEnd)
+            previous[gene] = (expect, negCovered, gene, start, end)
+        self.best[self.contig] = heapq.nsmallest(self.topk, previous.values())
+        self.contig, self.hsps = None, {}
+        pass
+
+    def getBestHits(self):
+        """
+        Returns {contig: [(gene, start, end), ...]} (best first), with the
+        contig span covered by the gene's HSPs.
+        """
+        self._flush()
+        return dict((contig, [key[2:] for key in keys])
+                    for contig, keys in self.best.items())
+
+
+def writeSyntenyTable(hits, out, topk=1):
+    """
+    Writes the topk genes per (lifted) contig as contig<TAB>GM-id<TAB>start<TAB>end rows.
+    """
+    reducer = BestHitReducer(topk=topk)
+    for hit in hits:
+        contig, start, end = liftoverQuery(hit[0], hit[8], hit[9])
+        reducer.add(contig, hit[1], start, end, hit[3])
+    best = reducer.getBestHits()
+    out.write('#' + '\t'.join(SYNTENY_TABLEHEADER) + '\n')
+    out.write(''.join('%s\t%s\t%i\t%i\n' % ((contig,) + hit)
+                      for contig in sorted(best) for hit in best[contig]))
+    pass
+
+
+def isBlastXML(fn):
+    with open(fn) as handle:
+        head = handle.read(1024)
+    return head.lstrip().startswith('<')
+
+
 def doStuff(args):
-    blast_records = NCBIXML.parse(open(args.blastXMLInput))
-    
+    inputFormat = args.input_format
+    if inputFormat == 'auto':
+        inputFormat = 'xml' if isBlastXML(args.blastXMLInput) else 'tabular'
+    if inputFormat == 'xml':
+        hits = parseBlastXML(args.blastXMLInput, args.evalue,
+                             args.min_identity, args.min_query_coverage)
+    else:
+        hits = parseBlastTabular(args.blastXMLInput, args.evalue,
+                                 args.min_identity, args.min_query_coverage,
+                                 fields=args.tabular_fields.split())
+
     with open(args.blastHitsTSV, 'wb') as out:
+        if args.output_format == 'synteny':
+            writeSyntenyTable(hits, out, topk=args.top_k)
+            return
         out.write('\t'.join(TABLEHEADER) + '\n')
-        for blast_record in blast_records:
-            qlen = blast_record.query_length        
-            qid = blast_record.query
-            # hits[qid] = []
-            for alignment in blast_record.alignments:            
-                sid = alignment.title.split()[1]
-                tid = sid.split('|')[0]
-                for hsp in alignment.hsps:
-                    if hsp.expect >= args.evalue:
-                        continue
-                    qcov = (hsp.query_end - hsp.query_start + 1.0) / qlen
-                    if qcov < args.min_query_coverage:
-                        continue
-                    identity = hsp.identities / float(hsp.align_length)
-                    if identity < args.min_identity:
-                        continue
-               
-                    hit = (tid, sid, hsp.expect, qcov, qlen, hsp.align_length, identity)
-                    out.write('\t'.join([qid] + map(str, hit)) + '\n')  
+        block = []
+        for hit in hits:
+            block.append('\t'.join(map(str, hit[:8])) + '\n')
+            if len(block) >= OUTPUT_BLOCK_RECORDS:
+                out.write(''.join(block))
+                block = []
+        out.write(''.join(block))
     pass
 
 
 def main(argv):
-    
+
     descr = ''
-    parser = argparse.ArgumentParser(description=descr)        
+    parser = argparse.ArgumentParser(description=descr)
     parser.add_argument('--evalue', type=float, default=1e-10)
     parser.add_argument('--min-identity', type=float, default=0.75)
     parser.add_argument('--min-query-coverage', type=float, default=0.75)
+    parser.add_argument('--input-format', choices=['auto', 'xml', 'tabular'], default='auto', help='BLAST XML or tabular (-outfmt 6/7) output; auto-detected by default.')
+    parser.add_argument('--tabular-fields', default='std qlen', help='-outfmt 6 specifiers of tabular input without "# Fields:" lines (default: "std qlen").')
+    parser.add_argument('--output-format', choices=['hits', 'synteny'], default='hits', help='hits: all passing HSPs; synteny: contig<TAB>GM-id<TAB>start<TAB>end table of the best genes per contig, with seqsplitter fragments lifted back to their contigs.')
+    parser.add_argument('--top-k', type=int, default=1, help='Number of genes per contig in the synteny table.')
     parser.add_argument('blastXMLInput', type=str)
     parser.add_argument('blastHitsTSV', type=str)
 
@@ -54,12 +315,20 @@ def main(argv):
     except:
         sys.exit(1)
 
+    if args.top_k < 1:
+        sys.stderr.write('Error: --top-k must be at least 1.\n')
+        sys.exit(1)
+
     if not os.path.exists(args.blastXMLInput):
         sys.stderr.write('Input file (%s) is missing.\n' % args.blastXMLInput)
         sys.exit(1)
 
-    doStuff(args)
-      
+    try:
+        doStuff(args)
+    except ValueError as e:
+        sys.stderr.write('Error: %s\n' % e)
+        sys.exit(1)
+
     pass
 
 
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import os
+import re
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import cProfile
+except ImportError:
+    cProfile = None
+
+"""
+telemetry - per-stage performance metrics
+Each stage records wall time, CPU time (own and of finished worker
+processes), processed records, records per second, bytes of declared
+inputs and peak RSS, written as one JSON object per line next to the
+human-readable log. Optionally every stage is profiled with cProfile.
+"""
+
+
+class StageRecord(object):
+    """
+    Handle yielded by Telemetry.stage; set records (and optionally
+    bytesRead) inside the with-block.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.records = None
+        self.bytesRead = None
+
+
+def getPeakRSS():
+    """
+    Returns the peak resident set size in kB of this process and of its
+    terminated children (None, None where unavailable).
+    """
+    if resource is None:
+        return None, None
+    # ru_maxrss: kB on Linux, bytes on macOS
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale)
+
+
+def _getInputSize(inputs):
+    size = 0
+    for fn in inputs:
+        if fn and os.path.isfile(fn):
+            size += os.path.getsize(fn)
+    return size
+
+
+class Telemetry(object):
+    """
+    Writes stage metrics as JSON lines to metricsFile (if given) and cProfile
+    statistics to profileDir/<stage>.prof (if given).
+    """
+
+    def __init__(self, metricsFile=None, profileDir=None):
+        self.out = open(metricsFile, 'w') if metricsFile else None
+        self.profileDir = profileDir
+        if profileDir and not os.path.isdir(profileDir):
+            os.makedirs(profileDir)
+        self.nstages = 0
+
+    @contextlib.contextmanager
+    def stage(self, label, logfile=None, inputs=()):
+        """
+        Times the with-block as stage label; writes 'label... Ns' to logfile.
+        """
+        if logfile is not None:
+            logfile.write('%s...' % label)
+            logfile.flush()
+        record = StageRecord(label)
+        profile = None
+        if self.profileDir and cProfile is not None:
+            profile = cProfile.Profile()
+            profile.enable()
+        t0, c0 = time.time(), os.times()
+        try:
+            yield record
+        finally:
+            wall, c1 = time.time() - t0, os.times()
+            if profile is not None:
+                profile.disable()
+            self.nstages += 1
+            if logfile is not None:
+                logfile.write(' %is\n' % int(wall + 0.5))
+            if profile is not None:
+                slug = re.sub('[^A-Za-z0-9]+', '_', label).strip('_')
+                profile.dump_stats(os.path.join(self.profileDir, '%02i_%s.prof' % (self.nstages, slug)))
+            if self.out is not None:
+                self._write(record, wall, c0, c1, inputs)
+        pass
+
+    def _write(self, record, wall, c0, c1, inputs):
+        peakRSS, peakChildRSS = getPeakRSS()
+        bytesRead = record.bytesRead if record.bytesRead is not None else _getInputSize(inputs)
+        metrics = {'stage': record.label,
+                   'wall_s': round(wall, 6),
+                   'cpu_s': round((c1[0] - c0[0]) + (c1[1] - c0[1]), 6),
+                   'children_cpu_s': round((c1[2] - c0[2]) + (c1[3] - c0[3]), 6),
+                   'records': record.records,
+                   'records_per_s': round(record.records / wall, 3) if record.records is not None and wall > 0 else None,
+                   'bytes_read': bytesRead,
+                   'peak_rss_kb': peakRSS,
+                   'peak_children_rss_kb': peakChildRSS,
+                   'timestamp': round(time.time(), 3)}
+        self.out.write(json.dumps(metrics, sort_keys=True) + '\n')
+        self.out.flush()
+        pass
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+        pass
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+import bisect
+import operator
+import itertools
+from array import array
+
+"""
+VariantTable - compact columnar storage for VCF variant records
+Replaces dictionaries of (depth, alt, ref, genotype) tuples by typed array
+columns (a few dozen bytes per SNP) and offers set operations, genotype
+filtering and per-contig reductions that run in C-level loops.
+"""
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+try:
+    from itertools import imap
+except ImportError:
+    imap = map
+
+# 64bit signed integer typecode for the packed (contig, pos) keys
+KEY_TYPECODE = 'l' if array('l').itemsize >= 8 else 'q'
+KEY_SHIFT = 32
+POS_MASK = (1 << KEY_SHIFT) - 1
+
+COLUMNS = ('keys', 'depth', 'genotype', 'ref', 'alt')
+
+if hasattr(array, 'tobytes'):
+    def tobytes(a):
+        return a.tobytes()
+    def frombytes(a, b):
+        a.frombytes(b)
+else:
+    def tobytes(a):
+        return a.tostring()
+    def frombytes(a, b):
+        a.fromstring(b)
+
+# genotype flags are 4bit (cf. GTYPE_* in snplrr.py)
+GENOTYPE_VALUES = 16
+
+
+class Interner(object):
+    """
+    Maps strings (contig names, alleles) to consecutive integer ids.
+    """
+
+    def __init__(self):
+        self.names, self.ids = [], {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, name):
+        id_ = self.ids.get(name)
+        if id_ is None:
+            id_ = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id_
+
+    def get(self, name, default=None):
+        return self.ids.get(name, default)
+
+    def name(self, id_):
+        return self.names[id_]
+
+def getContigRuns(keys):
+    """
+    Returns generator over the (contig id, start, end) ranges of sorted keys.
+    """
+    start, n = 0, len(keys)
+    while start < n:
+        cid = keys[start] >> KEY_SHIFT
+        end = bisect.bisect_left(keys, (cid + 1) << KEY_SHIFT, start, n)
+        yield cid, start, end
+        start = end
+    pass
+
+# shared by all tables, so that their keys are comparable
+CONTIGS = Interner()
+ALLELES = Interner()
+
+
+class VariantTable(object):
+    """
+    Variant records sorted by packed key (contig id << 32 | pos), one record
+    per key. Columns: key, depth, genotype, ref, alt (allele ids).
+    """
+
+    def __init__(self, contigs=None, alleles=None):
+        self.contigs = contigs if contigs is not None else CONTIGS
+        self.alleles = alleles if alleles is not None else ALLELES
+        self.keys = array(KEY_TYPECODE)
+        self.depth = array('l')
+        self.genotype = array('B')
+        self.ref = array('l')
+        self.alt = array('l')
+
+    @classmethod
+    def fromRecords(cls, records, contigs=None, alleles=None):
+        """
+        Returns a table built from readVCFQuick-style records
+        ((contig, pos), (depth, alt, ref, genotype)). As with dict(records),
+        the last record wins for duplicate positions.
+        """
+        table = cls(contigs=contigs, alleles=alleles)
+        internContig, internAllele = table.contigs.intern, table.alleles.intern
+        keys, depth, genotype = table.keys, table.depth, table.genotype
+        ref, alt = table.ref, table.alt
+        for (contig, pos), (dp, alt_, ref_, gt) in records:
+            keys.append((internContig(contig) << KEY_SHIFT) | pos)
+            depth.append(dp)
+            genotype.append(gt)
+            ref.append(internAllele(ref_))
+            alt.append(internAllele(alt_))
+        return table._sortUnique()
+
+    @classmethod
+    def fromBuffers(cls, buffers):
+        """
+        Returns a table (with its own dictionaries) from toBuffers() output.
+        """
+        contigNames, alleleNames, columns = buffers
+        table = cls(contigs=Interner(), alleles=Interner())
+        for name in contigNames:
+            table.contigs.intern(name)
+        for name in alleleNames:
+            table.alleles.intern(name)
+        for col in COLUMNS:
+            data = array(getattr(table, col).typecode)
+            frombytes(data, columns[col])
+            setattr(table, col, data)
+        return table
+
+    @classmethod
+    def concatenate(cls, tables, contigs=None, alleles=None):
+        """
+        Returns the union of tables (e.g. parsed from consecutive chunks of
+        one file) mapped onto shared dictionaries. For duplicate positions
+        the record from the later table wins.
+        """
+        table = cls(contigs=contigs, alleles=alleles)
+        for part in tables:
+            contigMap = [table.contigs.intern(name) for name in part.contigs.names]
+            alleleMap = [table.alleles.intern(name) for name in part.alleles.names]
+            for cid, start, end in part.contigRuns():
+                offset = (contigMap[cid] - cid) << KEY_SHIFT
+                table.keys.extend(map(operator.add, part.keys[start:end],
+                                      itertools.repeat(offset, end - start)))
+            table.depth.extend(part.depth)
+            table.genotype.extend(part.genotype)
+            table.ref.extend(map(alleleMap.__getitem__, part.ref))
+            table.alt.extend(map(alleleMap.__getitem__, part.alt))
+        return table._sortUnique()
+
+    def toBuffers(self):
+        """
+        Returns (contig names, allele names, {column: bytes}): a compact,
+        cheaply picklable representation for inter-process transfer.
+        """
+        return (self.contigs.names, self.alleles.names,
+                dict((col, tobytes(getattr(self, col))) for col in COLUMNS))
+
+    def _sortUnique(self):
+        keys = self.keys
+        if all(imap(operator.lt, keys, itertools.islice(keys, 1, None))):
+            # already sorted and unique (e.g. records in file order)
+            return self
+        if all(imap(operator.le, keys, itertools.islice(keys, 1, None))):
+            order = xrange(len(keys))
+        else:
+            # stable sort keeps input order within duplicate keys ...
+            order = array('l', sorted(xrange(len(keys)), key=keys.__getitem__))
+        # ... so that the last of each run of equal keys is kept
+        keep = itertools.chain(imap(operator.ne, imap(keys.__getitem__, order),
+                                    imap(keys.__getitem__, itertools.islice(order, 1, None))),
+                               (True,))
+        return self._take(array('l', itertools.compress(order, keep)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _take(self, indices):
+        """
+        Returns a new table with the rows at indices (in the given order).
+        """
+        table = VariantTable(contigs=self.contigs, alleles=self.alleles)
+        for col in COLUMNS:
+            src = getattr(self, col)
+            setattr(table, col, array(src.typecode, imap(src.__getitem__, indices)))
+        return table
+
+    def _checkCompatible(self, other):
+        if self.contigs is not other.contigs:
+            raise ValueError('VariantTables use different contig dictionaries.')
+        pass
+
+    def filter(self, crit):
+        """
+        Returns the records whose genotype matches (genotype & crit) == crit.
+        """
+        passes = [(g & crit) == crit for g in xrange(GENOTYPE_VALUES)]
+        mask = map(passes.__getitem__, self.genotype)
+        return self._take(list(itertools.compress(xrange(len(self)), mask)))
+
+    def _matchRows(self, other, matched):
+        """
+        Returns generator over the rows of self whose keys do (matched=True)
+        or do not occur in other: a merge join of the sorted key columns that
+        bisects forward from the previous match.
+        """
+        self._checkCompatible(other)
+        otherKeys, index = other.keys, bisect.bisect_left
+        j, m = 0, len(otherKeys)
+        for i, key in enumerate(self.keys):
+            j = index(otherKeys, key, j, m)
+            if (j < m and otherKeys[j] == key) is matched:
+                yield i
+        pass
+
+    def intersection(self, other):
+        """
+        Returns the records of self whose positions also occur in other.
+        """
+        return self._take(array('l', self._matchRows(other, True)))
+
+    def difference(self, other):
+        """
+        Returns the records of self whose positions do not occur in other.
+        """
+        return self._take(array('l', self._matchRows(other, False)))
+
+    def align(self, other):
+        """
+        Returns the records of other at the positions of self
+        (all positions of self must occur in other).
+        """
+        self._checkCompatible(other)
+        index = bisect.bisect_left
+        return other._take([index(other.keys, k) for k in self.keys])
+
+    def contigRuns(self):
+        """
+        Returns generator over (contig id, start, end) row ranges.
+        """
+        return getContigRuns(self.keys)
+
+    def getContigs(self):
+        """
+        Returns the set of contig names with at least one record.
+        """
+        return set(self.contigs.name(cid) for cid, _, _ in self.contigRuns())
+
+    def countPerContig(self):
+        """
+        Returns dictionary {contig: number of records}.
+        """
+        return dict((self.contigs.name(cid), end - start)
+                    for cid, start, end in self.contigRuns())
+
+    def meanDepthPerContig(self):
+        """
+        Returns dictionary {contig: average depth over its records}.
+        """
+        depth = self.depth
+        return dict((self.contigs.name(cid),
+                     sum(depth[start:end]) / float(end - start))
+                    for cid, start, end in self.contigRuns())
+
+    def getRecord(self, i):
+        """
+        Returns row i as ((contig, pos), (depth, alt, ref, genotype)).
+        """
+        key = self.keys[i]
+        return ((self.contigs.name(key >> KEY_SHIFT), key & POS_MASK),
+                (self.depth[i], self.alleles.name(self.alt[i]),
+                 self.alleles.name(self.ref[i]), self.genotype[i]))
+
+    def sortedContigRuns(self):
+        """
+        Returns the (contig id, start, end) row ranges sorted by contig name.
+        """
+        return sorted(self.contigRuns(),
+                      key=lambda run: self.contigs.name(run[0]))
+
+    def iterSorted(self):
+        """
+        Returns generator over the row indices sorted by (contig name, pos).
+        """
+        for cid, start, end in self.sortedContigRuns():
+            for i in xrange(start, end):
+                yield i
+        pass
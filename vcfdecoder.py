@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+import re
+import itertools
+
+from indexedio import readLines
+
+"""
+vcfdecoder - header-driven decoding of VCF sample records
+The sample column is located once from the #CHROM header line, and the
+positions of the GT, DP and AD keys are resolved once per distinct FORMAT
+string and cached, so records of any variant caller decode without
+assumptions on the FORMAT order. Lines are only split as far as the
+sample column. Genotypes are mapped through a precomputed table that
+covers unphased, phased, haploid and multi-allelic calls.
+"""
+
+# bumped whenever decoded records change (cache keys)
+DECODER_VERSION = 2
+
+GTYPE_HOMOZYGOUS_REF = 1
+GTYPE_HOMOZYGOUS_ALT = 2
+GTYPE_HETEROZYGOUS = 4
+GTYPE_UNKNOWN = 8
+
+GT_SEPARATOR = re.compile('[/|]')
+# alleles covered by the precomputed genotype table
+TABLE_ALLELES = [str(i) for i in range(10)] + ['.']
+
+
+def classifyGenotype(gt):
+    """
+    Returns (GTYPE_* flag, allele index of a homozygous ALT call or 0).
+    """
+    alleles = GT_SEPARATOR.split(gt)
+    if '.' in alleles or '' in alleles:
+        return GTYPE_UNKNOWN, 0
+    if alleles.count(alleles[0]) != len(alleles):
+        return GTYPE_HETEROZYGOUS, 0
+    if alleles[0] == '0':
+        return GTYPE_HOMOZYGOUS_REF, 0
+    if not alleles[0].isdigit():
+        return GTYPE_UNKNOWN, 0
+    return GTYPE_HOMOZYGOUS_ALT, int(alleles[0])
+
+
+GENOTYPES = dict((gt, classifyGenotype(gt)) for gt in
+                 TABLE_ALLELES +
+                 ['%s%s%s' % (a, sep, b)
+                  for a, b in itertools.product(TABLE_ALLELES, repeat=2) for sep in '/|'])
+
+
+def getGenotype(gt):
+    """
+    Returns (GTYPE_* flag, homozygous ALT allele index) of a GT value.
+    """
+    genotype = GENOTYPES.get(gt)
+    if genotype is None:
+        genotype = GENOTYPES[gt] = classifyGenotype(gt)
+    return genotype
+
+
+def readSampleNames(fn):
+    """
+    Returns the sample names from the #CHROM line of a VCF ([] if missing).
+    """
+    for line in readLines(fn):
+        if line.startswith('#CHROM'):
+            return line.rstrip('\r\n').split('\t')[9:]
+        if not line.startswith('#'):
+            break
+    return []
+
+
+class VCFDecoder(object):
+    """
+    Decodes PASS records of one sample column into readVCFQuick-style
+    ((contig, pos), (depth, alt, ref, genotype)) records. Depth is the
+    sample's DP, else the sum of its AD, else 0. For homozygous ALT calls
+    at multi-allelic sites, alt is the called allele.
+    """
+
+    def __init__(self, column=9):
+        self.column = column
+        self.layouts = {}
+
+    @classmethod
+    def fromFile(cls, fn, sample=None):
+        """
+        Returns a decoder for the named (default: first) sample of a VCF.
+        """
+        if sample is None:
+            return cls(9)
+        samples = readSampleNames(fn)
+        if sample not in samples:
+            raise ValueError('%s has no sample %s.' % (fn, sample))
+        return cls(9 + samples.index(sample))
+
+    def getLayout(self, format_):
+        """
+        Returns the (GT, DP, AD) indices (None if missing) of a FORMAT string.
+        """
+        layout = self.layouts.get(format_)
+        if layout is None:
+            keys = format_.split(':')
+            layout = self.layouts[format_] = tuple(keys.index(key) if key in keys else None
+                                                   for key in ('GT', 'DP', 'AD'))
+        return layout
+
+    def decode(self, line):
+        """
+        Returns the record of a data line (None for non-PASS records).
+        """
+        return next(self.decodeLines([line]), None)
+
+    def decodeLines(self, lines):
+        """
+        Returns generator over the records of the PASS data lines.
+        """
+        column, layouts, genotypes = self.column, self.layouts, GENOTYPES
+        for line in lines:
+            if line[0] == '#':
+                continue
+            # the sample column keeps the rest of the line
+            fields = line.split('\t', column)
+            if fields[6] != 'PASS' and fields[6].strip() != 'PASS':
+                continue
+            gt, dp, ad = layouts.get(fields[8]) or self.getLayout(fields[8])
+            values = fields[column].split('\t', 1)[0].rstrip('\r\n').split(':')
+            nvalues = len(values)
+            genotype, allele = (genotypes.get(values[gt]) or getGenotype(values[gt])) \
+                if gt is not None and gt < nvalues else (GTYPE_UNKNOWN, 0)
+            if dp is not None and dp < nvalues and values[dp].isdigit():
+                depth = int(values[dp])
+            elif ad is not None and ad < nvalues:
+                depth = sum(int(x) for x in values[ad].split(',') if x.isdigit())
+            else:
+                depth = 0
+            alt = fields[4]
+            if allele and ',' in alt:
+                alts = alt.split(',')
+                if allele <= len(alts):
+                    alt = alts[allele - 1]
+            yield ((fields[0], int(fields[1])), (depth, alt, fields[3], genotype))
+        pass